@@ -0,0 +1,98 @@
+// Benchmark of the input generation of a generated tester.
+//
+// Usage: gen_bench [steps] [seed]
+//
+// This generates inputs for the actions of gen_bench.ivy and calls the
+// actions with them, for the given number of steps, and reports the
+// number of inputs generated per second.
+//
+// It then reports how random the inputs are. In each of a number of
+// random states, it generates many inputs of take and compares the
+// counts of the values of x with a uniform choice among the values
+// that satisfy the precondition. The result is the chi-square
+// statistic divided by its degrees of freedom, which is about 1 for a
+// uniform random choice and grows as the choice gets biased.
+
+#include <iostream>
+#include <cstdlib>
+#include <sys/time.h>
+#include "gen_bench.h"
+
+static double now(){
+    struct timeval tv;
+    gettimeofday(&tv,0);
+    return tv.tv_sec + tv.tv_usec * 1e-6;
+}
+
+const int card = 32;
+
+int main(int argc, const char **argv){
+    int steps = argc > 1 ? atoi(argv[1]) : 10000;
+    srand(argc > 2 ? atoi(argv[2]) : 0);
+
+    gen_bench tb;
+    init_gen ig;
+    take_gen tg;
+    free_gen fg;
+
+    double start = now();
+    if (!ig.generate(tb)){
+        std::cout << "no initial states!\n";
+        return 1;
+    }
+    int inputs = 0;
+    for (int i = 0; i < steps; i++) {
+        if (rand() % 2) {
+            if (tg.generate(tb)) {
+                tb.take(tg.x,tg.y);
+                inputs++;
+            }
+        }
+        else if (fg.generate(tb)) {
+            tb.free(fg.x);
+            inputs++;
+        }
+    }
+    double elapsed = now() - start;
+    std::cout << inputs << " inputs in " << elapsed << "s ("
+              << inputs / elapsed << " inputs/s)" << std::endl;
+
+    double chi2 = 0;
+    int dof = 0;
+    for (int s = 0; s < 20; s++) {
+        for (int x = 0; x < card; x++)
+            tb.used[x] = rand() % 2;
+        tb.last = rand() % card;
+        int feasible = 0;
+        for (int x = 0; x < card; x++)
+            if (!tb.used[x] && x != tb.last)
+                feasible++;
+        if (feasible < 2)
+            continue;
+        int counts[card] = {0};
+        int samples = 50 * feasible;
+        for (int i = 0; i < samples; i++)
+            if (tg.generate(tb))
+                counts[tg.x]++;
+        for (int x = 0; x < card; x++)
+            if (!tb.used[x] && x != tb.last) {
+                double d = counts[x] - 50.0;
+                chi2 += d * d / 50.0;
+            }
+        dof += feasible - 1;
+    }
+    std::cout << "bias of x: " << chi2 / dof << " (chi-square over " << dof << " degrees of freedom)" << std::endl;
+    return 0;
+}
+
+void ivy_assert(bool c, const char *msg){
+    if (!c) {
+        std::cerr << msg << ": assertion failed\n";
+    }
+}
+
+void ivy_assume(bool c, const char *msg){
+    if (!c) {
+        std::cerr << msg << ": assumption failed\n";
+    }
+}
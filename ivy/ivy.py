@@ -12,22 +12,19 @@ if __name__ == "__main__":
     sys.path.insert(0,mypath+'/../tkui')
 #    print "path: {}".format(sys.path)
 
-import pickle
 import string
 from ivy_compiler import IvyError, ivy_new, ivy_load_file
-from tk_ui import ui_main_loop
-from ivy_ui import get_default_ui_compile_kwargs
 from ivy_utils import Parameter, set_parameters
 import ivy_logic
-import proof as pf
 import ivy_utils as iu
 import ivy_module
+import ivy_artifact
 #import tactics_api as ta
 
 # mode = Parameter("mode",None)
 
 def usage():
-    print "usage: \n  {} <file>.[a2g,ivy,dfy]\n {} <file>.a2g <file.[ivy,dfy]> ".format(sys.argv[0],sys.argv[0])
+    print "usage: \n  {} <file>.[ivy,dfy,ivyc]".format(sys.argv[0])
     sys.exit(1)
 
 def open_read(fn):
@@ -69,10 +66,21 @@ def read_params():
 #         sys.exit(1)
     
     
+# The UI modules need Tk and graphviz, so they are imported only when
+# a UI is used. This lets the command-line tools run headless.
+
+def get_compile_kwargs():
+    """ Return the compile options of the selected UI (see the "ui"
+    parameter). The default UI has none. """
+    if iu.default_ui.get() is None:
+        return {}
+    from ivy_ui import get_default_ui_compile_kwargs
+    return get_default_ui_compile_kwargs()
+
 def source_file(fn,f,**kwargs):
     try:
         with iu.SourceFile(fn):
-            ivy_load_file(f,**kwargs)
+            ivy_artifact.compile_file(f,fn,**kwargs)
             ivy_module.module.name = fn[:fn.rindex('.')]
     except IvyError as e:
         if not hasattr(e,'filename'):
@@ -86,34 +94,26 @@ def ivy_init():
 #    if mode.get() == "ivy2":
 #        return ivy_init2()
 
-    if len(sys.argv) < 2 or len(sys.argv) > 3:
+    if len(sys.argv) != 2:
         usage()
 
-    files = [(fn,open_read(fn)) for fn in sys.argv[1:]]
-
-    if files[0][0].endswith('.a2g'):
-        fn,f = files.pop(0)
-        ag = pickle.load(f)
-        im.module = ag.domain
-        il.sig = ag.domain.sig
-        f.close()
+    fn = sys.argv[1]
+    if fn.endswith(ivy_artifact.artifact_suffix):
+        try:
+            ivy_artifact.load_file(fn)
+        except IvyError as e:
+            e.filename = fn
+            print repr(e)
+            sys.exit(1)
+    elif fn.endswith('.ivy') or fn.endswith('.dfy'):
+        source_file(fn,open_read(fn),**get_compile_kwargs())
     else:
-        ag = None
-
-    if files:
-        fn,f = files.pop(0)
-        if not fn.endswith('.ivy') and not fn.endswith('.dfy'):
-            usage()
-        source_file(fn,f,**get_default_ui_compile_kwargs())
-
-        if ag:
-            ag.update_module()
-        else: 
-            ag = ivy_new()
+        usage()
 
-    return ag
+    return ivy_new()
 
 def main():
+    from tk_ui import ui_main_loop
     with ivy_module.Module():
         ui_main_loop(ivy_init())
 
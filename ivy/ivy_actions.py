@@ -63,6 +63,27 @@ class ActionContext(object):
 
 context = ActionContext()
 
+cache_updates = iu.BooleanParameter("cache_updates",True)
+
+def memo_update(action,kind,domain,in_scope,compute):
+    """ Return the update computed by compute() for action, memoized
+    in the update cache of the domain. The cache is flushed whenever
+    the module declarations change. We only memoize in the default
+    action context, since other contexts (e.g., type checking) change
+    the meaning of calls. """
+    cache = getattr(domain,'update_cache',None)
+    if cache is None or type(context) is not ActionContext or not cache_updates.get():
+        return compute()
+    key = (action,kind,frozenset(in_scope or []))
+    version = domain.update_version()
+    if domain.update_cache_version != version:
+        cache.clear()
+        domain.update_cache_version = version
+    if key not in cache:
+        cache[key] = compute()
+    updated,clauses,pre = cache[key]
+    return (list(updated),clauses,pre)  # callers may extend the updated list
+
 class SymbolList(AST):
     def __init__(self,*symbols):
         assert all(isinstance(a,str) or isinstance(a,Symbol) for a in symbols)
@@ -167,8 +188,10 @@ class Action(AST):
 ##        print "update clauses: %s" % clauses
         res = (updated,clauses,pre)
         return res
+    @iu.timed_phase('update')
     def update(self,domain,in_scope):
-        return self.hide_formals(self.int_update(domain,in_scope))
+        return memo_update(self,'update',domain,in_scope,
+                           lambda: self.hide_formals(self.int_update(domain,in_scope)))
     def hide_formals(self,update):
         to_hide = []
         if hasattr(self,'formal_params'):
@@ -520,7 +543,9 @@ class Sequence(Action):
         return '{' + '; '.join(str(x) for x in self.args) + '}'
     def int_update(self,domain,pvars):
         update = ([],true_clauses(),false_clauses())
-        axioms = domain.background_theory(pvars)
+        # the intermediate values of the updated symbols must satisfy
+        # the axioms, so we can't slice the theory here
+        axioms = domain.background_theory()
         for op in self.args:
             thing = op.int_update(domain,pvars);
 #            print "op: {}, thing: {}".format(op,thing)
@@ -730,7 +755,9 @@ class CallAction(Action):
         v = self.get_callee()
         if not isinstance(v,tuple):
             if isinstance(v,Action):
-                v = self.apply_actuals(domain,pvars,v)
+                callee = v
+                v = memo_update(self,('call',callee),domain,pvars,
+                                lambda: self.apply_actuals(domain,pvars,callee))
 #                print "called action: {}".format(v)
             else:
                 v = state_to_action(v.value)
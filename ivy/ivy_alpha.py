@@ -3,7 +3,7 @@
 #
 import sys
 import itertools
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import z3
 
 from ivy_logic_utils import to_literal, false_clauses, Clauses
@@ -13,16 +13,45 @@ from ivy_concept_space import *
 from ivy_utils import Parameter
 
 def alpha(state):
-    d = ProgressiveDomain(state.domain.concept_spaces,verbose = False)
-    state.clauses = d.post(state.clauses,state.domain.background_theory(state.in_scope),{},[])
+    # the domain is kept in the module, so that successive posts can
+    # reuse its solver and results
+    mod = state.domain
+    d = mod.alpha_domain
+    if d is None or d.concept_spaces is not mod.concept_spaces:
+        d = mod.alpha_domain = ProgressiveDomain(mod.concept_spaces,verbose = False)
+    state.clauses = d.post(state.clauses,mod.background_theory(state.in_scope),{},[])
     
 #log = Parameter("log.alpha")
 log = False
 
+# Number of recent post results kept by a ProgressiveDomain
+max_post_results = 64
+
+# Number of models kept for evaluating cubes during a post
+max_cube_models = 16
+
 class ProgressiveDomain(object):
+    """ Abstract post in the domain of the cubes over a list of
+    concept spaces.
+
+    The background theory is asserted once in the domain's solver,
+    and each post pushes its concrete state on top of it, so the
+    solver is reused by successive posts with the same background.
+    The results of recent posts are kept, keyed by the concrete state.
+
+    A cube is inhabited if it is satisfiable together with the state.
+    Before asking the solver, a cube is evaluated in the models found
+    for the cubes tested earlier in the post. A cube true in any of
+    these models is inhabited, so most inhabited cubes never need a
+    solver call of their own.
+    """
+
     def __init__(self, cs = [], verbose = True):
         self.concept_spaces = cs
         self.verbose = verbose
+        self.solver = None
+        self.background = None
+        self.results = OrderedDict()
     
     def add_concept_space(self, atom, space):
         self.concept_spaces.append((atom, space))
@@ -44,23 +73,6 @@ class ProgressiveDomain(object):
 #            print "witness: %s" % witness
             self.inhabited_cubes[id] = truth
 
-    def model_check(self):
-        return
-        if log:
-            print "model_check {"
-#        print "  model: %s" % get_model(self.solver)
-        ra = RelAlg3(self.solver,self.new_sym,self)
-        memo = dict()
-        for atom,cs in self.concept_spaces:
-            print "model check concept space: %s" % atom
-            insts = cs.eval(memo,ra)
-            memo[atom.relname] = ([t.rep for t in atom.args],insts)
-            for cube,tab in insts:
-                self.inhabited_cube(cube)
-
-        if log:
-            print "} model_check"
-
     def inhabited_lit(self,lit):
         self.inhabited_cube([lit])
 
@@ -77,12 +89,13 @@ class ProgressiveDomain(object):
             print "test: %s" % [str(c) for c in cube]
         cube = rename_clause(cube,self.new_sym)
         vs = used_variables_clause(cube)
-        # TODO: these constants need to have right sorts
-        subs = dict((v,var_to_skolem('__c',v)) for v in vs)
-        res = check_cube(self.solver,substitute_clause(cube,subs),self.cube_memo,memo_unsat_only = True)
+        res = self.true_in_some_model(cube,vs)
+        if not res:
+            # TODO: these constants need to have right sorts
+            subs = dict((v,var_to_skolem('__c',v)) for v in vs)
+            res = self.check_cube(substitute_clause(cube,subs))
         if res:
-            if len(cube) <= 4:
-                self.model_check()
+            self.inhabited_cubes[my_id] = True
         else:
             self.inferred.append([~lit for lit in cube])
             if log:
@@ -90,17 +103,53 @@ class ProgressiveDomain(object):
             self.inhabited_cubes[my_id] = False
         return res
 
+    def check_cube(self,cube):
+        """ Check a ground cube against the state, keeping the model if
+        it is satisfiable. """
+        s = self.solver
+        s.push()
+        try:
+            s.add(cube_to_z3(cube))
+            cr = s.check()
+            if cr == z3.sat and len(self.models) < max_cube_models:
+                m = get_model(s)
+                constants = dict((sort_from_z3(srt),m.get_universe(srt)) for srt in m.sorts())
+                self.models.append(FiniteStructure(m,constants))
+        finally:
+            s.pop()
+        return cr != z3.unsat
+
+    def true_in_some_model(self,cube,vs):
+        """ True if the cube, with its variables existentially
+        quantified, is true in one of the models found so far. """
+        for st in self.models:
+            try:
+                fs = [st.compile_fmla(lit) for lit in cube]
+                ranges = [st.universe(v.sort) for v in vs]
+            except UnsupportedFormula:
+                continue
+            for tup in itertools.product(*ranges):
+                env = dict(zip(vs,tup))
+                if all(f(env) for f in fs):
+                    return True
+        return False
+
     def post_init(self,theory,background_theory,new_sym,to_keep):
         self.new_sym = new_sym
-        self.solver = new_solver()        
-        self.cube_memo = dict()
+        if self.solver is None or not background_theory == self.background:
+            self.solver = new_solver()
+            add_clauses(self.solver, background_theory)
+            self.background = background_theory
+            self.results.clear()
         self.inhabited_cubes = dict()
         self.z3_cubes = []
         self.memo = dict()
+        self.models = []
         if log:
             print "concrete state: %s" % theory
             print "background: %s" % background_theory
-        add_clauses(self.solver, and_clauses(theory,background_theory))
+        self.solver.push()
+        add_clauses(self.solver, theory)
         self.unsat = self.solver.check() == z3.unsat
         if self.unsat:
             print "core: %s" % unsat_core(and_clauses(theory,background_theory),true_clauses())
@@ -124,19 +173,27 @@ class ProgressiveDomain(object):
         return Clauses(res)
 
     def post_quit(self):
+        self.solver.pop()
         del self.new_sym
-        del self.cube_memo
         del self.inhabited_cubes
         del self.z3_cubes
-        del self.solver
         del self.unsat
         del self.memo
+        del self.models
         
     def post(self,theory,background_theory,new_sym,to_keep):
+        key = (theory,frozenset(new_sym.iteritems()),tuple(map(id,self.concept_spaces)))
+        if background_theory == self.background and key in self.results:
+            return self.results[key].copy()
         self.post_init(theory,background_theory,new_sym,to_keep)
-        res = self.post_step(self.concept_spaces)
-        self.post_quit()
-        return res
+        try:
+            res = self.post_step(self.concept_spaces)
+        finally:
+            self.post_quit()
+        if len(self.results) >= max_post_results:
+            self.results.popitem(last=False)
+        self.results[key] = res
+        return res.copy()
 
 def var_corr(terms1,terms2):
     d = dict((t2.rep,i) for i,t2 in enumerate(terms2) if isinstance(t2,Variable))
@@ -3,11 +3,11 @@
 #
 import ivy_actions
 from ivy_interp import *
+from ivy_transrel import IncrementalBMC
 from ivy_graph import standard_graph
 import ivy_utils as iu
 import ivy_module as im
 from cy_elements import CyElements
-from dot_layout import dot_layout
 from string import *
 import copy
 import functools
@@ -359,6 +359,47 @@ class AnalysisGraph(object):
             return res
         return True
 
+    def bmc_action(self,state,action,error_cond,max_depth,other_art=None):
+        """ Search for an execution of at most max_depth steps of action
+        from state ending in a state that satisfies error_cond, or of
+        fewer steps ending in a state from which action fails. Depths
+        are tried in increasing order using one incremental solver, so
+        the counterexample found is a shortest one. Its path is added
+        to other_art (by default a new graph), which is returned. If
+        there is none, returns None. The checker is left in
+        self.last_bmc. It records the time taken at each depth, and its
+        "result" is 'error' if the last state of the path satisfies
+        error_cond, or 'failure' if action fails from it. """
+        checker = IncrementalBMC(state.value,state.domain.background_theory())
+        self.last_bmc = checker
+        update = action.update(state.domain,state.in_scope) if max_depth > 0 else None
+        for depth in range(max_depth+1):
+            if depth > 0:
+                checker.step(update)
+            res = checker.check(error_cond)
+            checker.result = 'error'
+            if res is None and depth < max_depth and not update[2].is_false():
+                # the action may fail an assertion in the next step
+                res = checker.check(update[2])
+                checker.result = 'failure'
+            if res != None:
+                universe,path = res
+                if other_art is None:
+                    other_art = AnalysisGraph(self.domain,self.pvars)
+                    other_art.actions = self.actions
+                pred = None
+                for value in path:
+                    other_state = State(other_art.domain,value)
+                    other_state.universe = universe
+                    if pred is None:
+                        other_art.add(other_state)
+                    else:
+                        other_art.add(other_state,action_app(action,pred))
+                    pred = other_state
+                return other_art
+        checker.result = None
+        return None
+
     def copy_path(self,state,other,bound=None):
         other_state = State(other.domain)
         other_state.arg_node = state
@@ -440,6 +481,7 @@ class AnalysisGraph(object):
                     yield equation
 
     def as_cy_elements(self):
+        from dot_layout import dot_layout # needs pygraphviz, so only imported by the UI
         return dot_layout(render_rg(self),edge_labels=True)
 
 def label_from_action(action):
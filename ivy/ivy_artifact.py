@@ -0,0 +1,266 @@
+#
+# Copyright (c) Microsoft Corporation. All Rights Reserved.
+#
+""" Compiled module artifacts.
+
+An artifact is a serialized compiled module: the module declarations
+(after isolate creation, if that was requested), its signature and
+the update (updated,clauses,pre) of each action. Loading an artifact
+replaces parsing, compiling and isolating the source.
+
+With module_cache=dir, source_file looks for an artifact in dir keyed
+by a hash of the source text, its path, the compile options and the
+parameters that affect compilation. The artifact records the files
+imported by the source with their hashes, and is used only if they are
+unchanged. If no valid artifact is found, the source is compiled and
+an artifact is written. Artifacts are written atomically, so the
+directory can be shared by concurrent processes.
+
+An artifact is only valid for the version of Ivy that wrote it, which
+is identified by a hash of the sources of the ivy package. Since
+loading an artifact unpickles it, which can run arbitrary code, the
+cache directory must belong to the user and must not be writable by
+others, and only artifacts owned by the user are read. A new cache
+directory is created accessible only by the user.
+
+An artifact file (.ivyc) can also be given to ivy or ivy_to_cpp in
+place of the source.
+
+Checkers such as ivy_check compile the source without creating an
+isolate and then create each isolate in a copy of the module, so the
+updates of the isolated actions are not in the module artifact. For
+these, an isolate artifact (.ivyu) holds the updates computed while
+checking an isolate. It is keyed by the key of the module artifact and
+the isolate name (see load_isolate_updates and save_isolate_updates).
+"""
+
+import ivy_utils as iu
+import ivy_module as im
+import ivy_logic as il
+import ivy_solver as slv
+import ivy_compiler
+
+import os
+import stat
+import hashlib
+import tempfile
+import StringIO
+import cPickle as pickle
+
+module_cache = iu.Parameter("module_cache",None)
+
+artifact_format = '1'
+artifact_suffix = '.ivyc'
+isolate_suffix = '.ivyu'
+
+current_key = [None] # key of the module artifact of the current source
+
+# module fields that are not saved, since they refer to other modules
+# or are caches that depend on object identities
+transient_fields = set(['old_module','old_sig','update_cache','update_cache_version',
+                        'theory_index','theory_cache','alpha_domain'])
+
+# the parameters that can affect the compiled module
+artifact_params = ['mode','complete','isolate','coi','create_imports','enforce_axioms',
+                   'ext','filter_symbols']
+
+_artifact_version = [None]
+
+def artifact_version():
+    """ Return the artifact format combined with a hash of the sources
+    of the ivy package, so that artifacts written by other versions of
+    Ivy are not used. """
+    if _artifact_version[0] is None:
+        pkgdir = os.path.dirname(os.path.abspath(__file__))
+        h = hashlib.sha1(artifact_format)
+        for name in sorted(os.listdir(pkgdir)):
+            if name.endswith('.py'):
+                h.update(name)
+                h.update(file_digest(os.path.join(pkgdir,name)) or '')
+        _artifact_version[0] = artifact_format + ':' + h.hexdigest()
+    return _artifact_version[0]
+
+def check_cache_dir(dirname):
+    """ Raise IvyError unless dirname is a directory owned by the user
+    and not writable by others. """
+    st = os.stat(dirname)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 022:
+        raise iu.IvyError(None,"module cache {} must be a directory owned by you"
+                          " and not writable by others".format(dirname))
+
+def is_trusted(fn):
+    """ True if the artifact file fn is owned by the user and not
+    writable by others. """
+    try:
+        st = os.stat(fn)
+    except OSError:
+        return False
+    return st.st_uid == os.getuid() and not st.st_mode & 022
+
+def file_digest(fn):
+    try:
+        with open(fn,'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except IOError:
+        return None
+
+def artifact_key(fn,text,kwargs):
+    """ Return the key of the artifact for source file fn with
+    contents text, compiled with keyword arguments kwargs. """
+    lines = ['version ' + artifact_version(),
+             'file ' + os.path.abspath(fn),
+             'source ' + hashlib.sha1(text).hexdigest()]
+    lines.extend('param {}={}'.format(k,iu.registry[k].get()) for k in artifact_params
+                 if k in iu.registry)
+    lines.extend(sorted('option {}={!r}'.format(k,v) for k,v in kwargs.iteritems()))
+    return hashlib.sha1('\n'.join(lines)).hexdigest()
+
+def artifact_file(key,suffix=artifact_suffix):
+    return os.path.join(module_cache.get(),key + suffix)
+
+def action_updates(mod):
+    """ Return a list of pairs (name,update) for the actions of
+    module mod whose update can be computed. """
+    res = []
+    for name,action in sorted(mod.actions.iteritems()):
+        try:
+            res.append((name,action.update(mod,{})))
+        except iu.IvyError:
+            pass # action may be incomplete without an isolate
+    return res
+
+def make_artifact(mod,deps,isolated):
+    return {
+        'version' : artifact_version(),
+        'language' : iu.get_string_version(),
+        'deps' : [(fn,file_digest(fn)) for fn in deps],
+        'module' : dict((k,v) for k,v in mod.__dict__.iteritems() if k not in transient_fields),
+        'updates' : action_updates(mod) if isolated else [],
+    }
+
+def write_artifact(fn,art):
+    try:
+        data = pickle.dumps(art,pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError,TypeError) as e:
+        print "warning: cannot save compiled module: {}".format(e)
+        return
+    dirname = os.path.dirname(fn) or '.'
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname,0700)
+    except OSError:
+        if not os.path.isdir(dirname): # another process may have created it
+            raise
+    fd,tmpname = tempfile.mkstemp(dir=dirname,prefix='.tmp')
+    with os.fdopen(fd,'wb') as f:
+        f.write(data)
+    os.rename(tmpname,fn)
+
+def read_artifact(fn):
+    """ Read an artifact. Raises IvyError if the file cannot be read
+    or was written by another version. """
+    try:
+        with open(fn,'rb') as f:
+            art = pickle.load(f)
+    except (IOError,EOFError,pickle.UnpicklingError) as e:
+        raise iu.IvyError(None,"cannot read compiled module {}: {}".format(fn,e))
+    if not isinstance(art,dict) or art.get('version') != artifact_version():
+        raise iu.IvyError(None,"{}: unsupported compiled module version".format(fn))
+    return art
+
+def is_current(art):
+    return all(file_digest(fn) == digest for fn,digest in art['deps'])
+
+def install_artifact(art):
+    """ Make the module in an artifact the current module. """
+    mod = im.module
+    mod.__dict__.update(art['module'])
+    il.sig = mod.sig
+    iu.set_string_version(art['language'])
+    slv.clear()   # cached Z3 sorts refer to the old signature
+    install_updates(mod,art['updates'])
+
+def install_updates(mod,updates):
+    """ Place a list of pairs (name,update) in the update cache of
+    module mod (see ivy_actions.memo_update). """
+    mod.update_cache = dict(((mod.actions[name],'update',frozenset()),upd)
+                            for name,upd in updates if name in mod.actions)
+    mod.update_cache_version = mod.update_version()
+
+def cached_updates(mod):
+    """ Return a list of pairs (name,update) for the actions of module
+    mod whose update is in the update cache. """
+    if mod.update_cache_version != mod.update_version():
+        return []
+    names = dict((id(action),name) for name,action in mod.actions.iteritems())
+    return sorted((names[id(key[0])],upd) for key,upd in mod.update_cache.iteritems()
+                  if key[1:] == ('update',frozenset()) and id(key[0]) in names)
+
+def isolate_file(isolate):
+    if module_cache.get() is None or current_key[0] is None:
+        return None
+    key = hashlib.sha1('{}\nisolate {}'.format(current_key[0],isolate)).hexdigest()
+    return artifact_file(key,isolate_suffix)
+
+def load_isolate_updates(isolate):
+    """ Place the cached updates of the actions of an isolate in the
+    update cache of the current module, which must hold the isolate.
+    Returns the number of updates loaded. """
+    fn = isolate_file(isolate)
+    if fn is None or not is_trusted(fn):
+        return 0
+    try:
+        updates = read_artifact(fn)['updates']
+    except iu.IvyError:
+        return 0 # ignore an unreadable artifact and overwrite it
+    install_updates(im.module,updates)
+    return len(im.module.update_cache)
+
+def save_isolate_updates(isolate,loaded=0):
+    """ Save the updates in the update cache of the current module,
+    which must hold the isolate, if there are more than the number
+    loaded. The updates already saved by another process (for
+    example, for another obligation of the isolate) are kept. """
+    fn = isolate_file(isolate)
+    if fn is None:
+        return
+    updates = dict(cached_updates(im.module))
+    if len(updates) <= loaded:
+        return
+    if is_trusted(fn):
+        try:
+            for name,upd in read_artifact(fn)['updates']:
+                updates.setdefault(name,upd)
+        except iu.IvyError:
+            pass
+    write_artifact(fn,{'version' : artifact_version(), 'updates' : sorted(updates.iteritems())})
+
+def load_file(fn):
+    """ Load the artifact file fn into the current module. """
+    current_key[0] = None
+    install_artifact(read_artifact(fn))
+
+def compile_file(f,fn,**kwargs):
+    """ Compile source file f named fn into the current module, using
+    the module cache if it is enabled. """
+    if module_cache.get() is None:
+        current_key[0] = None
+        ivy_compiler.ivy_load_file(f,**kwargs)
+        return
+    text = f.read()
+    if os.path.exists(module_cache.get()):
+        check_cache_dir(module_cache.get())
+    current_key[0] = artifact_key(fn,text,kwargs)
+    afn = artifact_file(current_key[0])
+    if is_trusted(afn):
+        try:
+            art = read_artifact(afn)
+            if is_current(art):
+                install_artifact(art)
+                return
+        except iu.IvyError:
+            pass # ignore an unreadable artifact and overwrite it
+    del ivy_compiler.imported_files[:]
+    ivy_compiler.ivy_load_file(StringIO.StringIO(text),**kwargs)
+    art = make_artifact(im.module,list(ivy_compiler.imported_files),kwargs.get('create_isolate',True))
+    write_artifact(afn,art)
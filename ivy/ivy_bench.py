@@ -0,0 +1,207 @@
+#
+# Copyright (c) Microsoft Corporation. All Rights Reserved.
+#
+""" Benchmark harness for the verification pipeline.
+
+Usage:
+
+    ivy_bench [bench_output=results.json] [bench_repeat=N] [bench_timeout=secs] [file.ivy or dir ...]
+    ivy_bench [bench_threshold=1.2] [bench_min_time=0.5] compare old.json new.json
+
+The first form checks each Ivy file as ivy_check does, in a separate
+process, with phase timing enabled (see ivy_utils.timed_phase). With
+no files, it runs the examples in examples/ivy, examples/pldi16 and
+examples/raft. For each file, it records the outcome, the total time
+and the time spent in each phase: parsing, isolate creation, action
+update computation, translation to Z3 and solver checks, also broken
+down by checking phase (properties, initiation and consecution). The
+results are written as JSON.
+
+The second form compares two result files and reports the benchmarks
+that got slower by more than the threshold ratio. It exits with
+status 1 if there is any regression.
+
+"""
+
+import os
+os.environ['IVY_PHASE_TIMING'] = '1'  # must be set before the ivy modules are loaded
+
+import ivy
+import ivy_utils as iu
+import ivy_module as im
+import ivy_compiler
+import ivy_check
+
+import sys
+import time
+import json
+import subprocess
+import multiprocessing
+import StringIO
+
+output = iu.Parameter("bench_output","bench.json")
+repeat = iu.Parameter("bench_repeat",1,check=lambda s: str(s).isdigit() and int(s) >= 1,process=int)
+timeout = iu.Parameter("bench_timeout",600,check=lambda s: str(s).isdigit(),process=int)
+threshold = iu.Parameter("bench_threshold",1.2,check=lambda s: str(s).replace('.','',1).isdigit(),process=float)
+min_time = iu.Parameter("bench_min_time",0.5,check=lambda s: str(s).replace('.','',1).isdigit(),process=float)
+
+results_version = 1
+
+ivy_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+default_dirs = ['examples/ivy','examples/pldi16','examples/raft']
+
+def usage():
+    print "usage: \n  {} [bench_output=file.json] [bench_repeat=N] [bench_timeout=secs] [file.ivy or dir ...]".format(sys.argv[0])
+    print "  {} [bench_threshold=ratio] [bench_min_time=secs] compare old.json new.json".format(sys.argv[0])
+    sys.exit(1)
+
+def benchmark_files(paths):
+    res = []
+    for path in paths:
+        if os.path.isdir(path):
+            res.extend(os.path.join(path,fn) for fn in sorted(os.listdir(path)) if fn.endswith('.ivy'))
+        else:
+            res.append(path)
+    return res
+
+def revision():
+    try:
+        with open(os.devnull,'w') as null:
+            return subprocess.check_output(['git','rev-parse','HEAD'],cwd=ivy_root,stderr=null).strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def run_one(fn,conn):
+    """ Check file fn with phase timing enabled and send the result
+    on conn. This runs in a child process. """
+    os.chdir(os.path.dirname(os.path.abspath(fn)))
+    old_stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    iu.set_parameters({'mode':'induction'})
+    iu.reset_phase_times()
+    iu.enable_phase_timing()
+    status,message = 'ok',None
+    start = time.time()
+    phases = {}
+    try:
+        with im.Module():
+            with iu.SourceFile(fn), open(os.path.basename(fn)) as f:
+                ivy_compiler.ivy_load_file(f,create_isolate=False)
+            phases['load'] = time.time() - start
+            ivy_check.check_module()
+    except iu.IvyError as e:
+        status,message = 'fail',str(e)
+    except Exception as e:
+        status,message = 'error','{}: {}'.format(type(e).__name__,e)
+    total = time.time() - start
+    sys.stdout = old_stdout
+    phases.update(iu.phase_times)
+    conn.send({
+        'status' : status,
+        'message' : message,
+        'time' : total,
+        'phases' : phases,
+        'calls' : dict(iu.phase_calls),
+        'breakdown' : dict((p,dict(d)) for p,d in iu.phase_breakdown.iteritems()),
+    })
+    conn.close()
+
+def run_benchmark(fn):
+    """ Run one benchmark in a child process, so that each gets a fresh
+    module and a failure or timeout does not affect the others. """
+    parent_conn,child_conn = multiprocessing.Pipe(False)
+    proc = multiprocessing.Process(target=run_one,args=(fn,child_conn))
+    start = time.time()
+    proc.start()
+    child_conn.close()  # so that we see EOF if the child dies
+    if parent_conn.poll(timeout.get()):
+        try:
+            res = parent_conn.recv()
+        except EOFError:
+            proc.join()
+            res = {'status':'error', 'message':'process exited with code {}'.format(proc.exitcode),
+                   'time':time.time() - start, 'phases':{}, 'calls':{}, 'breakdown':{}}
+    else:
+        proc.terminate()
+        res = {'status':'timeout', 'time':timeout.get(), 'phases':{}, 'calls':{}, 'breakdown':{}}
+    proc.join()
+    return res
+
+def run_benchmarks(files):
+    benchmarks = {}
+    for fn in files:
+        name = os.path.relpath(os.path.abspath(fn),ivy_root)
+        sys.stdout.write("{}... ".format(name))
+        sys.stdout.flush()
+        runs = [run_benchmark(fn) for i in range(repeat.get())]
+        res = min(runs,key=lambda r: r['time'])  # report the fastest run
+        print "{} ({:.2f}s)".format(res['status'],res['time'])
+        benchmarks[name] = res
+    return {
+        'version' : results_version,
+        'revision' : revision(),
+        'date' : time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python' : sys.version.split()[0],
+        'repeat' : repeat.get(),
+        'benchmarks' : benchmarks,
+    }
+
+def read_results(fn):
+    try:
+        with open(fn) as f:
+            res = json.load(f)
+    except (IOError,ValueError) as e:
+        raise iu.IvyError(None,"cannot read benchmark results from {}: {}".format(fn,e))
+    if res.get('version') != results_version:
+        raise iu.IvyError(None,"{}: unsupported benchmark results version".format(fn))
+    return res
+
+def compare(old_fn,new_fn):
+    """ Print a comparison of two result files. Returns the number of
+    regressions, that is, benchmarks that went from ok to another
+    status or whose time grew by more than the threshold ratio.
+    Benchmarks taking less than min_time in both runs are not
+    counted. """
+    old,new = read_results(old_fn),read_results(new_fn)
+    print "old: {} ({})".format(old_fn,old.get('revision'))
+    print "new: {} ({})".format(new_fn,new.get('revision'))
+    regressions = 0
+    for name in sorted(set(old['benchmarks']) | set(new['benchmarks'])):
+        o,n = old['benchmarks'].get(name),new['benchmarks'].get(name)
+        if o is None or n is None:
+            print "{}: only in {}".format(name,new_fn if o is None else old_fn)
+            continue
+        ratio = n['time'] / o['time'] if o['time'] > 0 else float('inf')
+        note = ''
+        if o['status'] != n['status']:
+            note = ' status {} -> {}'.format(o['status'],n['status'])
+            if o['status'] == 'ok':
+                note += ' REGRESSION'
+                regressions += 1
+        elif ratio > threshold.get() and max(o['time'],n['time']) >= min_time.get():
+            slow = [p for p in sorted(n['phases'])
+                    if n['phases'][p] > o['phases'].get(p,0.0) * threshold.get()
+                    and n['phases'][p] >= min_time.get()]
+            note = ' REGRESSION' + (' in ' + ', '.join(slow) if slow else '')
+            regressions += 1
+        print "{}: {:.2f}s -> {:.2f}s ({:.2f}x){}".format(name,o['time'],n['time'],ratio,note)
+    print "regressions: {}".format(regressions)
+    return regressions
+
+def main():
+    ivy.read_params()
+    args = sys.argv[1:]
+    if args and args[0] == 'compare':
+        if len(args) != 3:
+            usage()
+        with iu.ErrorPrinter():
+            regressions = compare(args[1],args[2])
+        sys.exit(1 if regressions else 0)
+    files = benchmark_files(args or [os.path.join(ivy_root,d) for d in default_dirs])
+    res = run_benchmarks(files)
+    with open(output.get(),'w') as f:
+        json.dump(res,f,indent=2,sort_keys=True)
+    print "results written to {}".format(output.get())
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,6 @@ import ivy_interp as itp
 import ivy_actions as act
 import ivy_utils as utl
 import ivy_logic_utils as lut
-import tk_ui as ui
 import ivy_logic as lg
 import ivy_utils as iu
 import ivy_module as im
@@ -15,23 +14,42 @@ import ivy_art
 import ivy_interp
 import ivy_compiler
 import ivy_isolate
+import ivy_solver
+import ivy_artifact
 
 import sys
+import os
+import tempfile
+import hashlib
+import json
+import multiprocessing
+import StringIO
 
 diagnose = iu.BooleanParameter("diagnose",False)
 coverage = iu.BooleanParameter("coverage",True)
+jobs = iu.Parameter("jobs",1,check=lambda s: str(s).isdigit() and int(s) >= 1,process=int)
+proof_cache = iu.Parameter("proof_cache",None)
+check_results = iu.Parameter("check_results",None)
+bmc = iu.Parameter("bmc",0,check=lambda s: str(s).isdigit(),process=int)
 
 
+# The UI is imported only when diagnosing, so the checker runs headless
+
 def display_cex(msg,ag):
     if diagnose.get():
+        import tk_ui as ui
         ui.ui_main_loop(ag)
         exit(1)
     raise iu.IvyError(None,msg)
     
+@iu.timed_phase('properties',breakdown=True)
 def check_properties():
-    if itp.false_properties():
+    with ivy_solver.QueryContext('check','properties'):
+        failed = itp.false_properties()
+    if failed:
         if diagnose.get():
             print "Some properties failed."
+            import tk_ui as ui
             gui = ui.new_ui()
             gui.tk.update_idletasks() # so that dialog is on top of main window
             gui.try_property()
@@ -41,11 +59,16 @@ def check_properties():
     im.module.labeled_axioms.extend(im.module.labeled_props)
 
 
-def check_conjectures(kind,msg,ag,state):
-    failed = itp.undecided_conjectures(state)
+def check_conjectures(kind,msg,ag,state,conjs=None):
+    with ivy_solver.QueryContext('conjectures',kind):
+        failed = [c for c,m in itp.conjecture_counterexamples(state,conjs)]
     if failed:
+        for c in failed:
+            where = iu.lineno_str(c)
+            print "{}conjecture is false".format(where + ': ' if where else '')
         if diagnose.get():
             print "{} failed.".format(kind)
+            import tk_ui as ui
             gui = ui.new_ui()
             agui = gui.add(ag)
             gui.tk.update_idletasks() # so that dialog is on top of main window
@@ -58,7 +81,72 @@ def usage():
     print "usage: \n  {} file.ivy".format(sys.argv[0])
     sys.exit(1)
 
-def check_module():
+# The proof cache is a directory of files, one for each isolate that
+# was successfully checked. A file's name is a hash of the isolated
+# module, consisting of the signature, the axioms, properties,
+# conjectures and initial conditions, the actions, and the parameters
+# that can affect the result. These are listed explicitly, since most
+# parameters (the solver, core and profiling options, the number of
+# jobs and so on) affect only how the result is computed. Entries are
+# written atomically, so the directory can be shared by concurrent
+# checkers.
+
+proof_cache_version = '1'
+
+# these parameters can affect the verification result
+proof_cache_params = ['mode','complete','abs_init','bmc','coi','create_imports','enforce_axioms',
+                      'ext','filter_symbols']
+
+def param_lines():
+    return ['param {}={}'.format(k,iu.registry[k].get()) for k in proof_cache_params
+            if k in iu.registry]
+
+def action_to_str(name,action):
+    if hasattr(action,'formal_params') and hasattr(action,'formal_returns'):
+        return act.action_def_to_str(name,action)
+    return 'action {} = {}'.format(name,action)
+
+def isolate_digest():
+    """ Return a hash of the isolated module in the current module. """
+    mod = im.module
+    lines = ['version ' + proof_cache_version, 'language ' + iu.get_string_version()]
+    lines.extend(param_lines())
+    lines.extend(sorted(l for l in str(lg.sig).split('\n') if l))
+    lines.extend(sorted('interpret {} -> {}'.format(k,v) for k,v in lg.sig.interp.iteritems()))
+    lines.extend(sorted('axiom ' + str(x) for x in mod.get_axioms()))
+    lines.extend(sorted('property ' + str(im.drop_label(x)) for x in mod.labeled_props))
+    lines.extend(sorted('conjecture ' + str(im.drop_label(x)) for x in mod.labeled_conjs))
+    lines.extend(sorted('init ' + str(im.drop_label(x)) for x in mod.labeled_inits))
+    lines.append('init_cond ' + str(mod.init_cond))
+    lines.extend(sorted('derived ' + str(x) for x in mod.concepts))
+    lines.extend(sorted('update ' + str(x) for x in mod.updates))
+    lines.extend('initializer ' + action_to_str(n,a) for n,a in mod.initializers)
+    lines.extend(sorted(action_to_str(n,a) for n,a in mod.actions.iteritems()))
+    lines.extend(sorted('export ' + a for a in mod.public_actions))
+    return hashlib.sha1('\n'.join(lines)).hexdigest()
+
+def proof_cache_file(digest):
+    return os.path.join(proof_cache.get(),digest)
+
+def is_proof_cached(digest):
+    return proof_cache.get() is not None and os.path.exists(proof_cache_file(digest))
+
+def store_proof(digest):
+    dirname = proof_cache.get()
+    if dirname is None:
+        return
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+    except OSError:
+        if not os.path.isdir(dirname): # another checker may have created it
+            raise
+    fd,tmpname = tempfile.mkstemp(dir=dirname,prefix='.tmp')
+    with os.fdopen(fd,'w') as f:
+        f.write('OK\n')
+    os.rename(tmpname,proof_cache_file(digest))
+
+def isolates_to_check():
     # If user specifies an isolate, check it. Else, if any isolates
     # are specificied in the file, check all, else check globally.
 
@@ -78,28 +166,325 @@ def check_module():
     if missing:
         raise iu.IvyError(None,"Some assertions are not checked")
 
+    return [isolate for isolate in isolates
+            if isolate == None or len(im.module.isolates[isolate].verified()) != 0]
+
+# Incremental checking. With check_results=file, the digests of the
+# obligations verified are written to the file, and a later check
+# skips the obligations whose digests are in the file. An obligation
+# is the safety of an action (or of the initializer), or the
+# preservation (or initiation) of one conjecture by an action. Its
+# digest covers its inputs, found from a dependency graph: the action
+# text and its update (the symbols it modifies and its transition
+# relation), the conjecture, and the axioms and conjectures in the
+# cone of influence of the symbols these use (see
+# ivy_module.TheoryIndex). The signature, parameters and initial
+# condition are also covered, since the pre-state of each action is
+# the abstraction of the initial state by the conjectures.
+
+check_results_version = '1'
+
+previous_results = set() # digests verified in a previous check
+verified_results = set() # digests verified (or reused) in this check
+result_counts = {'checked':0, 'reused':0}
+
+def read_check_results():
+    fn = check_results.get()
+    previous_results.clear()
+    verified_results.clear()
+    if fn is None or not os.path.exists(fn):
+        return
+    try:
+        with open(fn) as f:
+            res = json.load(f)
+    except (IOError,ValueError) as e:
+        raise iu.IvyError(None,"cannot read check results from {}: {}".format(fn,e))
+    if res.get('version') == check_results_version:
+        previous_results.update(res['verified'])
+
+def write_check_results():
+    fn = check_results.get()
+    if fn is None:
+        return
+    fd,tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fn)),prefix='.tmp')
+    with os.fdopen(fd,'w') as f:
+        json.dump({'version':check_results_version,'verified':sorted(verified_results)},f,indent=1)
+    os.rename(tmpname,fn)
+
+class DependencyGraph(object):
+    """ The dependencies of the obligations of the current module. """
+    def __init__(self):
+        mod = im.module
+        self.conjs = mod.conjs
+        self.index = im.TheoryIndex(list(mod.get_axioms()) + self.conjs,mod.concepts,None)
+        lines = ['version ' + check_results_version, 'language ' + iu.get_string_version()]
+        lines.extend(param_lines())
+        lines.extend(sorted(l for l in str(lg.sig).split('\n') if l))
+        lines.extend(sorted('interpret {} -> {}'.format(k,v) for k,v in lg.sig.interp.iteritems()))
+        lines.append('init_cond ' + str(mod.init_cond))
+        lines.extend(sorted('init ' + str(im.drop_label(x)) for x in mod.labeled_inits))
+        lines.extend('initializer ' + action_to_str(n,a) for n,a in mod.initializers)
+        self.common = lines
+
+    def action_inputs(self,name):
+        """ Return the text and the symbols of an action, or of the
+        initializers if name is None. """
+        mod = im.module
+        actions = mod.initializers if name is None else [(name,mod.actions[name])]
+        lines,keys = [],set()
+        for n,a in actions:
+            updated,clauses,pre = a.update(mod,{})
+            lines.extend([action_to_str(n,a),'updates ' + ','.join(map(str,updated)),
+                          'transition ' + str(clauses),'pre ' + str(pre)])
+            keys.update(updated)
+            keys.update(im.theory_keys(clauses,pre))
+        return lines,keys
+
+    def digest(self,kind,lines,keys,goal=None):
+        if goal is not None:
+            keys = keys | im.theory_keys(goal)
+        cone = sorted(str(f) for f in self.index.slice(keys))
+        text = self.common + [kind] + lines + ['goal ' + str(goal)] + cone
+        return hashlib.sha1('\n'.join(text)).hexdigest()
+
+    def obligations(self,kind,name):
+        """ Return the digest of the safety obligation of an action
+        (or of the initializers if name is None) and the list of
+        digests of its obligations for the conjectures. """
+        lines,keys = self.action_inputs(name)
+        return (self.digest(kind + ' safety',lines,keys),
+                [self.digest(kind,lines,keys,c) for c in self.conjs])
+
+def is_reused(digest):
+    """ True if the obligation with the given digest (None if not
+    checking incrementally) was verified by a previous check. """
+    if digest is None:
+        return False
+    reused = digest in previous_results
+    result_counts['reused' if reused else 'checked'] += 1
+    return reused
+
+def record_verified(digests):
+    verified_results.update(d for d in digests if d is not None)
+
+def action_obligations(deps,kind,name,state):
+    if deps is None:
+        return None,[None for c in state.conjs]
+    return deps.obligations(kind,name)
+
+@iu.timed_phase('initiation',breakdown=True)
+def check_initiation(ag,deps=None):
+    state = ag.states[0]
+    safety,conjs = action_obligations(deps,'initiation',None,state)
+    if im.module.initializers and not is_reused(safety):
+        with ivy_solver.QueryContext('check','initializer'):
+            cex = ag.check_bounded_safety(state)
+        if cex is not None:
+            display_cex("safety failed in initializer",cex)
+    todo = [c for c,d in zip(state.conjs,conjs) if not is_reused(d)]
+    if todo:
+        with ivy_interp.EvalContext(check=False):
+            check_conjectures('Initiation','These conjectures are false initially.',ag,state,todo)
+    record_verified([safety] + conjs)
+
+@iu.timed_phase('consecution',breakdown=True)
+def check_consecution(ag,a,deps=None):
+    safety,conjs = action_obligations(deps,'consecution',a,ag.states[0])
+    check_safety = not is_reused(safety)
+    todo = [i for i,d in enumerate(conjs) if not is_reused(d)]
+    reused = len(conjs) - len(todo) + (0 if check_safety else 1)
+    with ivy_interp.EvalContext(check=False), ivy_solver.QueryContext('action',a):
+        if reused:
+            print "trying {}... ({} of {} results reused)".format(a,reused,len(conjs)+1)
+        else:
+            print "trying {}...".format(a)
+        if check_safety or todo:
+            ag.execute_action(a,prestate=ag.states[0])
+            state = ag.states[-1]
+            if check_safety:
+                cex = ag.check_bounded_safety(state)
+                if cex is not None:
+                    display_cex("safety failed",cex)
+            if todo:
+                check_conjectures('Consecution','These conjectures are not inductive.',ag,state,
+                                  [state.conjs[i] for i in todo])
+    record_verified([safety] + conjs)
+
+# With bmc=N, instead of checking that the conjectures are inductive,
+# we search for an execution of at most N exported actions from the
+# (concrete) initial state that ends in a state violating a conjecture
+# or in which an action fails an assertion. All the depths are checked
+# by one incremental solver (see ivy_transrel.IncrementalBMC). A
+# bounded check is not a proof, so it is not stored in the proof cache.
+
+@iu.timed_phase('bmc',breakdown=True)
+def check_isolate_bmc():
+    ag = ivy_art.AnalysisGraph()
+    ag.add_initial_state(ag.domain.init_cond)
+    state = ag.states[0]
+    mod = im.module
+    actions = [mod.actions[a] for a in sorted(mod.public_actions)]
+    depth = bmc.get() if actions else 0
+    if state.conjs:
+        error = lut.dual_clauses(lut.and_clauses(*state.conjs))
+    else:
+        error = lut.false_clauses()
+    with ivy_interp.EvalContext(check=False), ivy_solver.QueryContext('check','bmc'):
+        cex = ag.bmc_action(state,act.EnvAction(*actions),error,depth)
+    checker = ag.last_bmc
+    for d,t in enumerate(checker.times):
+        print "bmc depth {}: {} ({:.3f}s)".format(d,"fail" if cex and d == checker.depth else "ok",t)
+    if cex is not None:
+        if checker.result == 'failure':
+            display_cex("assertion fails in step {}".format(checker.depth+1),cex)
+        else:
+            display_cex("conjectures fail after {} steps".format(checker.depth),cex)
+
+def check_isolate_sequential(isolate=None):
+    check_properties()
+    loaded = ivy_artifact.load_isolate_updates(isolate)
+    if bmc.get() > 0:
+        check_isolate_bmc()
+    else:
+        ag = ivy_art.AnalysisGraph(initializer=ivy_alpha.alpha)
+        deps = DependencyGraph() if check_results.get() is not None else None
+        check_initiation(ag,deps)
+        for a in sorted(im.module.public_actions):
+            check_consecution(ag,a,deps)
+    ivy_artifact.save_isolate_updates(isolate,loaded)
+
+# A proof obligation is a pair (isolate,action), where action None
+# stands for the properties, the initializer and initiation of the
+# conjectures. Obligations are independent, so they can be checked in
+# separate processes. Each worker is forked from the checker process,
+# so it inherits the compiled module and gets its own Z3 context.
+
+def isolate_obligations(isolate):
+    """ Return the hash of an isolate and its obligations. The list of
+    obligations is empty if the isolate is in the proof cache. """
+    with im.module.copy():
+        ivy_isolate.create_isolate(isolate)
+        digest = isolate_digest()
+        if is_proof_cached(digest):
+            return digest,[]
+        actions = sorted(im.module.public_actions)
+    return digest,[(isolate,None)] + [(isolate,a) for a in actions]
+
+# Each worker builds the dependency graph of an isolate once, for the
+# first obligation of the isolate it checks. The graph depends only on
+# the isolate, not on the obligation.
+
+worker_deps = {} # isolate -> DependencyGraph
+
+def worker_dependency_graph(isolate):
+    if isolate not in worker_deps:
+        worker_deps[isolate] = DependencyGraph()
+    return worker_deps[isolate]
+
+def check_obligation(obligation):
+    """ Check one obligation in the current module, returning a tuple
+    (output,error,verified,counts) where output is the text printed by
+    the check, error is None or a tuple (msg,lineno,filename) for an
+    IvyError (see obligation_error), and verified and counts
+    are the digests of the results verified and the numbers of
+    results checked and reused (see check_results). """
+    isolate,action = obligation
+    out,old_out = StringIO.StringIO(),sys.stdout
+    sys.stdout = out
+    verified_results.clear()
+    result_counts.update(checked=0,reused=0)
+    try:
+        with im.module.copy(), ivy_solver.QueryContext('isolate',isolate):
+            ivy_isolate.create_isolate(isolate)
+            if action is None:
+                check_properties()
+            else:
+                im.module.labeled_axioms.extend(im.module.labeled_props)
+            loaded = ivy_artifact.load_isolate_updates(isolate)
+            ag = ivy_art.AnalysisGraph(initializer=ivy_alpha.alpha)
+            deps = worker_dependency_graph(isolate) if check_results.get() is not None else None
+            if action is None:
+                check_initiation(ag,deps)
+            else:
+                check_consecution(ag,action,deps)
+            ivy_artifact.save_isolate_updates(isolate,loaded)
+        err = None
+    except iu.IvyError as e:
+        # AST's may not be picklable, and exceptions whose constructor
+        # takes arguments cannot be unpickled, so keep just the
+        # message and the location
+        err = (e.msg,e.lineno,getattr(e,'filename',None))
+    finally:
+        sys.stdout = old_out
+    return out.getvalue(),err,list(verified_results),dict(result_counts)
+
+def obligation_error(msg,lineno,filename):
+    err = iu.IvyError(None,msg)
+    err.lineno = lineno
+    if filename is not None:
+        err.filename = filename
+    return err
+
+def check_isolates_parallel(isolates):
+    iso_obligations = [isolate_obligations(isolate) for isolate in isolates]
+    obligations = [ob for digest,obs in iso_obligations for ob in obs]
+    pool = multiprocessing.Pool(jobs.get())
+    try:
+        results = pool.map(check_obligation,obligations)
+        pool.close()
+    finally:
+        pool.terminate()
+
+    # report in the same order as the sequential checker, stopping at
+    # the first failure. As in the sequential checker, only the
+    # results of the obligations before the failure are recorded.
+
+    results = iter(results)
+    for isolate,(digest,obs) in zip(isolates,iso_obligations):
+        if isolate:
+            print "Checking isolate {}...".format(isolate)
+        if not obs:
+            print "(cached)"
+            continue
+        for ob in obs:
+            output,err,verified,counts = next(results)
+            sys.stdout.write(output)
+            if err is not None:
+                raise obligation_error(*err)
+            verified_results.update(verified)
+            for k,n in counts.iteritems():
+                result_counts[k] += n
+        if not bmc.get():
+            store_proof(digest)
+
+def check_module():
+    isolates = isolates_to_check()
+    read_check_results()
+    result_counts.update(checked=0,reused=0)
+    try:
+        if jobs.get() > 1 and not diagnose.get() and not bmc.get():
+            check_isolates_parallel(isolates)
+        else:
+            check_isolates_sequential(isolates)
+    finally:
+        write_check_results()
+    if check_results.get() is not None:
+        print "results checked: {}, reused: {}".format(result_counts['checked'],result_counts['reused'])
+
+def check_isolates_sequential(isolates):
     for isolate in isolates:
-        if isolate != None and len(im.module.isolates[isolate].verified()) == 0:
-            continue # skip if nothing to verify
         if isolate:
             print "Checking isolate {}...".format(isolate)
         with im.module.copy():
             ivy_isolate.create_isolate(isolate) # ,ext='ext'
-            check_properties()
-            ag = ivy_art.AnalysisGraph(initializer=ivy_alpha.alpha)
-            if im.module.initializers:
-                cex = ag.check_bounded_safety(ag.states[0])
-                if cex is not None:
-                    display_cex("safety failed in initializer",cex)
-            with ivy_interp.EvalContext(check=False):
-                check_conjectures('Initiation','These conjectures are false initially.',ag,ag.states[0])
-                for a in sorted(im.module.public_actions):
-                    print "trying {}...".format(a)
-                    ag.execute_action(a,prestate=ag.states[0])
-                    cex = ag.check_bounded_safety(ag.states[-1])
-                    if cex is not None:
-                        display_cex("safety failed",cex)
-                    check_conjectures('Consecution','These conjectures are not inductive.',ag,ag.states[-1])
+            digest = isolate_digest()
+            if is_proof_cached(digest):
+                print "(cached)"
+                continue
+            with ivy_solver.QueryContext('isolate',isolate):
+                check_isolate_sequential(isolate)
+        if not bmc.get():
+            store_proof(digest)
 
 
 def main():
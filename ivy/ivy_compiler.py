@@ -626,6 +626,9 @@ def read_module(f,nested=False):
         raise err
     return decls
 
+# the files read by import_module (see ivy_artifact)
+imported_files = []
+
 def import_module(name):
     fname = name + '.ivy'
     try: 
@@ -636,6 +639,7 @@ def import_module(name):
             f = open(inc,'r')
         except Exception:
             raise IvyError(None,"module {} not found in current directory or module path".format(name))
+    imported_files.append(os.path.abspath(f.name))
     with iu.SourceFile(fname):
         mod = read_module(f,nested=True)
     return mod
@@ -117,7 +117,6 @@ lexer = lex.lex()
 
 # Yacc example
 
-import ply.yacc as yacc
 
 def p_expr_lit(p):
     'expr : lit'
@@ -182,10 +181,10 @@ def p_sum_sum_expr(p):
 def p_error(p):
     print "Syntax error in input!"
 
-# Build the parser
-import os
-tabdir = os.path.dirname(os.path.abspath(__file__))
-parser = yacc.yacc(tabmodule='concept_space_parsetab',errorlog=yacc.NullLogger(),outputdir=tabdir)
+# The parser is built on first use (see ivy_utils.LazyParser)
+import sys
+import ivy_utils as iu
+parser = iu.LazyParser(sys.modules[__name__],'concept_space_parsetab')
 
 def to_concept_space(s):
     return parser.parse(s)
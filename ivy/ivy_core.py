@@ -5,6 +5,17 @@
 
 from z3 import *
 import ivy_utils as iu
+import time
+
+# Core minimization method: "deletion" removes one literal at a time,
+# "quickxplain" uses divide-and-conquer. The budget parameters bound
+# the number of solver checks and the time spent by "quickxplain"
+# (zero means no bound). When the budget runs out, the current core is
+# returned, which is unsatisfiable but may not be minimal.
+
+core_minimizer = iu.EnumeratedParameter("core_minimizer",["deletion","quickxplain"],"deletion")
+core_budget = iu.Parameter("core_budget",0,check=lambda s: str(s).isdigit(),process=int)
+core_time = iu.Parameter("core_time",0.0,check=lambda s: str(s).replace('.','',1).isdigit(),process=float)
 
 def get_id(x):
     return Z3_get_ast_id(x.ctx_ref(), x.as_ast())
@@ -13,6 +24,13 @@ def biased_core(s,alits,unlikely):
     """ Try to produce a minimal unsatisfiable subset of alits, using as few
     of the alits in unlikely as possible. 
     """
+    if core_minimizer.get() == "quickxplain":
+        # quickxplain prefers to drop the literals at the end of the list
+        unlikely_ids = set(get_id(c) for c in unlikely)
+        core = list(s.unsat_core())
+        core = ([c for c in core if get_id(c) not in unlikely_ids]
+                + [c for c in core if get_id(c) in unlikely_ids])
+        return QuickXplain(s).minimize(core)
     core = alits
     for lit in unlikely:
         test = [c for c in core if get_id(c) != get_id(lit)]
@@ -41,9 +59,55 @@ def minimize_core_aux2(s, core):
     return mus
 
 def minimize_core(s):
+    if core_minimizer.get() == "quickxplain":
+        return QuickXplain(s).minimize(list(s.unsat_core()))
     core = list(s.unsat_core())
 #    print "minimize_core: core = {}".format(core)
     core = minimize_core_aux2(s, core)
 #    print "minimize_core: core = {}".format(core)
     return core
 
+class QuickXplain(object):
+    """ Minimize an unsatisfiable set of assumption literals of solver
+    s by divide and conquer. Each unsat check also yields a core, which
+    is used to drop literals from the set still to be minimized. """
+
+    def __init__(self,s,max_checks=None,max_time=None):
+        self.s = s
+        self.max_checks = core_budget.get() if max_checks is None else max_checks
+        self.max_time = core_time.get() if max_time is None else max_time
+        self.checks = 0
+        self.start = time.time()
+        self.last_core = None
+
+    def exhausted(self):
+        return (self.max_checks and self.checks >= self.max_checks
+                or self.max_time and time.time() - self.start >= self.max_time)
+
+    def is_unsat(self,lits):
+        self.checks += 1
+        if self.s.check(lits) == unsat:
+            self.last_core = set(get_id(c) for c in self.s.unsat_core())
+            return True
+        return False
+
+    def minimize(self,core):
+        """ core is an unsatisfiable list of literals. Returns a subset
+        of core that is unsatisfiable, and minimal if the budget allows. """
+        return self.qx([],False,core)
+
+    def qx(self,base,check_base,lits):
+        """ base + lits is unsat. Return a subset m of lits such that
+        base + m is unsat. """
+        if check_base and self.is_unsat(base):
+            return []
+        if len(lits) <= 1 or self.exhausted():
+            return lits
+        k = len(lits) / 2
+        lits1,lits2 = lits[:k],lits[k:]
+        m2 = self.qx(base + lits1,True,lits2)
+        if not m2:
+            # base + lits1 was unsat, so restrict lits1 to its core
+            lits1 = [c for c in lits1 if get_id(c) in self.last_core]
+        m1 = self.qx(base + m2,len(m2) > 0,lits1)
+        return m1 + m2
@@ -3,13 +3,10 @@
 #
 from ivy_dafny_lexer import *
 from ivy_dafny_grammar import *
-from ivy_utils import p_error, parse_with
+from ivy_utils import p_error, parse_with, LazyParser
 
-import ply.yacc as yacc
-
-import os
-tabdir = os.path.dirname(os.path.abspath(__file__))
-parser = yacc.yacc(start='top',tabmodule='ivy_dafny_parsetab',errorlog=yacc.NullLogger(),outputdir=tabdir)
+import sys
+parser = LazyParser(sys.modules[__name__],'ivy_dafny_parsetab',start='top')
 
 def parse(s):
     return parse_with(s,parser,lexer)
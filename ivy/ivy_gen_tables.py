@@ -0,0 +1,65 @@
+#
+# Copyright (c) Microsoft Corporation. All Rights Reserved.
+#
+""" Generate the PLY parse tables.
+
+Usage:
+
+    python ivy_gen_tables.py
+
+This builds each parser once, writing its table module into the
+package directory, so that the parsers need not regenerate their
+tables at run time (see ivy_utils.LazyParser). The grammars of Ivy
+and of its formulas and terms depend on the language version, so there
+are tables for each version. This is run at install time by setup.py.
+"""
+
+import sys
+import os
+
+# pick up some paths if were are run as main
+if __name__ == "__main__":
+    sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+import ivy_utils as iu
+
+language_versions = ['1','1.1','1.2','1.3','1.4','1.5','1.6']
+
+def reload_grammar(modname):
+    """ Reload a grammar module after a change of language version,
+    removing its old rules first (see ivy_compiler.clear_rules). """
+    mod = sys.modules[modname]
+    for s in list(mod.__dict__):
+        if s.startswith('p_'):
+            del mod.__dict__[s]
+    return reload(mod)
+
+def generate():
+    import ivy_logic_utils   # imports the grammar modules in the right order
+    import ivy_logic_parser_gen
+    import ivy_concept_space
+    import ivy_dafny_parser
+    import ivy_logic_parser
+    import ivy_parser
+    ivy_concept_space.parser.get()
+    ivy_dafny_parser.parser.get()
+    old_version = iu.get_string_version()
+    try:
+        for version in language_versions:
+            iu.set_string_version(version)
+            reload_grammar('ivy_logic_parser')
+            gen = reload_grammar('ivy_logic_parser_gen')
+            gen.formula_parser.get()
+            gen.term_parser.get()
+            reload_grammar('ivy_parser').parser.get()
+    finally:
+        iu.set_string_version(old_version)
+        reload_grammar('ivy_logic_parser')
+        reload_grammar('ivy_logic_parser_gen')
+        reload_grammar('ivy_parser')
+
+def main():
+    generate()
+
+if __name__ == "__main__":
+    main()
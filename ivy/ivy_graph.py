@@ -11,7 +11,6 @@ import functools
 from collections import defaultdict
 import concept as co
 import concept_interactive_session as cis
-from dot_layout import dot_layout
 from cy_elements import CyElements
 import ivy_utils as iu
 from copy import deepcopy
@@ -562,6 +561,7 @@ class Graph(object):
         self.concrete = clauses
 
     def recompute(self):
+        from dot_layout import dot_layout # needs pygraphviz, so only imported when rendering
         self.concept_session.recompute(self.projection)
         self.cy_elements = dot_layout(render_concept_graph(self),subgraph_boxes=True,node_gt = node_gt)
 
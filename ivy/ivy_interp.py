@@ -12,7 +12,7 @@ from collections import defaultdict
 
 from ivy_logic import *
 from ivy_logic_utils import *
-from ivy_solver import unsat_core, clauses_imply, clauses_imply_formula, clauses_imply_list, clauses_model_to_clauses, clauses_model_to_diagram, get_model_clauses
+from ivy_solver import unsat_core, clauses_imply, clauses_imply_formula, clauses_imply_list, clauses_model_to_clauses, clauses_model_to_diagram, get_model_clauses, get_session
 from ivy_transrel import compose_state_action, forward_interpolant, reverse_image, interpolant, \
     join_state, implies_state, ActionFailed, null_update, forward_image, reverse_interpolant_case, \
     is_skolem, interpolant_case, History, top_state, action_failure
@@ -289,8 +289,9 @@ def reach_state(state,clauses=None):
         clauses = state.clauses
     print "reach_state: clauses = {}".format(clauses)
     axioms = state.domain.background_theory(state.in_scope)
-    img = and_clauses(forward_image(pre,axioms,state.update),axioms,clauses)
-    m = get_model_clauses(img)
+    fwd = and_clauses(forward_image(pre,axioms,state.update),clauses)
+    img = and_clauses(fwd,axioms)
+    m = get_session(axioms).get_model_clauses(fwd)
     ignore = lambda s,d=state.domain: s not in d.relations and s not in d.functions
     if m:
 #        print "reach_state model = {}".format(m.model)
@@ -537,20 +538,30 @@ def eval_state_actions(expr,pre):
 # cannot contain a formula.
 
 def state_implies_formula(state1, fmla2):
-    clauses1 = and_clauses(state1.clauses + state1.domain.background_theory(state1.in_scope))
-    return clauses_imply_formula(clauses1,fmla2)
+    axioms = state1.domain.background_theory(im.theory_keys(state1.clauses,fmla2))
+    return get_session(axioms).clauses_imply_formula(state1.clauses,fmla2)
 
 def undecided_conjectures(state1):
-    clauses1 = and_clauses(state1.clauses,state1.domain.background_theory(state1.in_scope))
-    truths = clauses_imply_list(clauses1,state1.conjs)
-    return [c for c,t in zip(state1.conjs,truths) if not t]
+    return [c for c,m in conjecture_counterexamples(state1)]
 #    return [c for c in state1.conjs if not clauses_imply(clauses1,c)]
 
+def conjecture_counterexamples(state1,conjs=None):
+    """ Return a list of pairs (conj,model) for the conjectures not
+    implied by state1, where model is a HerbrandModel of state1 in
+    which conj is false (or None if the solver is inconclusive). All
+    conjectures (or the given subset conjs) are checked in one batch,
+    sharing counterexamples. """
+    if conjs is None:
+        conjs = state1.conjs
+    axioms = state1.domain.background_theory(im.theory_keys(state1.clauses,*conjs))
+    res = get_session(axioms).clauses_imply_list_cex(state1.clauses,conjs)
+    return [(c,m) for c,m in zip(conjs,res) if m is not True]
+
 def false_properties():
-    axioms = im.background_theory()
     props = im.module.labeled_props
     goals = [formula_to_clauses(prop.formula) for prop in props]
-    truths = clauses_imply_list(axioms,goals)
+    axioms = im.background_theory(im.theory_keys(*goals))
+    truths = get_session(axioms).clauses_imply_list(true_clauses(),goals)
     return [c for c,t in zip(props,truths) if not t]
 #    return [c for c in state1.conjs if not clauses_imply(clauses1,c)]
 
@@ -572,8 +583,10 @@ def history_forward_step(history,state):
     return history.forward_step(state.pred.domain.background_theory(state.pred.in_scope),state.update)
 
 def history_satisfy(history,state,_get_model_clauses=None,final_cond=None):
+    # The model is extracted for all the symbols of the history, so
+    # we need the whole theory here, not a slice.
     return history.satisfy(
-        state.domain.background_theory(state.in_scope),
+        state.domain.background_theory(),
         _get_model_clauses,
         final_cond
     )
@@ -809,6 +809,7 @@ def fix_initializers(mod,after_inits):
         ais = set(m.mixer() for m in after_inits)
         mod.exports = [e for e in mod.exports if e.exported() not in ais]
 
+@iu.timed_phase('isolate')
 def create_isolate(iso,mod = None,**kwargs):
 
         mod = mod or im.module
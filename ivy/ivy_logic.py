@@ -70,6 +70,17 @@ from logic import And,Or,Not,Implies,Iff,Ite,ForAll,Exists
 from type_inference import concretize_sorts
 from collections import defaultdict
 from itertools import chain
+from utils import recstruct_object
+
+def set_hash_consing(val):
+    enabled = str(val).lower() == 'true'
+    recstruct_object.set_hash_consing(enabled)
+    return enabled
+
+# When true, structurally equal terms and formulas are the same object
+hash_cons = iu.Parameter("hash_cons",False,
+                         check=lambda s: str(s).lower() in ('true','false'),
+                         process=set_hash_consing)
 
 allow_unsorted = False
 repr = str
@@ -2,7 +2,6 @@
 # Copyright (c) Microsoft Corporation. All Rights Reserved.
 #
 from ivy_lexer import *
-import ply.yacc as yacc
 
 # Parser for formulas
 
@@ -25,9 +24,9 @@ from ivy_logic_parser import *
 def p_error(token):
     raise LogicParseError(token,"syntax error")
 
-import os
-tabdir = os.path.dirname(os.path.abspath(__file__))
-formula_parser = yacc.yacc(start = 'fmla', tabmodule='ivy_formulatab',errorlog=yacc.NullLogger(),outputdir=tabdir,debug=None)
-#formula_parser = yacc.yacc(start = 'fmla', tabmodule='ivy_formulatab')
-term_parser = yacc.yacc(start = 'term', tabmodule='ivy_termtab',errorlog=yacc.NullLogger(),outputdir=tabdir,debug=None)
+# The parsers are built on first use (see ivy_utils.LazyParser)
+import sys
+import ivy_utils as iu
+formula_parser = iu.LazyParser(sys.modules[__name__],iu.versioned_tabmodule('ivy_formulatab'),start='fmla')
+term_parser = iu.LazyParser(sys.modules[__name__],iu.versioned_tabmodule('ivy_termtab'),start='term')
 
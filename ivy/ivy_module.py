@@ -58,6 +58,12 @@ class Module(object):
         self.natives = [] # list of NativeDef
         self.initializers = [] # list of name,action pairs
         self.params = []
+        self.version = 0 # incremented by changed (see update_version)
+        self.update_cache = {} # memo of action updates (see ivy_actions.memo_update)
+        self.update_cache_version = None
+        self.theory_index = None # index for slicing the background theory
+        self.theory_cache = None # pair (version,background theory)
+        self.alpha_domain = None # abstract domain of the concept spaces (see ivy_alpha.alpha)
 
         self.sig = il.sig.copy() # capture the current signature
 
@@ -84,16 +90,58 @@ class Module(object):
 
     def background_theory(self, symbols=None):
         """ Return a set of clauses which represent the background theory
-        restricted to the given symbols (should be like the result of used_symbols).
+        restricted to the given symbols (should be like the result of
+        used_symbols, or of theory_keys). If symbols is None or empty,
+        or slice_theory is false, the whole theory is returned.
         """
-        theory = list(self.get_axioms())
-        # axioms of the derived relations TODO: used only the
-        # referenced ones, but we need to know abstract domain for
-        # this
-        for df in self.concepts:
-            theory.append(df.to_constraint()) # TODO: make this a def?
-        return lu.Clauses(theory)
+        if symbols and slice_theory.get():
+            return self.get_theory_index().slice_clauses(symbols)
+        version = self.update_version()
+        if self.theory_cache is None or self.theory_cache[0] != version:
+            theory = list(self.get_axioms())
+            # axioms of the derived relations TODO: make these defs?
+            for df in self.concepts:
+                theory.append(df.to_constraint())
+            self.theory_cache = (version,lu.Clauses(theory))
+        return self.theory_cache[1]
 
+    def get_theory_index(self):
+        version = self.update_version()
+        if self.theory_index is None or self.theory_index.version != version:
+            self.theory_index = TheoryIndex(self.get_axioms(),self.concepts,version)
+        return self.theory_index
+
+    def changed(self):
+        """ Record a change made in place to one of the declarations
+        (say, rewriting the body of an action). Adding, removing or
+        replacing declarations is seen by update_version without this. """
+        self.version += 1
+
+    def update_version(self):
+        """ Return a key that changes whenever the declarations that
+        derived data (action updates, the background theory and its
+        index) depend on change. The key is computed from the
+        declarations themselves, so that no modification of the module
+        can be missed: it holds the axioms, properties, conjectures,
+        update axioms, concepts, concept spaces, schemata and their
+        instances and actions of the module, and the sizes of the
+        object hierarchy and the signature. """
+        objs,sizes = [],[self.version]
+        for decls in (self.labeled_axioms,self.labeled_props,self.labeled_conjs,
+                      self.updates,self.concepts,self.concept_spaces):
+            objs.extend(decls)
+            sizes.append(len(decls))
+        for name,sch in self.schemata.iteritems():
+            objs.append(sch)
+            objs.extend(sch.instances)
+            sizes.append(len(sch.instances))
+        for name,action in self.actions.iteritems():
+            objs.append(action)
+            sizes.append(name)
+        sizes.append(sum(len(v) + 1 for v in self.hierarchy.itervalues()))
+        sig = self.sig
+        sizes.extend((len(sig.sorts),len(sig.symbols),len(sig.interp)))
+        return DeclsKey(objs,sizes)
 
     def add_to_hierarchy(self,name):
         if iu.ivy_compose_character in name:
@@ -128,15 +176,119 @@ class Module(object):
         for x,y in self.__dict__.iteritems():
             if x is 'sig':
                 m.__dict__[x] = y.copy()
+            elif x is 'update_cache':
+                m.__dict__[x] = {}
+            elif x in ('theory_index','theory_cache','alpha_domain'):
+                m.__dict__[x] = None
             else:
                 m.__dict__[x] = copy(y)
         return m
 
+class DeclsKey(object):
+    """ Key identifying the declarations of a module (see
+    Module.update_version). Declarations are compared by identity.
+    Holding them keeps their ids from being reused. """
+    def __init__(self,objs,sizes):
+        self.objs,self.sizes = objs,sizes
+    def __eq__(self,other):
+        return (isinstance(other,DeclsKey) and self.sizes == other.sizes
+                and len(self.objs) == len(other.objs)
+                and all(x is y for x,y in zip(self.objs,other.objs)))
+    def __ne__(self,other):
+        return not self == other
+
 module = None
 
 def background_theory(symbols = None):
     return module.background_theory(symbols)
 
+# Slicing of the background theory. A query only needs the axioms in
+# the cone of influence of its symbols: the axioms sharing a symbol or
+# an uninterpreted sort with the query, and transitively with the
+# axioms already in the cone. Sorts must be followed, since an axiom
+# can constrain the size of a sort (say, "X:t = c") and so the
+# satisfiability of a query that mentions only the sort. A definition
+# of a derived relation is a conservative extension, so it is needed
+# only when the relation is in the cone. Assuming the whole theory is
+# consistent, the remaining axioms share no symbols or sorts with the
+# query and its cone, so any model of the slice extends to a model of
+# the whole theory. That is, the sliced query is equisatisfiable.
+
+slice_theory = iu.BooleanParameter("slice_theory",True)
+
+def theory_keys(*asts):
+    """ Return the symbols in the given formulas or Clauses, and the
+    uninterpreted sorts of their symbols and variables. """
+    syms,variables = set(),set()
+    for ast in asts:
+        if isinstance(ast,lu.Clauses):
+            syms.update(lu.used_symbols_clauses(ast))
+            variables.update(lu.used_variables_clauses(ast))
+        else:
+            syms.update(lu.used_symbols_ast(ast))
+            variables.update(lu.used_variables_ast(ast))
+    sorts = set(v.sort for v in variables)
+    for sym in syms:
+        sorts.update(sym.sort.dom)
+        sorts.add(sym.sort.rng)
+    return syms | set(s for s in sorts if il.is_uninterpreted_sort(s))
+
+class TheoryIndex(object):
+    """ Index of the background theory, mapping each symbol and sort to
+    the formulas it pulls into the cone of influence. """
+    def __init__(self,axioms,concepts,version):
+        self.version = version
+        self.fmlas = []         # formulas in theory order
+        self.deps = []          # keys each formula brings into the cone
+        self.triggers = defaultdict(list) # key -> indices of formulas
+        self.slices = {}        # cone (tuple of indices) -> Clauses
+        for ax in axioms:
+            keys = theory_keys(ax)
+            self.add(ax,keys,keys)
+        for df in concepts:
+            fmla = df.to_constraint()
+            self.add(fmla,lu.used_symbols_ast(df.args[0]),theory_keys(fmla))
+
+    def add(self,fmla,triggers,deps):
+        idx = len(self.fmlas)
+        self.fmlas.append(fmla)
+        self.deps.append(deps)
+        for key in triggers:
+            self.triggers[key].append(idx)
+
+    def slice(self,symbols):
+        """ Return the formulas in the cone of influence of symbols. """
+        return [self.fmlas[idx] for idx in self.cone(symbols)]
+
+    def slice_clauses(self,symbols):
+        """ Return the formulas in the cone of influence of symbols as
+        Clauses. The same cone gives the same object, so the result
+        can be used as a key by identity (see ivy_solver.get_session). """
+        cone = self.cone(symbols)
+        res = self.slices.get(cone)
+        if res is None:
+            res = self.slices[cone] = lu.Clauses([self.fmlas[idx] for idx in cone])
+        return res
+
+    def cone(self,symbols):
+        """ Return the indices of the formulas in the cone of influence
+        of symbols, in order. """
+        seen = set(symbols)
+        for sym in symbols:
+            if isinstance(sym,il.Symbol):
+                seen.update(s for s in list(sym.sort.dom) + [sym.sort.rng] if il.is_uninterpreted_sort(s))
+        todo = list(seen)
+        used = set()
+        while todo:
+            for idx in self.triggers.get(todo.pop(),[]):
+                if idx not in used:
+                    used.add(idx)
+                    for key in self.deps[idx]:
+                        if key not in seen:
+                            seen.add(key)
+                            todo.append(key)
+        return tuple(sorted(used))
+
 def find_action(name):
     return module.actions.get(name,None)
 
@@ -6,10 +6,8 @@ from ivy_ast import *
 from ivy_actions import AssumeAction, AssertAction, EnsuresAction, SetAction, AssignAction, HavocAction, IfAction, AssignFieldAction, NullFieldAction, CopyFieldAction, InstantiateAction, CallAction, LocalAction, LetAction, Sequence, UpdatePattern, PatternBasedUpdate, SymbolList, UpdatePatternList, Schema, ChoiceAction, NativeAction
 from ivy_lexer import *
 import ivy_utils as iu
-import copy
 
 
-import ply.yacc as yacc
 import string
 
 if not (iu.get_numeric_version() <= [1,2]):
@@ -1240,23 +1238,35 @@ def p_error(token):
     else:
         report_error(ParseError(None,None,'unexpected end of input'));
 
-# Build the parsers
-import os
-tabdir = os.path.dirname(os.path.abspath(__file__))
-parser = yacc.yacc(start='top',tabmodule='ivy_parsetab',errorlog=yacc.NullLogger(),outputdir=tabdir,debug=None)
-#parser = yacc.yacc(start='top',tabmodule='ivy_parsetab')
-# formula_parser = yacc.yacc(start = 'fmla', tabmodule='ivy_formulatab')
-
+# The parser is built on first use. The grammar depends on the
+# language version, which is fixed when this module is (re)loaded.
+import sys
+parser = iu.LazyParser(sys.modules[__name__],iu.versioned_tabmodule('ivy_parsetab'),start='top')
+
+class ParseContext(object):
+    """ Context Manager for one parse. A nested parse (of an included
+    module) happens inside a grammar action of the enclosing parse.
+    It shares the error list and object stack of the enclosing parse,
+    but gets its own lexer, since a lexer holds the input. The parser
+    keeps its state on the Python stack, so it can be shared. """
+    def __init__(self,nested):
+        self.nested = nested
+    def __enter__(self):
+        global error_list
+        global stack
+        if not self.nested:
+            error_list = []
+            stack = []
+        self.lexer = lexer.clone()
+        return self
+    def __exit__(self,exc_type, exc_val, exc_tb):
+        return False # don't block any exceptions
+
+@iu.timed_phase('parse')
 def parse(s,nested=False):
-    global error_list
-    global stack
-    if not nested:
-        error_list = []
-        stack = []
     vernum = iu.get_numeric_version()
-    with LexerVersion(vernum):
-        # shallow copy the parser and lexer to try for re-entrance (!!!)
-        res = copy.copy(parser).parse(s,lexer=copy.copy(lexer))
+    with LexerVersion(vernum), ParseContext(nested) as ctx:
+        res = parser.parse(s,lexer=ctx.lexer)
     if error_list:
         raise iu.ErrorList(error_list)
     return res
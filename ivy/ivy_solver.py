@@ -10,6 +10,14 @@ from itertools import chain
 from collections import defaultdict
 import re
 import functools
+import time
+import multiprocessing
+import Queue
+import heapq
+import atexit
+import sys
+import os
+from collections import OrderedDict
 
 import z3
 import ivy_logic
@@ -27,6 +35,23 @@ use_z3_enums = False
 def set_use_native_enums(t):
     global use_z3_enums
     use_z3_enums = t
+    clear_translations()
+
+# Translations of formulas to Z3 are memoized, keyed on the formula
+# structure. When the cache reaches this size, the least recently used
+# translation is dropped. Zero disables the cache. With hash-consing
+# (see ivy_logic.hash_cons), hashing a formula takes constant time, so
+# every subformula is memoized, and subformulas shared between
+# formulas are translated once. Otherwise, only the formulas passed in
+# from outside are, since hashing at every level of a formula would
+# take quadratic time.
+
+translation_cache_size = 100000
+
+def set_translation_cache_size(n):
+    global translation_cache_size
+    translation_cache_size = n
+    clear_translations()
 
 def solver_name(symbol):
     name = symbol.name
@@ -108,11 +133,37 @@ def is_solver_op(name):
 
 
 def clear():
-    global z3_sorts, z3_predicates, z3_constants, z3_functions
+    global z3_sorts, z3_predicates, z3_constants, z3_functions, solver_sessions
     z3_sorts = dict()
     z3_predicates = {ivy_logic.equals : my_eq}
     z3_constants = dict()
     z3_functions = dict()
+    solver_sessions = OrderedDict()
+    clear_translations()
+
+def clear_translations():
+    global z3_formulas, z3_closed_formulas
+    z3_formulas = OrderedDict()         # formula -> open Z3 formula
+    z3_closed_formulas = OrderedDict()  # formula -> universally closed Z3 formula
+
+def cached_translation(cache,fmla,translate):
+    """ Return translate(fmla), memoized in cache, which is kept in
+    order of use. Definitions are compared by identity, so they are not
+    cached. """
+    if translation_cache_size == 0 or isinstance(fmla,ivy_logic.Definition):
+        return translate(fmla)
+    res = cache.pop(fmla,None)
+    if res is None:
+        res = translate(fmla)
+        if len(cache) >= translation_cache_size:
+            cache.popitem(last=False)
+    cache[fmla] = res
+    return res
+
+def subformula_translator():
+    """ The translator to use for the subformulas of a formula: the
+    memoized one with hash-consing, else the uncached one. """
+    return formula_to_z3_int if ivy_logic.hash_cons.get() else formula_to_z3_int_aux
 
 clear()    
 
@@ -241,7 +292,7 @@ def enumerated_to_numeral(term):
 
 def term_to_z3(term):
     if ivy_logic.is_boolean(term):
-        return formula_to_z3_int(term)
+        return formula_to_z3_int_aux(term)
     if not term.args:
         if isinstance(term,ivy_logic.Variable):
             sorted = hasattr(term,'sort')
@@ -277,7 +328,7 @@ def term_to_z3(term):
                 res = z3.Const(term.rep.name,sig)
             z3_constants[term.rep] = res
     elif isinstance(term,ivy_logic.Ite):
-        return z3.If(formula_to_z3_int(term.args[0]),term_to_z3(term.args[1]),term_to_z3(term.args[2]))
+        return z3.If(formula_to_z3_int_aux(term.args[0]),term_to_z3(term.args[1]),term_to_z3(term.args[2]))
     else:
         fun = z3_functions.get(term.rep)
         if fun is None:
@@ -345,18 +396,23 @@ def conj_to_z3(cl):
         return z3.And(*[conj_to_z3(t) for t in cl.args])
     return formula_to_z3(cl)
 
+@iu.timed_phase('z3_translation')
 def clauses_to_z3(clauses):
     z3_clauses = [conj_to_z3(cl) for cl in clauses.fmlas]
     z3_clauses += [formula_to_z3(dfn) for dfn in clauses.defs]
     return z3.And(z3_clauses)
 
 def formula_to_z3_int(fmla):
+    return cached_translation(z3_formulas,fmla,formula_to_z3_int_aux)
+
+def formula_to_z3_int_aux(fmla):
 #    print "formula_to_z3_int: {} : {}".format(fmla,type(fmla))
     if ivy_logic.is_atom(fmla):
         return atom_to_z3(fmla)
     if isinstance(fmla,ivy_logic.Definition) and ivy_logic.is_enumerated(fmla.args[0]) and not use_z3_enums:
         return encode_equality(*fmla.args)
-    args = [formula_to_z3_int(arg) for arg in fmla.args]
+    sub = subformula_translator()
+    args = [sub(arg) for arg in fmla.args]
     if isinstance(fmla,ivy_logic.And):
         return z3.And(args)
     if isinstance(fmla,ivy_logic.Or):
@@ -382,8 +438,12 @@ def formula_to_z3_int(fmla):
     print "bad fmla: {!r}".format(fmla)
     assert False
 
+@iu.timed_phase('z3_translation')
 def formula_to_z3(fmla):
-    z3_formula = formula_to_z3_int(fmla)
+    return cached_translation(z3_closed_formulas,fmla,formula_to_z3_aux)
+
+def formula_to_z3_aux(fmla):
+    z3_formula = subformula_translator()(fmla)
     variables = sorted(used_variables_ast(fmla))
     if len(variables) == 0:
         return z3_formula
@@ -395,8 +455,12 @@ def formula_to_z3(fmla):
 def unsat_core(clauses1, clauses2, implies = None, unlikely=lambda x:False):
 #    print "unsat_core clauses1 = {}, clauses2 = {}".format(clauses1,clauses2)
 #    assert clauses1.defs == []
+    return unsat_core_solver(new_solver(),clauses1,clauses2,implies,unlikely)
+
+def unsat_core_solver(s2, clauses1, clauses2, implies = None, unlikely=lambda x:False):
+    """ Compute the unsat core of unsat_core using solver s2, which may
+    already contain some background assertions. """
     fmlas = clauses1.fmlas
-    s2 = z3.Solver()
     alits = [z3.Const("__c%s" % n, z3.BoolSort()) for n,c in enumerate(fmlas)]
     cc = [z3.Or(z3.Not(a),formula_to_z3(c)) for a,c in zip(alits,fmlas)]
     foo = [(a,f) for a,f in zip(alits,fmlas) if unlikely(f)]
@@ -450,8 +514,263 @@ def check_cube(s,cube,memo = None,memo_unsat_only = False):
 ##    print "res %s" % res
     return res
 
+# Portfolio solving. With portfolio=N, a check that does not finish
+# within portfolio_timeout seconds is restarted under the first N
+# configurations in portfolio_configs, each in a separate process.
+# The first definite answer wins and the other processes are killed.
+# The solver then repeats the check under the winning configuration,
+# so that a model or unsat core is available to the caller (this is
+# skipped for an unsat answer without assumptions), and then restores
+# its configuration. The repeated check gets a timeout derived from
+# the time the winner took. Processes cannot be created inside a
+# daemonic process (for example, a worker of ivy_check with jobs=N),
+# so there the portfolio is not used. With profile=true, each win is
+# printed, and the number of wins of each configuration is reported.
+
+portfolio = iu.Parameter("portfolio",0,check=lambda s: str(s).isdigit(),process=int)
+portfolio_timeout = iu.Parameter("portfolio_timeout",5.0,check=lambda s: str(s).replace('.','',1).isdigit(),process=float)
+
+portfolio_configs = [
+    {},
+    {'smt.mbqi' : False},
+    {'smt.random_seed' : 1, 'sat.random_seed' : 1},
+    {'smt.random_seed' : 2, 'sat.random_seed' : 2},
+    {'smt.relevancy' : 0},
+    {'smt.ematching' : False},
+]
+
+# the Z3 defaults of the parameters set in portfolio_configs
+portfolio_defaults = {
+    'smt.mbqi' : True,
+    'smt.random_seed' : 0,
+    'sat.random_seed' : 0,
+    'smt.relevancy' : 2,
+    'smt.ematching' : True,
+}
+
+portfolio_wins = defaultdict(int) # number of wins of each configuration
+
+def portfolio_worker(query,config,idx,queue):
+    try:
+        for name,val in config.iteritems():
+            z3.set_param(name,val)
+        s = z3.Solver(ctx=z3.Context())
+        s.from_string(query)
+        queue.put((idx,str(s.check())))
+    except Exception:
+        queue.put((idx,'unknown'))
+
+def query_solver(assertions,assumptions):
+    """ Return a plain solver with the assertions and assumptions of
+    a query, for serializing it. """
+    q = z3.Solver()
+    q.add(assertions)
+    q.add(assumptions)
+    return q
+
+def assumption_list(assumptions):
+    """ The assumptions of a check may be given as a single list. """
+    if len(assumptions) == 1 and isinstance(assumptions[0],(list,tuple)):
+        return list(assumptions[0])
+    return list(assumptions)
+
+def portfolio_check(assertions,assumptions):
+    """ Check assertions and assumptions with the portfolio. Returns
+    the index of the winning configuration (or None), the result and
+    the time taken. """
+    query = query_solver(assertions,assumptions).sexpr()
+    configs = portfolio_configs[:portfolio.get()]
+    queue = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=portfolio_worker,args=(query,config,idx,queue))
+             for idx,config in enumerate(configs)]
+    start = time.time()
+    for p in procs:
+        p.start()
+    try:
+        pending = len(procs)
+        while pending:
+            try:
+                idx,res = queue.get(timeout=1.0)
+            except Queue.Empty:
+                # a worker that dies without answering (for example,
+                # out of memory) must not block us forever
+                if not any(p.is_alive() for p in procs) and queue.empty():
+                    break
+                continue
+            pending -= 1
+            if res in ('sat','unsat'):
+                elapsed = time.time()-start
+                portfolio_wins[idx] += 1
+                if profile.get():
+                    print "portfolio: {} by configuration {} {} in {:.2f}s".format(res,idx,configs[idx],elapsed)
+                return idx,(z3.sat if res == 'sat' else z3.unsat),elapsed
+        return None,z3.unknown,time.time()-start
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+
+# Query profiling. With profile=true, every check of a Solver is
+# recorded with its calling site, wall time, result, Z3 statistics
+# and size. At exit, the profile_top slowest queries are reported,
+# and if profile_dump names a directory, they are written there as
+# .smt2 files. The calling site is the function making the query,
+# with the names given by the enclosing QueryContext's (for example,
+# the isolate and action being checked).
+
+profile = iu.BooleanParameter("profile",False)
+profile_top = iu.Parameter("profile_top",10,check=lambda s: str(s).isdigit(),process=int)
+profile_dump = iu.Parameter("profile_dump",None)
+
+query_context = [] # stack of (kind,name) pairs
+
+class QueryContext(object):
+    """ Context Manager that names the calling site of the solver
+    queries made within it. """
+    def __init__(self,kind,name):
+        self.item = (kind,str(name))
+    def __enter__(self):
+        query_context.append(self.item)
+        return self
+    def __exit__(self,exc_type, exc_val, exc_tb):
+        query_context.pop()
+        return False # don't block any exceptions
+
+def z3_size(exprs):
+    """ Number of distinct subterms of a list of Z3 expressions. """
+    seen = set()
+    todo = list(exprs)
+    while todo:
+        e = todo.pop()
+        if e.get_id() in seen:
+            continue
+        seen.add(e.get_id())
+        if z3.is_quantifier(e):
+            todo.append(e.body())
+        elif z3.is_app(e):
+            todo.extend(e.children())
+    return len(seen)
+
+def query_caller():
+    f = sys._getframe(2)
+    while f is not None and f.f_code.co_name in ('check','wrapper','decide'):
+        f = f.f_back
+    if f is None:
+        return '?'
+    return '{} ({}:{})'.format(f.f_code.co_name,os.path.basename(f.f_code.co_filename),f.f_lineno)
+
+class QueryProfile(object):
+    """ Records the solver queries when profiling. """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = [] # heap of (time,count,record)
+        self.by_site = defaultdict(float)
+        atexit.register(self.report)
+
+    def record(self,solver,assumptions,res,elapsed):
+        self.count += 1
+        self.total += elapsed
+        ctx = ', '.join('{}={}'.format(k,n) for k,n in query_context)
+        self.by_site[ctx] += elapsed
+        if len(self.slowest) >= profile_top.get() and elapsed <= self.slowest[0][0]:
+            return
+        stats = solver.statistics()
+        assertions = solver.assertions()
+        rec = {
+            'caller' : query_caller(),
+            'context' : ctx,
+            'result' : str(res),
+            'stats' : dict((k,stats.get_key_value(k)) for k in stats.keys()),
+            'assertions' : len(assertions),
+            'assumptions' : len(assumptions),
+            'size' : z3_size(list(assertions) + assumptions),
+        }
+        if profile_dump.get():
+            rec['smt2'] = query_solver(assertions,assumptions).to_smt2()
+        heapq.heappush(self.slowest,(elapsed,self.count,rec))
+        if len(self.slowest) > profile_top.get():
+            heapq.heappop(self.slowest)
+
+    def report(self):
+        print "solver profile: {} queries in {:.2f}s".format(self.count,self.total)
+        print "time by site:"
+        for ctx,t in sorted(self.by_site.iteritems(),key=lambda x: -x[1]):
+            print "  {:8.2f}s  {}".format(t,ctx or '(none)')
+        if portfolio_wins:
+            print "portfolio wins: " + ', '.join('configuration {}: {}'.format(idx,n)
+                                                 for idx,n in sorted(portfolio_wins.iteritems()))
+        print "slowest queries:"
+        dump = profile_dump.get()
+        if dump and not os.path.isdir(dump):
+            os.makedirs(dump)
+        for elapsed,num,rec in sorted(self.slowest,reverse=True):
+            print "  {:8.2f}s  query {}: {} {} [{}] assertions={} assumptions={} size={}".format(
+                elapsed,num,rec['result'],rec['caller'],rec['context'],
+                rec['assertions'],rec['assumptions'],rec['size'])
+            keys = [k for k in ('conflicts','decisions','quant instantiations','memory') if k in rec['stats']]
+            if keys:
+                print "            " + ' '.join('{}={}'.format(k.replace(' ','_'),rec['stats'][k]) for k in keys)
+            if 'smt2' in rec:
+                fn = os.path.join(dump,'query{}.smt2'.format(num))
+                with open(fn,'w') as f:
+                    f.write(rec['smt2'])
+                print "            written to {}".format(fn)
+
+query_profile = None
+
+def get_query_profile():
+    global query_profile
+    if query_profile is None:
+        query_profile = QueryProfile()
+    return query_profile
+
+class Solver(z3.Solver):
+    """ A Z3 solver whose checks are timed as the "solver" phase
+    (see ivy_utils.timed_phase), use the portfolio if enabled and are
+    recorded if profiling. """
+    @iu.timed_phase('solver')
+    def check(self,*assumptions):
+        if not profile.get():
+            return self.check_aux(*assumptions)
+        start = time.time()
+        res = self.check_aux(*assumptions)
+        get_query_profile().record(self,assumption_list(assumptions),res,time.time() - start)
+        return res
+
+    def check_aux(self,*assumptions):
+        if portfolio.get() and not multiprocessing.current_process().daemon:
+            return self.portfolio_check(*assumptions)
+        return z3.Solver.check(self,*assumptions)
+
+    def portfolio_check(self,*assumptions):
+        res = self.check_with_timeout(portfolio_timeout.get(),*assumptions)
+        if res != z3.unknown:
+            return res
+        lits = assumption_list(assumptions)
+        idx,res,elapsed = portfolio_check(self.assertions(),lits)
+        if res == z3.unknown or res == z3.unsat and not lits:
+            return res
+        config = portfolio_configs[idx]
+        for name,val in config.iteritems():
+            self.set(name,val)
+        try:
+            # the winner's time plus slack for the cost of starting over
+            return self.check_with_timeout(2 * elapsed + portfolio_timeout.get(),*assumptions)
+        finally:
+            for name in config:
+                self.set(name,portfolio_defaults[name])
+
+    def check_with_timeout(self,secs,*assumptions):
+        self.set('timeout',int(secs * 1000))
+        try:
+            return z3.Solver.check(self,*assumptions)
+        finally:
+            self.set('timeout',4294967295) # the default: no timeout
+
 def new_solver():
-    return z3.Solver()
+    return Solver()
 
 def solver_add(solver,fmla):
     solver.add(formula_to_z3(fmla))
@@ -571,12 +890,22 @@ class HerbrandModel(object):
                         for s in self.sorts())
         return dict((s,[c.skolem() for c in self.sort_universe(s)]) for s in self.sorts())
 
+    @property
+    def structure(self):
+        if not hasattr(self,'_structure'):
+            self._structure = FiniteStructure(self.model,self.constants)
+        return self._structure
+
     def check(self,fmla):
         """ Return the set of satisfying assignments to the free variables in fmla. Returns
             a table in the format (vars,rows), where each row is a tuple of values of the
             variables in vars.
         """
         vs = list(variables_ast(fmla))
+        try:
+            return self.structure.check(fmla,vs)
+        except UnsupportedFormula:
+            pass
         s = self.solver
         m = self.model
         ranges = [self.constants[x.sort] for x in vs]
@@ -605,6 +934,139 @@ class HerbrandModel(object):
     def eval_to_constant(self,t):
         return constant_from_z3(t.sort,self.model.eval(term_to_z3(t),model_completion=True))
     
+class UnsupportedFormula(Exception):
+    pass
+
+class FiniteStructure(object):
+    """ The interpretation given by a Z3 model to the symbols over
+    uninterpreted sorts, restricted to the finite universes of the
+    model. The value of a symbol at a tuple of elements is read from
+    the model only once and then kept in a table, so that formulas
+    can be evaluated in Python rather than by a Z3 call per
+    tuple. Elements are represented by their Z3 ast ids.
+
+    Formulas that use interpreted sorts or symbols, enumerated sorts
+    or if-then-else terms are not supported. For these, check raises
+    UnsupportedFormula and the caller falls back on the solver.
+    """
+
+    def __init__(self,model,constants):
+        self.model = model
+        self.constants = constants
+        self.elems = {}      # map from ids to Z3 elements
+        self.universes = {}  # map from sorts to lists of ids
+        self.tables = {}     # map from symbols to (template,vars,values)
+        self.ivy_elems = {}  # map from (sort,id) to Ivy constants
+
+    def universe(self,sort):
+        res = self.universes.get(sort)
+        if res is None:
+            if not ivy_logic.is_uninterpreted_sort(sort) or sort not in self.constants:
+                raise UnsupportedFormula
+            res = []
+            for e in self.constants[sort]:
+                self.elems[e.get_id()] = e
+                res.append(e.get_id())
+            self.universes[sort] = res
+        return res
+
+    def value(self,sym,key):
+        """ Value of symbol sym at the elements with ids key: a Boolean
+        for a relation, else the id of an element. """
+        tab = self.tables.get(sym)
+        if tab is None:
+            vs = [ivy_logic.Variable('V{}'.format(i),s) for i,s in enumerate(sym.sort.dom)]
+            app = sym(*vs) if vs else sym
+            template = formula_to_z3_int(app) if ivy_logic.is_boolean(app) else term_to_z3(app)
+            tab = self.tables[sym] = (template,[term_to_z3(v) for v in vs],{})
+        template,z3_vs,values = tab
+        res = values.get(key)
+        if res is None:
+            fact = substitute(template,*zip(z3_vs,[self.elems[i] for i in key])) if key else template
+            val = self.model.eval(fact,model_completion=True)
+            if ivy_logic.is_boolean_sort(sym.sort.rng):
+                res = z3.is_true(val)
+            else:
+                res = val.get_id()
+                self.elems[res] = val
+            values[key] = res
+        return res
+
+    def compile_app(self,app):
+        sym = app.rep
+        if (ivy_logic.is_numeral(sym) or solver_name(sym) is None
+            or not all(ivy_logic.is_uninterpreted_sort(s) for s in sym.sort.dom)
+            or not (ivy_logic.is_boolean_sort(sym.sort.rng) or ivy_logic.is_uninterpreted_sort(sym.sort.rng))):
+            raise UnsupportedFormula
+        args = [self.compile_term(a) for a in app.args]
+        return lambda env: self.value(sym,tuple(a(env) for a in args))
+
+    def compile_term(self,term):
+        if ivy_logic.is_variable(term):
+            self.universe(term.sort)
+            return lambda env: env[term]
+        if ivy_logic.is_app(term):
+            return self.compile_app(term)
+        raise UnsupportedFormula
+
+    def compile_fmla(self,fmla):
+        """ Return a function that evaluates fmla in an environment
+        mapping its free variables to element ids. """
+        if isinstance(fmla,ivy_logic.Literal):
+            f = self.compile_fmla(fmla.atom)
+            return f if fmla.polarity else (lambda env: not f(env))
+        if ivy_logic.is_quantifier(fmla):
+            qvs = list(ivy_logic.quantifier_vars(fmla))
+            ranges = [self.universe(v.sort) for v in qvs]
+            body = self.compile_fmla(ivy_logic.quantifier_body(fmla))
+            test = all if ivy_logic.is_forall(fmla) else any
+            def quant(env):
+                env = dict(env)
+                def vals():
+                    for tup in itertools.product(*ranges):
+                        env.update(zip(qvs,tup))
+                        yield body(env)
+                return test(vals())
+            return quant
+        if isinstance(fmla,ivy_logic.And):
+            fs = [self.compile_fmla(a) for a in fmla.args]
+            return lambda env: all(f(env) for f in fs)
+        if isinstance(fmla,ivy_logic.Or):
+            fs = [self.compile_fmla(a) for a in fmla.args]
+            return lambda env: any(f(env) for f in fs)
+        if isinstance(fmla,ivy_logic.Not):
+            f = self.compile_fmla(fmla.args[0])
+            return lambda env: not f(env)
+        if isinstance(fmla,ivy_logic.Implies):
+            f,g = [self.compile_fmla(a) for a in fmla.args]
+            return lambda env: not f(env) or g(env)
+        if isinstance(fmla,ivy_logic.Iff):
+            f,g = [self.compile_fmla(a) for a in fmla.args]
+            return lambda env: f(env) == g(env)
+        if ivy_logic.is_eq(fmla):
+            comp = self.compile_fmla if ivy_logic.is_boolean(fmla.args[0]) else self.compile_term
+            f,g = [comp(a) for a in fmla.args]
+            return lambda env: f(env) == g(env)
+        if ivy_logic.is_app(fmla) and ivy_logic.is_boolean(fmla):
+            return self.compile_app(fmla)
+        raise UnsupportedFormula
+
+    def ivy_elem(self,sort,i):
+        res = self.ivy_elems.get((sort,i))
+        if res is None:
+            res = self.ivy_elems[sort,i] = constant_from_z3(sort,self.elems[i])
+        return res
+
+    def check(self,fmla,vs):
+        """ As HerbrandModel.check, for free variables vs. """
+        test = self.compile_fmla(fmla)
+        ranges = [self.universe(v.sort) for v in vs]
+        insts = []
+        for tup in itertools.product(*ranges):
+            if test(dict(zip(vs,tup))):
+                insts.append([self.ivy_elem(v.sort,i) for v,i in zip(vs,tup)])
+        return (vs,insts)
+
 # TODO: need to map Z3 sorts back to ivy sorts
 def sort_from_z3(s):
     return z3_sorts_inv[get_id(s)]
@@ -636,7 +1098,7 @@ def get_model_constant(m,t):
 def clauses_imply(clauses1, clauses2):
     """True if clauses1 imply clauses2.
     """
-    s = z3.Solver()
+    s = new_solver()
     z1 = clauses_to_z3(clauses1)
 #    print "z1 = {}".format(z1)
     s.add(z1)
@@ -648,7 +1110,7 @@ def clauses_imply(clauses1, clauses2):
 def clauses_imply_list(clauses1, clauses2_list):
     """True if clauses1 imply clauses2.
     """
-    s = z3.Solver()
+    s = new_solver()
     z1 = clauses_to_z3(clauses1)
 #    print "z1 = {}".format(z1)
     s.add(z1)
@@ -663,6 +1125,7 @@ def clauses_imply_list(clauses1, clauses2_list):
         s.pop()
     return res
 
+@iu.timed_phase('z3_translation')
 def not_clauses_to_z3(clauses):
     # Separate the definition of skolems
     sdefs,defs = [],[]
@@ -676,7 +1139,7 @@ def not_clauses_to_z3(clauses):
 def clauses_sat(clauses1):
     """True if clauses1 imply clauses2.
     """
-    s = z3.Solver()
+    s = new_solver()
     s.add(clauses_to_z3(clauses1))
     return s.check() != z3.unsat
 
@@ -689,7 +1152,7 @@ def remove_duplicates_clauses(clauses):
 def clauses_case(clauses1):
     """ Drop literals in a clause set while maintaining satisfiability.
     This only works for quantifier-free clauses. """
-    s = z3.Solver()
+    s = new_solver()
     s.add(clauses_to_z3(clauses1))
     if s.check() == z3.unsat:
         return [[]]
@@ -734,7 +1197,7 @@ def clause_model_simp(m,c):
     return res
 
 def get_model_clauses(clauses1):
-    s = z3.Solver()
+    s = new_solver()
     z3c = clauses_to_z3(clauses1)
     s.add(z3c)
     res = s.check()
@@ -743,6 +1206,178 @@ def get_model_clauses(clauses1):
     m = get_model(s)
     return HerbrandModel(s,m,used_symbols_clauses(clauses1))
 
+# A solver session keeps a background theory (typically the result of
+# background_theory) asserted in a single Z3 solver. Each query is
+# asserted in a pushed scope and retracted when the query is answered,
+# so the background theory is translated and asserted only once per
+# session rather than once per query. Sessions are cached by the
+# identity of their axioms in "solver_sessions", which is reset by
+# "clear", since the Z3 terms depend on the current signature. A
+# session keeps its axioms, so their id is not reused while the session
+# is cached. Module.background_theory returns the same object for the
+# same theory, so the lookup need not hash the clauses.
+
+incremental = iu.BooleanParameter("incremental_solver",True)
+max_solver_sessions = 16
+
+class SolverSession(object):
+    """ A Z3 solver with the clauses "axioms" asserted. """
+
+    def __init__(self,axioms):
+        self.axioms = axioms
+        self.solver = new_solver()
+        self.solver.add(clauses_to_z3(axioms))
+        self.num_acts = 0
+
+    def add_clauses(self,clauses):
+        """ Permanently assert clauses in the session. """
+        self.solver.add(clauses_to_z3(clauses))
+
+    def get_small_model_assuming(self,clauses,vocab,sorts_to_minimize=[]):
+        """ Return a HerbrandModel of the session's assertions and
+        clauses, or None if unsat. The model is shrunk as in
+        get_small_model. The clauses are asserted under a fresh
+        activation literal, which is disabled afterward. """
+        s = self.solver
+        act = z3.Const("__act%s" % self.num_acts, z3.BoolSort())
+        self.num_acts += 1
+        s.add(z3.Implies(act,clauses_to_z3(clauses)))
+        try:
+            if decide(s,[act]) == z3.unsat:
+                return None
+            s.push()  # to discard the size constraints
+            try:
+                return HerbrandModel(s,shrink_model(s,sorts_to_minimize,[act]),vocab)
+            finally:
+                s.pop()
+        finally:
+            s.add(z3.Not(act))
+
+    def check(self,*z3_fmlas):
+        """ Check z3_fmlas in a scope. Returns the check result and a model, or None if unsat. """
+        s = self.solver
+        s.push()
+        try:
+            for f in z3_fmlas:
+                s.add(f)
+            res = s.check()
+            return res, (get_model(s) if res != z3.unsat else None)
+        finally:
+            s.pop()
+
+    def clauses_imply(self,clauses1,clauses2):
+        """True if clauses1 and the axioms imply clauses2."""
+        res,m = self.check(clauses_to_z3(clauses1),not_clauses_to_z3(clauses2))
+        return res == z3.unsat
+
+    def clauses_imply_list(self,clauses1,clauses2_list):
+        """Like clauses_imply, for a list of clause sets clauses2_list."""
+        s = self.solver
+        s.push()
+        try:
+            s.add(clauses_to_z3(clauses1))
+            res = []
+            for clauses2 in clauses2_list:
+                s.push()
+                s.add(not_clauses_to_z3(clauses2))
+                res.append(s.check() == z3.unsat)
+                s.pop()
+            return res
+        finally:
+            s.pop()
+
+    def clauses_imply_list_cex(self,clauses1,clauses2_list):
+        """For each clause set in clauses2_list, return True if it is
+        implied by clauses1 and the axioms, else a HerbrandModel of
+        clauses1 and the axioms in which it is false (or None if the
+        solver is inconclusive).
+
+        The negated clause sets are asserted once, each guarded by an
+        assumption literal. Each query asks for a model of some
+        undecided negation, and the model is used to refute every
+        clause set it falsifies, so the number of solver calls is one
+        more than the number of distinct counterexamples.
+        """
+        s = self.solver
+        s.push()
+        try:
+            s.add(clauses_to_z3(clauses1))
+            alits = [z3.Const("__conj%s" % n, z3.BoolSort()) for n,c in enumerate(clauses2_list)]
+            negs = [not_clauses_to_z3(c) for c in clauses2_list]
+            for a,n in zip(alits,negs):
+                s.add(z3.Implies(a,n))
+            res = [True for c in clauses2_list]
+            undecided = range(len(clauses2_list))
+            vocab = None
+            while undecided:
+                s.push()
+                s.add(z3.Or([alits[i] for i in undecided]))
+                is_sat = s.check()
+                m = get_model(s) if is_sat == z3.sat else None
+                s.pop()
+                if is_sat == z3.unsat:
+                    break
+                if m is None:
+                    for i in undecided:
+                        res[i] = None
+                    break
+                if vocab is None:
+                    vocab = used_symbols_clauses(clauses1)
+                    vocab.update(used_symbols_clauses(self.axioms))
+                    for c in clauses2_list:
+                        vocab.update(used_symbols_clauses(c))
+                h = HerbrandModel(s,m,vocab)
+                refuted = set(i for i in undecided
+                              if z3.is_true(m.eval(alits[i],model_completion=True))
+                              or z3.is_true(m.eval(negs[i],model_completion=True)))
+                assert refuted
+                for i in refuted:
+                    res[i] = h
+                undecided = [i for i in undecided if i not in refuted]
+            return res
+        finally:
+            s.pop()
+
+    def clauses_imply_formula(self,clauses1,fmla2):
+        """True if clauses1 and the axioms imply fmla2."""
+        res,m = self.check(clauses_to_z3(clauses1),z3.Not(formula_to_z3(fmla2)))
+        return res == z3.unsat
+
+    def clauses_sat(self,clauses1):
+        """True if clauses1 is consistent with the axioms."""
+        res,m = self.check(clauses_to_z3(clauses1))
+        return res != z3.unsat
+
+    def get_model_clauses(self,clauses1):
+        """Return a HerbrandModel of clauses1 and the axioms, or None."""
+        res,m = self.check(clauses_to_z3(clauses1))
+        if res == z3.unsat:
+            return None
+        vocab = used_symbols_clauses(clauses1)
+        vocab.update(used_symbols_clauses(self.axioms))
+        return HerbrandModel(self.solver,m,vocab)
+
+    def unsat_core(self,clauses1,clauses2,implies=None,unlikely=lambda x:False):
+        """Like unsat_core, with the axioms added to clauses2."""
+        s = self.solver
+        s.push()
+        try:
+            return unsat_core_solver(s,clauses1,clauses2,implies,unlikely)
+        finally:
+            s.pop()
+
+def get_session(axioms):
+    """ Return a solver session for the background theory "axioms". """
+    if not incremental.get():
+        return SolverSession(axioms)
+    res = solver_sessions.get(id(axioms))
+    if res is None or res.axioms is not axioms:
+        res = SolverSession(axioms)
+        if len(solver_sessions) >= max_solver_sessions:
+            solver_sessions.popitem(last=False)
+        solver_sessions[id(axioms)] = res
+    return res
+
 def sort_size_constraint(sort,size):
     if isinstance(sort,ivy_logic.UninterpretedSort):
         syms = [ivy_logic.Symbol('__'+sort.name+'$'+str(i),sort) for i in range(size)]
@@ -793,7 +1428,7 @@ def size_constraint(x, size):
 def model_if_none(clauses1,implied,model):
     h = model
     if h == None:
-        s = z3.Solver()
+        s = new_solver()
         z3c = clauses_to_z3(clauses1)
         s.add(z3c)
         if implied != None:
@@ -841,7 +1476,7 @@ def get_small_model(clauses, sorts_to_minimize, relations_to_minimize, final_con
     Second, minimize the number of positive entries in the relations
     according to the order of relations_to_minimize.
     """
-    s = z3.Solver()
+    s = new_solver()
     s.add(clauses_to_z3(clauses))
     
     res = decide(s)
@@ -855,21 +1490,95 @@ def get_small_model(clauses, sorts_to_minimize, relations_to_minimize, final_con
             return None
 
 #    print "shrinking model {"
-    for x in chain(sorts_to_minimize, relations_to_minimize):
-        for n in itertools.count(1):
-            s.push()
-            sc = size_constraint(x, n)
-            s.add(formula_to_z3(sc))
-            res = decide(s)
-            if res == z3.sat:
-                break
-            else:
-                s.pop()
+    m = shrink_model(s,chain(sorts_to_minimize, relations_to_minimize))
 #    print "} shrinking model"
-    m = get_model(s)
     h = HerbrandModel(s,m,used_symbols_clauses(clauses))
     return h
 
+# Budget for model minimization. When either the number of checks or
+# the time in seconds is exceeded, the smallest model found so far is
+# used.
+
+small_model_budget = iu.Parameter("small_model_budget",None,check=lambda s: str(s).isdigit(),process=int)
+small_model_time = iu.Parameter("small_model_time",None,check=lambda s: str(s).replace('.','',1).isdigit(),process=float)
+
+size_lit_counter = itertools.count()
+
+def model_size(x,model):
+    """ Return the size of sort or relation x in a Z3 model, or None
+    if it is not known. """
+    if type(x) is lg.UninterpretedSort:
+        univ = model.get_universe(x.to_z3())
+        return len(univ) if univ is not None else None
+    if type(x) is lg.Const and type(x.sort) is lg.FunctionSort:
+        lit = ivy_logic.Literal(1,rel_inst(x))
+        try:
+            vs,rows = HerbrandModel(None,model,[]).structure.check(lit,list(variables_ast(lit)))
+        except UnsupportedFormula:
+            return None
+        return max(len(rows),1)
+    return None
+
+def shrink_model(s,things,assumptions=None):
+    """ Given a satisfiable solver s, successively constrain the size
+    of each of "things" (sorts or relations) to the least size that
+    remains satisfiable under the assumption literals, and return the
+    model found for these sizes.
+
+    Each size constraint is asserted under a fresh literal, and the
+    literal of the chosen size becomes an assumption for the
+    following things, so the solver is never pushed or popped. The
+    least size is found by binary search between one and the size
+    in the best model so far, which shrinks as smaller models are
+    found. If the budget runs out, the best model so far is returned.
+    """
+    assumptions = list(assumptions or [])
+    model = get_model(s)
+    budget,time_limit = small_model_budget.get(),small_model_time.get()
+    start,checks = time.time(),[0]
+
+    def exhausted():
+        return (budget is not None and checks[0] >= budget
+                or time_limit is not None and time.time() - start >= time_limit)
+
+    def size_lit(x,n):
+        lit = z3.Const("__size%s" % next(size_lit_counter), z3.BoolSort())
+        s.add(z3.Implies(lit,formula_to_z3(size_constraint(x, n))))
+        return lit
+
+    def try_size(lit):
+        checks[0] += 1
+        return decide(s,assumptions + [lit]) == z3.sat
+
+    for x in things:
+        hi = model_size(x,model)
+        if hi is None:
+            # size unknown: search upward
+            for n in itertools.count(1):
+                if exhausted():
+                    return model
+                lit = size_lit(x,n)
+                if try_size(lit):
+                    model = get_model(s)
+                    assumptions.append(lit)
+                    break
+            continue
+        lo,hi_lit = 1,None
+        while lo < hi:
+            if exhausted():
+                return model
+            mid = (lo + hi) // 2
+            lit = size_lit(x,mid)
+            if try_size(lit):
+                model = get_model(s)
+                size = model_size(x,model)
+                hi = mid if size is None else min(mid,size)
+                hi_lit = lit if hi == mid else None
+            else:
+                lo = mid + 1
+        assumptions.append(hi_lit if hi_lit is not None else size_lit(x,hi))
+    return model
+
 
 def model_universe_facts(h,sort,upclose):
     if ivy_logic.is_interpreted_sort(sort):
@@ -1007,7 +1716,7 @@ def filter_redundant_facts(clauses,axioms):
     fmlas = clauses.fmlas
     pos_fmlas = [fmla for fmla in fmlas if not isinstance(fmla,ivy_logic.Not)]
     neg_fmlas = [fmla for fmla in fmlas if isinstance(fmla,ivy_logic.Not)]
-    s2 = z3.Solver()
+    s2 = new_solver()
     alits = [z3.Const("__c%s" % n, z3.BoolSort()) for n,c in enumerate(neg_fmlas)]
     cc = [z3.Or(z3.Not(a),z3.Not(formula_to_z3(c))) for a,c in zip(alits,neg_fmlas)]
     s2.add(clauses_to_z3(axioms))
@@ -1129,7 +1838,7 @@ def function_model_to_clauses(h,f):
 def clauses_imply_formula(clauses1, fmla2):
     """True if clauses1 imply clauses2.
     """
-    s = z3.Solver()
+    s = new_solver()
     s.add(clauses_to_z3(clauses1))
     s.add(z3.Not(formula_to_z3(fmla2)))
 #    print s.to_smt2()
@@ -62,19 +62,298 @@ def indent_code(header,code):
     for line in code.split('\n'):
         header.append((indent_level * 4 + get_indent(line) - indent) * ' ' + line.strip() + '\n')
 
-def declare_symbol(header,sym,c_type = None):
+def declare_symbol(header,sym,c_type = None,prefix = ''):
     if slv.solver_name(sym) == None:
         return # skip interpreted symbols
     name, sort = sym.name,sym.sort
     if not c_type:
         c_type = 'bool' if sort.is_relational() else 'int'
     header.append('    ' + c_type + ' ')
-    header.append(varname(sym.name))
+    header.append(prefix + varname(sym.name))
     if hasattr(sort,'dom'):
         for d in sort.dom:
             header.append('[' + str(sort_card(d)) + ']')
     header.append(';\n')
 
+# State symbols whose domain includes a large or unbounded sort (see
+# is_sparse_sort) are stored sparsely, in a hash map (an ivy_sparse)
+# holding the cells whose value differs from a default value. As for
+# compact symbols, the generated code accesses a sparse symbol f
+# through an accessor f(x,y) returning a reference to the cell. The
+# values of unbounded sorts are represented by ints. Quantifiers over
+# an unbounded sort must be guarded by a sparse relation (see
+# emit_quant) so they can iterate over its stored cells. Quantifiers
+# over a finite sort, however large, can still loop over the whole
+# sort. Sparse symbols start with the default value (false or 0), and
+# native code cannot refer to them. The test generator (target=gen)
+# needs finite sorts, so it uses no sparse symbols.
+
+# A sort is large if it has more than sparse_limit elements. This only
+# decides how state is stored. It is also the largest domain for which
+# a dense array is initialized from a model (see check_representable).
+
+sparse_limit = iu.Parameter("sparse_limit",16,check=lambda s: str(s).isdigit(),process=int)
+
+sparse_class = """
+#include "hash.h"
+template <int N> struct ivy_key {
+    int args[N];
+    bool operator==(const ivy_key &other) const {
+        for (int i = 0; i < N; i++)
+            if (args[i] != other.args[i])
+                return false;
+        return true;
+    }
+};
+template <int N> struct ivy_key_hash {
+    size_t operator()(const ivy_key<N> &key) const {
+        size_t res = 0;
+        for (int i = 0; i < N; i++)
+            res = res * 31 + key.args[i];
+        return res;
+    }
+};
+template <class T, int N> struct ivy_sparse {
+    typedef hash_space::hash_map<ivy_key<N>,T,ivy_key_hash<N> > map_type;
+    map_type cells; // the cells whose value is not dflt
+    T dflt;
+    ivy_sparse() : dflt() {}
+    T get(const ivy_key<N> &key) {
+        typename map_type::iterator it = cells.find(key);
+        return it == cells.end() ? dflt : it->second;
+    }
+    void set(const ivy_key<N> &key, T value) {
+        if (value == dflt)
+            cells.erase(key);
+        else
+            cells[key] = value;
+    }
+    void fill(T value) {
+        cells.clear();
+        dflt = value;
+    }
+    struct ref {
+        ivy_sparse *map;
+        ivy_key<N> key;
+        ref(ivy_sparse *map, const ivy_key<N> &key) : map(map), key(key) {}
+        operator T() const {return map->get(key);}
+        ref &operator=(T value) {map->set(key,value); return *this;}
+        ref &operator=(const ref &other) {return *this = (T)other;}
+    };
+    ref at(const ivy_key<N> &key) {return ref(this,key);}
+};
+"""
+
+def is_sparse_sort(sort):
+    if target.get() == "gen":
+        return False
+    card = sort_card(sort)
+    return card is None or card > sparse_limit.get()
+
+sparse_symbols = set()
+
+# The sparse relations that some action fills with a value other than
+# false. Their stored cells are not their members, so they cannot
+# guard a quantifier.
+
+filled_sparse = set()
+
+def find_sparse_symbols(native_names):
+    global sparse_symbols, filled_sparse
+    sparse_symbols = set(sym for sym in all_state_symbols()
+                         if any(is_sparse_sort(s) for s in sort_domain(sym.sort))
+                         and slv.solver_name(sym) != None and sym not in is_derived)
+    for sym in sparse_symbols:
+        if sym.name in native_names:
+            raise iu.IvyError(None,'native code cannot refer to "{}" since its domain is unbounded'.format(sym))
+    filled_sparse = set()
+    actions = im.module.actions.values() + [a for n,a in im.module.initializers]
+    for action in actions:
+        for a in action.iter_subactions():
+            if isinstance(a,ia.AssignAction):
+                lhs,rhs = a.args
+                if (is_fill(lhs,rhs) and lhs.func in sparse_symbols and lhs.func.sort.is_relational()
+                    and not (rhs == lg.false or isinstance(rhs,lg.Or) and not rhs.args)):
+                    filled_sparse.add(lhs.func)
+
+def sparse_type(sym):
+    return 'ivy_sparse<{},{}>'.format('bool' if sym.sort.is_relational() else 'int',len(sort_domain(sym.sort)))
+
+def declare_sparse_symbol(header,sym):
+    """ Declare the storage, the accessor and the fill method of a
+    sparse symbol. """
+    cname = varname(sym.name)
+    arity = len(sort_domain(sym.sort))
+    vtype = 'bool' if sym.sort.is_relational() else 'int'
+    params = ','.join('int X{}'.format(idx) for idx in range(arity))
+    header.append('    {} __sparse_{};\n'.format(sparse_type(sym),cname))
+    header.append('    {}::ref {}({}) {{ivy_key<{}> k = {{{{{}}}}}; return __sparse_{}.at(k);}}\n'
+                  .format(sparse_type(sym),cname,params,arity,
+                          ','.join('X{}'.format(idx) for idx in range(arity)),cname))
+    header.append('    void ___ivy_fill_{}({} value) {{__sparse_{}.fill(value);}}\n'.format(cname,vtype,cname))
+
+# With layout=compact, the state symbols that take arguments are
+# stored in one flat array each, indexed by the arguments with
+# computed strides, rather than in nested arrays. Relations are packed
+# as bitsets. The generated code accesses a compact symbol f through
+# an inline accessor f(x,y) returning a reference to the cell (for a
+# relation, an ivy_bitref), so the code for actions is the same with
+# either layout. Symbols that native code refers to keep the dense
+# layout, since native code indexes them as nested arrays.
+
+layout = iu.EnumeratedParameter("layout",["dense","compact"],"dense")
+
+compact_class = """
+#include <algorithm>
+struct ivy_bitref {
+    unsigned long long *word;
+    unsigned long long mask;
+    ivy_bitref(unsigned long long *bits, unsigned idx) : word(bits + idx / 64), mask(1ULL << (idx % 64)) {}
+    operator bool() const {return (*word & mask) != 0;}
+    ivy_bitref &operator=(bool value) {
+        if (value) *word |= mask; else *word &= ~mask;
+        return *this;
+    }
+    ivy_bitref &operator=(const ivy_bitref &other) {return *this = (bool)other;}
+};
+"""
+
+compact_symbols = set()
+
+def find_compact_symbols(native_names):
+    global compact_symbols
+    compact_symbols = set()
+    if layout.get() == "compact":
+        compact_symbols = set(sym for sym in all_state_symbols()
+                              if len(sort_domain(sym.sort)) > 0 and slv.solver_name(sym) != None
+                              and sym not in sparse_symbols
+                              and sym not in is_derived and sym.name not in native_names)
+
+def cell_offset(sym,args):
+    """ The offset in the flat array of compact symbol sym of the cell
+    at args (C++ expressions). """
+    res = None
+    for a,dsort in zip(args,sort_domain(sym.sort)):
+        res = a if res is None else '({})*{}+{}'.format(res,sort_card(dsort),a)
+    return res
+
+def symbol_cell(sym,args,obj=None):
+    """ The C++ lvalue of the cell of state symbol sym at args (C++
+    expressions), in object obj, or this if obj is None. """
+    name = (obj + '.' if obj else '') + varname(sym.name)
+    if sym in compact_symbols:
+        return name + '(' + ','.join(args) + ')'
+    return name + ''.join('[' + a + ']' for a in args)
+
+def declare_compact_symbol(header,sym):
+    """ Declare the storage, the accessor and the fill method of a
+    compact symbol. """
+    cname = varname(sym.name)
+    size = num_cells(sym)
+    params = ','.join('int X{}'.format(idx) for idx in range(len(sort_domain(sym.sort))))
+    offset = cell_offset(sym,['X{}'.format(idx) for idx in range(len(sort_domain(sym.sort)))])
+    if sym.sort.is_relational():
+        words = (size + 63) / 64
+        header.append('    unsigned long long __bits_{}[{}];\n'.format(cname,words))
+        header.append('    ivy_bitref {}({}) {{return ivy_bitref(__bits_{},{});}}\n'.format(cname,params,cname,offset))
+        header.append('    void ___ivy_fill_{}(bool value) {{std::fill(__bits_{},__bits_{}+{},value ? ~0ULL : 0ULL);}}\n'
+                      .format(cname,cname,cname,words))
+    else:
+        header.append('    int __data_{}[{}];\n'.format(cname,size))
+        header.append('    int &{}({}) {{return __data_{}[{}];}}\n'.format(cname,params,cname,offset))
+        header.append('    void ___ivy_fill_{}(int value) {{std::fill(__data_{},__data_{}+{},value);}}\n'
+                      .format(cname,cname,cname,size))
+
+def is_fill(lhs,rhs):
+    """ True if the assignment lhs := rhs sets every cell of a symbol
+    to the same value. """
+    if not isinstance(lhs,lg.Apply):
+        return False
+    vs = lhs.args
+    return (all(isinstance(v,lg.Var) for v in vs) and len(set(vs)) == len(vs)
+            and not any(v in vs for v in lu.free_variables(rhs)))
+
+def emit_fill(header,lhs,rhs):
+    """ If the assignment lhs := rhs sets every cell of a compact or
+    sparse symbol to the same value, emit a call to its fill method and
+    return True. """
+    if not (is_fill(lhs,rhs) and (lhs.func in compact_symbols or lhs.func in sparse_symbols)):
+        return False
+    code_line(header,'___ivy_fill_{}({})'.format(varname(lhs.func.name),code_eval(header,rhs)))
+    return True
+
+# An index of a unary relation r is the list of the elements in r,
+# maintained on each assignment to r. Quantifiers guarded by r iterate
+# over the index (see emit_quant). We index only the unary relations
+# that native code does not refer to, since native code could modify
+# them behind our back.
+
+index_class = """
+struct ivy_index {
+    std::vector<int> members; // the elements in the relation
+    std::vector<int> pos;     // the position of each element in members, or -1
+    void init(int card) {
+        members.clear();
+        pos.assign(card,-1);
+    }
+    void update(int x, bool value) {
+        if (value && pos[x] < 0) {
+            pos[x] = members.size();
+            members.push_back(x);
+        }
+        else if (!value && pos[x] >= 0) {
+            int y = members.back();
+            members[pos[x]] = y;
+            pos[y] = pos[x];
+            members.pop_back();
+            pos[x] = -1;
+        }
+    }
+};
+"""
+
+indexed_relations = set()
+
+def find_indexed_relations(native_names):
+    global indexed_relations
+    indexed_relations = set(sym for sym in all_state_symbols()
+                            if sym.sort.is_relational() and len(sort_domain(sym.sort)) == 1
+                            and slv.solver_name(sym) != None and sym not in is_derived
+                            and sym not in sparse_symbols and sym.name not in native_names)
+
+def index_name(sym):
+    return '__idx_' + varname(sym.name)
+
+def emit_indices(header,impl,classname):
+    """ Declare the indices and the method that rebuilds them from the
+    state. """
+    if not indexed_relations:
+        return
+    header.append('    void ___ivy_rebuild_indices();\n')
+    impl.append('void ' + classname + '::___ivy_rebuild_indices(){\n')
+    for sym in sorted(indexed_relations,key=lambda s: s.name):
+        header.append('    ivy_index ' + index_name(sym) + ';\n')
+        card = sort_card(sort_domain(sym.sort)[0])
+        impl.append('    {}.init({});\n'.format(index_name(sym),card))
+        impl.append('    for (int X = 0; X < {}; X++)\n'.format(card))
+        impl.append('        {}.update(X,{});\n'.format(index_name(sym),symbol_cell(sym,['X'])))
+    impl.append('}\n')
+
+def emit_index_update(header,lhs):
+    """ Emit code to update the index of relation, if any, after an
+    assignment to lhs. """
+    if isinstance(lhs,lg.Apply) and lhs.func in indexed_relations:
+        code_line(header,'{}.update({},{})'.format(index_name(lhs.func),code_eval(header,lhs.args[0]),
+                                                   code_eval(header,lhs)))
+
+def emit_index_fill(header,lhs):
+    """ Emit code to rebuild the index of relation, if any, after it
+    is filled. """
+    if lhs.func in indexed_relations:
+        card = sort_card(sort_domain(lhs.func.sort)[0])
+        code_line(header,'for (int __X = 0; __X < {}; __X++) {}.update(__X,{})'
+                  .format(card,index_name(lhs.func),symbol_cell(lhs.func,['__X'])))
+
 special_names = {
     '<' : '__lt',
     '<=' : '__le',
@@ -162,33 +441,62 @@ def emit_eval(header,symbol,obj=None):
         header.append("for (int X{} = 0; X{} < {}; X{}++)\n".format(idx,idx,dcard,idx))
         indent_level += 1
     indent(header)
-    header.append((obj + '.' if obj else '')
-                  + cname + ''.join("[X{}]".format(idx) for idx in range(len(domain)))
+    header.append(symbol_cell(symbol,["X{}".format(idx) for idx in range(len(domain))],obj)
                   + ' = eval_apply("{}"'.format(sname)
                   + ''.join(",X{}".format(idx) for idx in range(len(domain)))
                   + ");\n")
     for idx,dsort in enumerate(domain):
         indent_level -= 1    
 
-def emit_set(header,symbol): 
+def num_cells(symbol):
+    res = 1
+    for dsort in sort_domain(symbol.sort):
+        res *= sort_card(dsort)
+    return res
+
+# A test generator keeps the values of the state symbols in its solver,
+# so that it need not assert the whole state on each call to generate.
+# The generator keeps a copy of the state it last saw (prefixed with
+# ___last_), and on each call passes the cells (that is, each symbol
+# applied to each tuple of arguments) that changed to gen::set_state.
+# Only the cells that changed since the state was last asserted are
+# passed to the solver as assumptions (see gen::sync_state). Comparing
+# the cells with their last values is still linear in the size of the
+# state, but is not solver work.
+
+def emit_sync(header,symbol,offset):
+    """ Emit code to update the state cells of symbol, numbered from
+    offset, that changed since the last call. Returns the number of
+    the first cell following those of symbol. """
     global indent_level
-    name = symbol.name
     sname = slv.solver_name(symbol)
-    cname = varname(name)
-    sort = symbol.sort
-    domain = sort_domain(sort)
+    cname = varname(symbol.name)
+    domain = sort_domain(symbol.sort)
+    cell = None
     for idx,dsort in enumerate(domain):
         dcard = sort_card(dsort)
         indent(header)
         header.append("for (int X{} = 0; X{} < {}; X{}++)\n".format(idx,idx,dcard,idx))
         indent_level += 1
+        cell = "X0" if cell is None else "({})*{}+X{}".format(cell,dcard,idx)
+    cell = str(offset) if cell is None else "{}+{}".format(offset,cell)
+    args = ''.join("[X{}]".format(idx) for idx in range(len(domain)))
+    value = symbol_cell(symbol,["X{}".format(idx) for idx in range(len(domain))],'obj')
+    indent(header)
+    header.append("if (!state_synced || {} != ___last_{}{}) {{\n".format(value,cname,args))
+    indent_level += 1
     indent(header)
-    header.append('set("{}"'.format(sname)
+    header.append('set_state({},"{}"'.format(cell,sname)
                   + ''.join(",X{}".format(idx) for idx in range(len(domain)))
-                  + ",obj.{}".format(cname)+ ''.join("[X{}]".format(idx) for idx in range(len(domain)))
-                  + ");\n")
+                  + ",{});\n".format(value))
+    indent(header)
+    header.append("___last_{}{} = {};\n".format(cname,args,value))
+    indent_level -= 1
+    indent(header)
+    header.append("}\n")
     for idx,dsort in enumerate(domain):
-        indent_level -= 1    
+        indent_level -= 1
+    return offset + num_cells(symbol)
 
 def emit_eval_sig(header,obj=None):
     for symbol in all_state_symbols():
@@ -251,6 +559,8 @@ public:
     indent_level += 2
     emit_eval_sig(impl,'obj')
     emit_clear_progress(impl,'obj')
+    if indexed_relations:
+        code_line(impl,'obj.___ivy_rebuild_indices()')
     indent_level -= 2
     impl.append("""
     }
@@ -304,71 +614,29 @@ def emit_action_gen(header,impl,name,action,classname):
     indent(impl)
     impl.append('add("(assert {})");\n'.format(slv.formula_to_z3(pre).sexpr().replace('\n','\\\n')))
     indent_level -= 1
-    impl.append("}\n");
-    header.append("    bool generate(" + classname + "&);\n};\n");
-    impl.append("bool " + caname + "_gen::generate(" + classname + "& obj) {\n    push();\n")
-    indent_level += 1
     pre_used = ilu.used_symbols_ast(pre)
-    for sym in all_state_symbols():
-        if sym in pre_used and sym not in pre_clauses.defidx: # skip symbols not used in constraint
-            if slv.solver_name(sym) != None: # skip interpreted symbols
-                global is_derived
-                if sym not in is_derived:
-                    emit_set(impl,sym)
-    for sym in syms:
-        if not sym.name.startswith('__ts') and sym not in pre_clauses.defidx:
-            emit_randomize(impl,sym)
-    impl.append("""
-    bool res = solve();
-    if (res) {
-""")
-    indent_level += 1
-    for sym in syms:
-        if not sym.name.startswith('__ts') and sym not in pre_clauses.defidx:
-            emit_eval(impl,sym)
-    indent_level -= 2
-    impl.append("""
-    }
-    pop();
-    obj.___ivy_gen = this;
-    return res;
-}
-""")
-
-def emit_action_gen(header,impl,name,action,classname):
-    global indent_level
-    caname = varname(name)
-    upd = action.update(im.module,None)
-    pre = tr.reverse_image(ilu.true_clauses(),ilu.true_clauses(),upd)
-    pre_clauses = ilu.trim_clauses(pre)
-    pre_clauses = ilu.and_clauses(pre_clauses,ilu.Clauses([df.to_constraint() for df in im.module.concepts]))
-    pre = pre_clauses.to_formula()
-    syms = [x for x in ilu.used_symbols_ast(pre) if x.name not in il.sig.symbols]
-    header.append("class " + caname + "_gen : public gen {\n  public:\n")
-    for sym in syms:
-        if not sym.name.startswith('__ts') and sym not in pre_clauses.defidx:
-            declare_symbol(header,sym)
-    header.append("    {}_gen();\n".format(caname))
-    impl.append(caname + "_gen::" + caname + "_gen(){\n");
+    global is_derived
+    state_syms = [sym for sym in all_state_symbols()
+                  if sym in pre_used and sym not in pre_clauses.defidx # skip symbols not used in constraint
+                  and slv.solver_name(sym) != None  # skip interpreted symbols
+                  and sym not in is_derived]
+    for sym in state_syms:
+        declare_symbol(header,sym,prefix='___last_')
     indent_level += 1
-    emit_sig(impl)
-    for sym in syms:
-        emit_decl(impl,sym)
-    
     indent(impl)
-    impl.append('add("(assert {})");\n'.format(slv.formula_to_z3(pre).sexpr().replace('\n','\\\n')))
+    impl.append('mk_state_cells({});\n'.format(sum(num_cells(sym) for sym in state_syms)))
     indent_level -= 1
     impl.append("}\n");
     header.append("    bool generate(" + classname + "&);\n};\n");
-    impl.append("bool " + caname + "_gen::generate(" + classname + "& obj) {\n    push();\n")
+    impl.append("bool " + caname + "_gen::generate(" + classname + "& obj) {\n")
     indent_level += 1
-    pre_used = ilu.used_symbols_ast(pre)
-    for sym in all_state_symbols():
-        if sym in pre_used and sym not in pre_clauses.defidx: # skip symbols not used in constraint
-            if slv.solver_name(sym) != None: # skip interpreted symbols
-                global is_derived
-                if sym not in is_derived:
-                    emit_set(impl,sym)
+    offset = 0
+    for sym in state_syms:
+        offset = emit_sync(impl,sym,offset)
+    indent(impl)
+    impl.append('sync_state();\n')
+    indent(impl)
+    impl.append('push();\n')
     for sym in syms:
         if not sym.name.startswith('__ts') and sym not in pre_clauses.defidx:
             emit_randomize(impl,sym)
@@ -520,9 +788,14 @@ def init_method():
     res.formal_returns = []
     return res
 
+def check_dense_sort(sort,ast=None):
+    if sort_card(sort) is None:
+        raise iu.IvyError(ast,'cannot iterate over type {} because it is unbounded'.format(sort))
+
 def open_loop(impl,vs,declare=True):
     global indent_level
     for idx in vs:
+        check_dense_sort(idx.sort)
         indent(impl)
         impl.append('for ('+ ('int ' if declare else '') + idx.name + ' = 0; ' + idx.name + ' < ' + str(sort_card(idx.sort)) + '; ' + idx.name + '++) {\n')
         indent_level += 1
@@ -646,6 +919,16 @@ def module_to_cpp_class(classname):
     for df in im.module.concepts:
         is_derived.add(df.defines())
 
+    native_names = set()
+    for n in im.module.natives:
+        native_names.update(e.rep for e in n.args[2:] if isinstance(e,ivy_ast.Atom))
+    for n in im.module.actions.values():
+        if isinstance(n,ia.NativeAction):
+            native_names.update(e.rep for e in n.args[1:] if isinstance(e,ivy_ast.Atom))
+    find_sparse_symbols(native_names)
+    find_indexed_relations(native_names)
+    find_compact_symbols(native_names)
+
     # remove the actions not reachable from exported
         
 # TODO: may want to call internal actions from testbench
@@ -661,6 +944,11 @@ def module_to_cpp_class(classname):
         header.append('extern int choose(int,int);\n')
         header.append('struct ivy_gen {virtual int choose(int rng,const char *name) = 0;};\n')
     header.append('#include <vector>\n')
+    header.append(index_class)
+    if layout.get() == "compact":
+        header.append(compact_class)
+    if sparse_symbols:
+        header.append(sparse_class)
 
     once_memo = set()
     for native in im.module.natives:
@@ -757,10 +1045,15 @@ void install_timer(timer *);
     }
 """)
     for sym in all_state_symbols():
-        if sym not in is_derived:
+        if sym in sparse_symbols:
+            declare_sparse_symbol(header,sym)
+        elif sym in compact_symbols:
+            declare_compact_symbol(header,sym)
+        elif sym not in is_derived:
             declare_symbol(header,sym)
     for sym in il.sig.constructors:
         declare_symbol(header,sym)
+    emit_indices(header,impl,classname)
     for sname in il.sig.interp:
         header.append('    int __CARD__' + varname(sname) + ';\n')
     for df in im.module.concepts:
@@ -870,11 +1163,36 @@ def check_representable(sym,ast=None):
             card = sort_card(domsort)
             if card == None:
                 raise iu.IvyError(ast,'cannot compile "{}" because type {} is uninterpreted'.format(sym,domsort))
-            if card > 16:
+            if card > sparse_limit.get():
                 raise iu.IvyError(ast,'cannot compile "{}" because type {} is large'.format(sym,domsort))
 
 cstr = il.fmla_to_str_ambiguous
 
+def sparse_init_constraints():
+    """ Return the constraint that the sparse relations are initially
+    empty, since the sparse symbols start with the default value. The
+    initial value of a sparse function cannot be constrained. """
+    used = ilu.used_symbols_clauses(im.module.init_cond)
+    fmlas = []
+    for sym in sparse_symbols:
+        if sym.sort.is_relational():
+            vs = [il.Variable('X{}'.format(idx),s) for idx,s in enumerate(sort_domain(sym.sort))]
+            fmlas.append(il.ForAll(vs,il.Not(sym(*vs))))
+        elif sym in used:
+            raise iu.IvyError(None,'cannot compile initial value of "{}" because its domain is unbounded'.format(sym))
+    return ilu.Clauses(fmlas)
+
+# Elements of unbounded uninterpreted sorts in the initial model are
+# numbered in order of appearance.
+
+element_numbers = {}
+
+def model_value_str(val):
+    if is_sparse_sort(val.sort) and not il.is_interpreted_sort(val.sort):
+        nums = element_numbers.setdefault(val.sort,{})
+        return str(nums.setdefault(val,len(nums)))
+    return cstr(val)
+
 def assign_symbol_from_model(header,sym,m):
     if slv.solver_name(sym) == None:
         return # skip interpreted symbols
@@ -884,10 +1202,10 @@ def assign_symbol_from_model(header,sym,m):
         for args in itertools.product(*[range(sort_card(s)) for s in sym.sort.dom]):
             term = sym(*[il.Symbol(str(a),s) for a,s in zip(args,sym.sort.dom)])
             val = m.eval_to_constant(term)
-            header.append(varname(sym.name) + ''.join('['+str(a)+']' for a in args) + ' = ')
-            header.append(cstr(val) + ';\n')
+            header.append(symbol_cell(sym,map(str,args)) + ' = ')
+            header.append(model_value_str(val) + ';\n')
     else:
-        header.append(varname(sym.name) + ' = ' + cstr(m.eval_to_constant(sym)) + ';\n')
+        header.append(varname(sym.name) + ' = ' + model_value_str(m.eval_to_constant(sym)) + ';\n')
         
 def check_init_cond(kind,lfmlas):
     params = set(im.module.params)
@@ -900,15 +1218,19 @@ def emit_one_initial_state(header):
     check_init_cond("initial condition",im.module.labeled_inits)
     check_init_cond("axiom",im.module.labeled_axioms)
         
-    m = slv.get_model_clauses(ilu.and_clauses(im.module.init_cond,im.module.background_theory()))
+    m = slv.get_model_clauses(ilu.and_clauses(im.module.init_cond,im.module.background_theory(),
+                                              sparse_init_constraints()))
     if m == None:
         raise IvyError(None,'Initial condition is inconsistent')
+    element_numbers.clear()
     for sym in all_state_symbols():
         if sym in im.module.params:
             name = varname(sym)
             header.append('    this->{} = {};\n'.format(name,name))
-        elif sym not in is_derived:
+        elif sym not in is_derived and sym not in sparse_symbols:
             assign_symbol_from_model(header,sym,m)
+    if indexed_relations:
+        header.append('___ivy_rebuild_indices();\n')
     action = ia.Sequence(*[a for n,a in im.module.initializers])
     action.emit(header)
 
@@ -987,7 +1309,7 @@ def emit_app(self,header,code):
     # handle uninterpreted ops
     code.append(varname(self.func.name))
     global is_derived
-    if self.func in is_derived:
+    if self.func in is_derived or self.func in compact_symbols or self.func in sparse_symbols:
         code.append('(')
         first = True
         for a in self.args:
@@ -1014,6 +1336,65 @@ def new_temp(header):
     header.append('int ' + name + ';\n')
     return name
 
+# The loop for a quantifier exits as soon as its value is known. If
+# the body of the quantifier is guarded by an indexed or sparse
+# relation r on the quantified variable (that is, the body is
+# "r(...X...) & ..." for an existential or "r(...X...) -> ..." or
+# "~r(...X...) | ..." for a universal) the loop ranges over only the elements in r (for a
+# sparse relation, the values of X in its stored cells, possibly with
+# repetitions). A sparse relation that is filled with true (see
+# filled_sparse) stores its non-members, so it is not used as a guard.
+
+def quant_guard(v,body,exists):
+    """ Return a pair (r,pos) where r is a relation guarding body and
+    pos is the position of v in its arguments, or None. """
+    if exists:
+        guards = body.args if isinstance(body,lg.And) else [body]
+    elif isinstance(body,lg.Implies):
+        guard = body.args[0]
+        guards = guard.args if isinstance(guard,lg.And) else [guard]
+    else:
+        guards = [d.args[0] for d in (body.args if isinstance(body,lg.Or) else [body])
+                  if isinstance(d,lg.Not)]
+    for c in guards:
+        if isinstance(c,lg.Apply):
+            if c.func in indexed_relations and c.args[0] == v:
+                return c.func,0
+            if (c.func in sparse_symbols and c.func.sort.is_relational() and v in c.args
+                and c.func not in filled_sparse):
+                return c.func,list(c.args).index(v)
+    return None
+
+def open_quant_loop(header,v,body,exists,going):
+    """ Open a loop over the values of variable v that may satisfy body
+    if exists, else falsify it, exiting when going (if not None) is
+    false. """
+    global indent_level
+    idx = v.name
+    going = ' && ' + going if going else ''
+    guard = quant_guard(v,body,exists)
+    if guard is None:
+        check_dense_sort(v.sort,body)
+        indent(header)
+        header.append('for (int ' + idx + ' = 0; ' + idx + ' < ' + str(sort_card(v.sort)) + going + '; ' + idx + '++) {\n')
+        indent_level += 1
+        return
+    rel,pos = guard
+    if rel in sparse_symbols:
+        cells = '__sparse_' + varname(rel.name)
+        indent(header)
+        header.append('for ({}::map_type::iterator __I{} = {}.cells.begin(); __I{} != {}.cells.end(){}; ++__I{}) {{\n'
+                      .format(sparse_type(rel),idx,cells,idx,cells,going,idx))
+        indent_level += 1
+        code_asgn(header,'int ' + idx,'__I{}->first.args[{}]'.format(idx,pos))
+    else:
+        members = index_name(rel) + '.members'
+        indent(header)
+        header.append('for (unsigned __I{} = 0; __I{} < {}.size(){}; __I{}++) {{\n'
+                      .format(idx,idx,members,going,idx))
+        indent_level += 1
+        code_asgn(header,'int ' + idx,'{}[__I{}]'.format(members,idx))
+
 def emit_quant(variables,body,header,code,exists=False):
     global indent_level
     if len(variables) == 0:
@@ -1022,12 +1403,9 @@ def emit_quant(variables,body,header,code,exists=False):
     v0 = variables[0]
     variables = variables[1:]
     res = new_temp(header)
-    idx = v0.name
     indent(header)
     header.append(res + ' = ' + str(0 if exists else 1) + ';\n')
-    indent(header)
-    header.append('for (int ' + idx + ' = 0; ' + idx + ' < ' + str(sort_card(v0.sort)) + '; ' + idx + '++) {\n')
-    indent_level += 1
+    open_quant_loop(header,v0,body,exists,('!' if exists else '') + res)
     subcode = []
     emit_quant(variables,body,header,subcode,exists)
     indent(header)
@@ -1063,7 +1441,8 @@ def emit_some(self,header,code):
     code_asgn(header,some,'0')
     if isinstance(self,ivy_ast.SomeMinMax):
         minmax = new_temp(header)
-    open_loop(header,vs)
+    for v in vs:
+        open_quant_loop(header,v,fmla,True,None if isinstance(self,ivy_ast.SomeMinMax) else '!'+some)
     open_if(header,code_eval(header,fmla))
     if isinstance(self,ivy_ast.SomeMinMax):
         index = new_temp(header)
@@ -1131,6 +1510,7 @@ def emit_assign_simple(self,header):
     self.args[1].emit(header,code)
     code.append(';\n')    
     header.extend(code)
+    emit_index_update(header,self.args[0])
 
 def emit_assign(self,header):
     global indent_level
@@ -1138,6 +1518,11 @@ def emit_assign(self,header):
     if len(vs) == 0:
         emit_assign_simple(self,header)
         return
+    if emit_fill(header,self.args[0],self.args[1]):
+        emit_index_fill(header,self.args[0])
+        return
+    for v in vs:
+        check_dense_sort(v.sort,self)
     global temp_ctr
     tmp = '__tmp' + str(temp_ctr)
     temp_ctr += 1
@@ -1169,6 +1554,7 @@ def emit_assign(self,header):
     self.args[0].emit(header,code)
     code.append(' = ' + tmp + ''.join('['+varname(v.name)+']' for v in vs) + ';\n')
     header.extend(code)
+    emit_index_update(header,self.args[0])
     for idx in vs:
         indent_level -= 1
         indent(header)
@@ -1234,6 +1620,8 @@ def emit_call(self,header):
         first = False
     code.append(');\n')    
     header.extend(code)
+    if len(self.args) == 2:
+        emit_index_update(header,self.args[1])
     indent(header)
     header.append('___ivy_stack.pop_back();\n')
 
@@ -1248,7 +1636,8 @@ def local_start(header,params,nondet_id=None):
         indent(header)
         header.append('int ' + varname(p.name) + ';\n')
         if nondet_id != None:
-            mk_nondet(header,p.name,sort_card(p.sort),p.name,nondet_id)
+            card = sort_card(p.sort)
+            mk_nondet(header,p.name,0 if card is None else card,p.name,nondet_id)
 
 def local_end(header):
     global indent_level
@@ -1621,7 +2010,8 @@ protected:
     z3::solver slvr;
     z3::model model;
 
-    gen(): slvr(ctx), model(ctx,(Z3_model)0) {}
+    gen(): slvr(ctx), model(ctx,(Z3_model)0), state_synced(false), state_scope(false),
+           rebuild_state(true), num_state_lits(0), num_alits(0) {}
 
     hash_map<std::string, z3::sort> enum_sorts;
     hash_map<Z3_sort, z3::func_decl_vector> enum_values;
@@ -1632,6 +2022,16 @@ protected:
     std::vector<Z3_symbol> decl_names;
     std::vector<Z3_func_decl> decls;
     std::vector<z3::expr> alits;
+    std::vector<z3::expr> alit_terms;
+    unsigned num_alits;
+    std::vector<z3::expr> cell_preds;
+    std::vector<z3::expr> state_lits;
+    std::vector<bool> is_changed;
+    std::vector<unsigned> changed_cells;
+    bool state_synced;
+    bool state_scope;
+    bool rebuild_state;
+    unsigned num_state_lits;
 
 
 public:
@@ -1703,39 +2103,88 @@ public:
         return enum_values.find(range)->second.size();
     }
 
-    int set(const char *decl_name, unsigned num_args, const int *args, int value) {
+    void mk_state_cells(unsigned num_cells) {
+        for (unsigned i = 0; i < num_cells; i++) {
+            cell_preds.push_back(ctx.bool_val(true));
+            state_lits.push_back(ctx.bool_val(true));
+        }
+        is_changed.resize(num_cells,false);
+    }
+
+    // The state is asserted in a solver scope of its own, below the
+    // scope of the randomization constraints. A cell that has not
+    // changed since this scope was built is asserted as a plain fact.
+    // A cell that has changed is asserted under an assumption literal,
+    // and only these literals are passed to the solver. When a cell
+    // changes for the first time, or when there are too many changed
+    // cells or literals, sync_state pops the state scope, which drops
+    // the old literals, and builds it again.
+
+    void set_state(unsigned cell, const char *decl_name, unsigned num_args, const int *args, int value) {
         z3::func_decl decl = decls_by_name.find(decl_name)->second;
-        std::vector<z3::expr> expr_args;
-        unsigned arity = decl.arity();
-        assert(arity == num_args);
-        for(unsigned i = 0; i < arity; i ++) {
-            z3::sort sort = decl.domain(i);
-            expr_args.push_back(int_to_z3(sort,args[i]));
+        cell_preds[cell] = mk_apply_expr(decl_name,num_args,args) == int_to_z3(decl.range(),value);
+        if (!state_synced)
+            return;
+        if (!is_changed[cell]) {
+            is_changed[cell] = true;
+            changed_cells.push_back(cell);
+            rebuild_state = true;
         }
-        z3::expr apply_expr = decl(arity,&expr_args[0]);
-        z3::sort range = decl.range();
-        z3::expr val_expr = int_to_z3(range,value);
-        z3::expr pred = apply_expr == val_expr;
-        //        std::cout << "pred: " << pred << std::endl;
-        slvr.add(pred);
+        else if (!rebuild_state)
+            add_state_lit(cell);
+    }
+
+    void add_state_lit(unsigned cell) {
+        std::ostringstream ss;
+        ss << "slit:" << num_state_lits++;
+        z3::expr slit = ctx.bool_const(ss.str().c_str());
+        slvr.add(!slit || cell_preds[cell]);
+        state_lits[cell] = slit;
+    }
+
+    // Call after setting every cell, before push.
+
+    void sync_state() {
+        state_synced = true;
+        if (num_state_lits > 2 * cell_preds.size() + 64)
+            rebuild_state = true;
+        if (!rebuild_state)
+            return;
+        if (2 * changed_cells.size() > cell_preds.size()) {
+            for (unsigned i = 0; i < changed_cells.size(); i++)
+                is_changed[changed_cells[i]] = false;
+            changed_cells.clear();
+        }
+        if (state_scope)
+            slvr.pop();
+        slvr.push();
+        state_scope = true;
+        num_state_lits = 0;
+        for (unsigned i = 0; i < cell_preds.size(); i++) {
+            if (is_changed[i])
+                add_state_lit(i);
+            else
+                slvr.add(cell_preds[i]);
+        }
+        rebuild_state = false;
     }
 
-    int set(const char *decl_name, int value) {
-        return set(decl_name,0,(int *)0,value);
+    void set_state(unsigned cell, const char *decl_name, int value) {
+        set_state(cell,decl_name,0,(int *)0,value);
     }
 
-    int set(const char *decl_name, int arg0, int value) {
-        return set(decl_name,1,&arg0,value);
+    void set_state(unsigned cell, const char *decl_name, int arg0, int value) {
+        set_state(cell,decl_name,1,&arg0,value);
     }
     
-    int set(const char *decl_name, int arg0, int arg1, int value) {
+    void set_state(unsigned cell, const char *decl_name, int arg0, int arg1, int value) {
         int args[2] = {arg0,arg1};
-        return set(decl_name,2,args,value);
+        set_state(cell,decl_name,2,args,value);
     }
 
-    int set(const char *decl_name, int arg0, int arg1, int arg2, int value) {
+    void set_state(unsigned cell, const char *decl_name, int arg0, int arg1, int arg2, int value) {
         int args[3] = {arg0,arg1,arg2};
-        return set(decl_name,3,args,value);
+        set_state(cell,decl_name,3,args,value);
     }
 
     void randomize(const char *decl_name, unsigned num_args, const int *args) {
@@ -1747,11 +2196,16 @@ public:
         z3::expr val_expr = int_to_z3(range,value);
         z3::expr pred = apply_expr == val_expr;
         // std::cout << "pred: " << pred << std::endl;
+        alit_terms.push_back(apply_expr);
+        alits.push_back(mk_alit(pred));
+    }
+
+    z3::expr mk_alit(const z3::expr &pred) {
         std::ostringstream ss;
-        ss << "alit:" << alits.size();
+        ss << "alit:" << num_alits++;
         z3::expr alit = ctx.bool_const(ss.str().c_str());
-        alits.push_back(alit);
         slvr.add(!alit || pred);
+        return alit;
     }
 
     void randomize(const char *decl_name) {
@@ -1825,26 +2279,60 @@ public:
         slvr.add(fmla);
     }
 
+    // Find a model, satisfying as many of the random values chosen by
+    // randomize as is easy. When the random values are inconsistent,
+    // we choose new random values for the terms of the alits in the
+    // unsat core, up to max_redraws times. The solver's choices are
+    // biased, so this keeps the inputs random when there are values
+    // that work. After that, we drop all of the alits in the core at
+    // once, rather than one per check, and let the solver choose.
+
+    static const unsigned max_redraws = 4;
+
     bool solve() {
         // std::cout << alits.size();
+        unsigned redraws = 0;
         while(true){
-            z3::check_result res = slvr.check(alits.size(),&alits[0]);
+            std::vector<z3::expr> assumptions;
+            for (unsigned i = 0; i < changed_cells.size(); i++)
+                assumptions.push_back(state_lits[changed_cells[i]]);
+            assumptions.insert(assumptions.end(),alits.begin(),alits.end());
+            z3::check_result res = slvr.check(assumptions.size(),&assumptions[0]);
             if (res != z3::unsat)
                 break;
+            // the state is fixed, so delete only alits
             z3::expr_vector core = slvr.unsat_core();
-            if (core.size() == 0)
+            std::vector<bool> in_core(alits.size(),false);
+            bool found = false;
+            for (unsigned j = 0; j < core.size(); j++)
+                for (unsigned i = 0; i < alits.size(); i++)
+                    if (z3::eq(alits[i],core[j]))
+                        in_core[i] = found = true;
+            if (!found) {
+                alits.clear();
+                alit_terms.clear();
                 return false;
-            unsigned idx = rand() % core.size();
-            z3::expr to_delete = core[idx];
+            }
+            if (redraws++ < max_redraws) {
+                for (unsigned i = 0; i < alits.size(); i++)
+                    if (in_core[i]) {
+                        z3::sort range = alit_terms[i].get_sort();
+                        alits[i] = mk_alit(alit_terms[i] == int_to_z3(range,rand() % sort_card(range)));
+                    }
+                continue;
+            }
+            unsigned k = 0;
             for (unsigned i = 0; i < alits.size(); i++)
-                if (z3::eq(alits[i],to_delete)) {
-                    alits[i] = alits.back();
-                    alits.pop_back();
-                    break;
+                if (!in_core[i]) {
+                    alit_terms[k] = alit_terms[i];
+                    alits[k++] = alits[i];
                 }
+            alits.erase(alits.begin()+k,alits.end());
+            alit_terms.erase(alit_terms.begin()+k,alit_terms.end());
         }
         model = slvr.get_model();
         alits.clear();
+        alit_terms.clear();
         //        std::cout << model;
         return true;
     }
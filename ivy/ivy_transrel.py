@@ -35,11 +35,12 @@ from ivy_logic_utils import used_symbols_clauses, rename_clauses, clauses_using_
     relations_clauses, eq_lit, condition_clauses, or_clauses, and_clauses, false_clauses, true_clauses,\
     formula_to_clauses, clauses_to_formula, formula_to_clauses_tseitin, is_ground_clause, \
     relations_clause, Clauses, sym_inst, negate_clauses, negate
-from ivy_solver import unsat_core, clauses_imply, clauses_imply_formula, clauses_sat, clauses_case, get_model_clauses, clauses_model_to_clauses, get_small_model
+from ivy_solver import unsat_core, clauses_imply, clauses_imply_formula, clauses_sat, clauses_case, get_model_clauses, clauses_model_to_clauses, get_small_model, get_session, SolverSession
 import ivy_logic
 import ivy_logic_utils as lu
 import ivy_utils as iu
 from logic_util import is_tautology_equality
+import time
 
 
 def new(sym):
@@ -207,13 +208,14 @@ def implies(s1,s2,axioms,relations,op):
 #    print "c1: {}".format(c1)
 #    print "axioms: {}".format(axioms)
 #    print "df: {}".format(diff_frame(u1,u2,relations,op))
-    c1 = and_clauses(c1,axioms,diff_frame(u1,u2,relations,op))
+    c1 = and_clauses(c1,diff_frame(u1,u2,relations,op))
     if isinstance(c2,Clauses):
         if not c2.is_universal_first_order() or not p2.is_universal_first_order():
             return False
         c2 = and_clauses(c2,diff_frame(u2,u1,relations,op))
-        return clauses_imply(p1,p2) and clauses_imply(c1,c2)
+        return clauses_imply(p1,p2) and get_session(axioms).clauses_imply(c1,c2)
     else:
+        c1 = and_clauses(c1,axioms)
         if not is_prenex_universal(c2) or not is_prenex_universal(p2):
             return False
         c2 = And(c2,clauses_to_formula(diff_frame(u2,u1,relations,op)))
@@ -587,5 +589,92 @@ class History(object):
         return uvs, [pure_state(clauses) for clauses in reversed(states)]
 
 
+class IncrementalBMC(object):
+    """ Bounded model checking over a growing sequence of updates using
+    a single incremental solver.
+
+    Unlike History, which renames the whole history at each step, the
+    checker gives each updated symbol a fresh (skolem) name at each
+    time, so the transition relation of each step is asserted once and
+    never changes. A condition on the final state is checked under an
+    activation literal, so checking at depth k does not disturb the
+    solver state for depth k+1. The time taken by the checks at each
+    depth is recorded in "times".
+    """
+
+    def __init__(self,state,axioms):
+        """ state is the initial (pure) state """
+        update,clauses,pre = state
+        assert update == None and pre.is_false()
+        clauses = clausify(clauses)
+        self.axioms = axioms
+        self.session = SolverSession(axioms)
+        self.session.add_clauses(clauses)
+        self.clauses = and_clauses(clauses,axioms)   # everything asserted, for model extraction
+        self.rn = UniqueRenamer('',used_symbols_clauses(self.clauses))
+        self.maps = [dict()]  # for each time, maps updated symbols to their name at that time
+        self.times = []
+        self.result = None
+
+    @property
+    def depth(self):
+        return len(self.maps) - 1
+
+    def fresh_skolems(self,clauses,renaming):
+        """ Extend renaming to map the skolems of clauses to fresh symbols. """
+        syms = used_symbols_clauses(clauses)
+        self.rn.used.update(str(s) for s in syms)
+        renaming = dict(renaming)
+        for s in syms:
+            if is_skolem(s) and s not in renaming:
+                renaming[s] = rename(s,self.rn)
+        return renaming
+
+    def assert_clauses(self,clauses):
+        self.session.add_clauses(clauses)
+        self.clauses = and_clauses(self.clauses,clauses)
+
+    def step(self,update):
+        """ Extend the history by one update. """
+        updated,tr,pre = update
+        prev = self.maps[-1]
+        cur = dict(prev)
+        for s in updated:
+            cur[s] = s.rename(lambda name: self.rn('__' + name))
+        renaming = dict(prev)
+        renaming.update((new(s),cur[s]) for s in updated)
+        self.assert_clauses(rename_clauses(tr,self.fresh_skolems(tr,renaming)))
+        # the axioms must hold of the new values of the updated symbols
+        ax = clauses_using_symbols(updated,self.axioms)
+        ax_renaming = dict((s,cur[s]) for s in updated)
+        self.assert_clauses(rename_clauses(ax,self.fresh_skolems(ax,ax_renaming)))
+        self.maps.append(cur)
+
+    def check(self,cond):
+        """ Check whether some execution of the current depth ends in a
+        state satisfying cond. Returns the sort universes and a
+        sequence of states, as History.satisfy does, or None. """
+        start = time.time()
+        cond = rename_clauses(cond,self.fresh_skolems(cond,self.maps[-1]))
+        all_clauses = and_clauses(self.clauses,cond)
+        model = self.session.get_small_model_assuming(cond,used_symbols_clauses(all_clauses),
+                                                      ivy_logic.uninterpreted_sorts())
+        res = None if model is None else self.extract_path(all_clauses,model)
+        while len(self.times) <= self.depth:
+            self.times.append(0.0)
+        self.times[self.depth] += time.time() - start
+        return res
+
+    def extract_path(self,all_clauses,model):
+        states = []
+        for m in self.maps:
+            inv = inverse_map(m)
+            ignore = lambda s,m=m,inv=inv: not(s in inv or not s.is_skolem() and s not in m)
+            clauses = clauses_model_to_clauses(all_clauses,ignore = ignore, model = model, numerals=use_numerals())
+            clauses = rename_clauses(clauses,inv)
+            states.append(remove_taut_eqs_clauses(clauses))
+        uvs = model.universes(numerals=use_numerals())
+        return uvs, [pure_state(clauses) for clauses in states]
+
 def use_numerals():
     return iu.use_numerals.get()
@@ -6,6 +6,8 @@ import string
 import operator
 import functools
 import collections
+import time
+import os
 
 # some useful combinators
 
@@ -437,6 +439,35 @@ def p_error(token):
     else:
         report_error(ParseError(None,None,'unexpected end of input'));
 
+class LazyParser(object):
+    """ A PLY parser for the grammar in a module, built on its first
+    use. The parse tables are read from tabmodule in the module's
+    directory. These are normally generated at install time (see
+    ivy_gen_tables). If they are missing or out of date, they are
+    rebuilt, and written back only if the directory is writable.
+    """
+    def __init__(self,module,tabmodule,start=None):
+        self.module,self.tabmodule,self.start = module,tabmodule,start
+        self.parser = None
+
+    def get(self):
+        if self.parser is None:
+            import ply.yacc as yacc
+            tabdir = os.path.dirname(os.path.abspath(self.module.__file__))
+            kwargs = {} if self.start is None else {'start':self.start}
+            self.parser = yacc.yacc(module=self.module,tabmodule=self.tabmodule,outputdir=tabdir,
+                                    write_tables=os.access(tabdir,os.W_OK),
+                                    errorlog=yacc.NullLogger(),debug=False,**kwargs)
+        return self.parser
+
+    def parse(self,*args,**kwargs):
+        return self.get().parse(*args,**kwargs)
+
+def versioned_tabmodule(name):
+    """ Name of the table module for a grammar that depends on the
+    current language version. """
+    return name + '_' + ivy_language_version.replace('.','_')
+
 # the default language version is the latest
 ivy_latest_language_version = '1.6'
 ivy_language_version = ivy_latest_language_version
@@ -495,6 +526,9 @@ polymorphic_symbols = set(
 
 use_numerals = BooleanParameter("use_numerals",True)
 use_new_ui = BooleanParameter("new_ui",False)
+default_ui = Parameter("ui",None) # see ivy_ui.get_default_ui_module
+modes = ["abstract","concrete","bounded","induction"]
+default_mode = Parameter("mode","abstract",lambda s: s in modes) # see ivy_ui
 catch = BooleanParameter("catch",True)
 
 
@@ -510,3 +544,55 @@ def dbg(*exprs):
         del frame
 
 
+
+# Phase timing. Functions decorated with timed_phase(name) accumulate
+# their running time and number of calls under "name" while phase
+# timing is enabled. Nested calls in the same phase (for example,
+# recursive ones) are counted once. Phases may nest in each other, so
+# their times are not disjoint. For a phase declared with
+# breakdown=True, the time spent in the phases nested in it is also
+# recorded in phase_breakdown[name].
+#
+# The wrapper has a cost on hot functions (such as the translation to
+# Z3), so functions are wrapped only if the environment variable
+# IVY_PHASE_TIMING is set when this module is loaded. Otherwise,
+# timed_phase returns the function itself and nothing is timed.
+
+phase_timing_supported = bool(os.environ.get('IVY_PHASE_TIMING'))
+phase_timing = [False]
+phase_times = collections.defaultdict(float)
+phase_calls = collections.defaultdict(int)
+phase_breakdown = collections.defaultdict(lambda: collections.defaultdict(float))
+active_phases = set()
+
+def enable_phase_timing(enabled=True):
+    phase_timing[0] = enabled
+
+def reset_phase_times():
+    phase_times.clear()
+    phase_calls.clear()
+    phase_breakdown.clear()
+
+def timed_phase(phase,breakdown=False):
+    def decorator(f):
+        if not phase_timing_supported:
+            return f
+        @functools.wraps(f)
+        def wrapper(*args,**kwargs):
+            if not phase_timing[0] or phase in active_phases:
+                return f(*args,**kwargs)
+            active_phases.add(phase)
+            before = dict(phase_times) if breakdown else None
+            start = time.time()
+            try:
+                return f(*args,**kwargs)
+            finally:
+                phase_times[phase] += time.time() - start
+                phase_calls[phase] += 1
+                active_phases.discard(phase)
+                if breakdown:
+                    for p,t in phase_times.iteritems():
+                        if p != phase and t != before.get(p,0.0):
+                            phase_breakdown[phase][p] += t - before.get(p,0.0)
+        return wrapper
+    return decorator
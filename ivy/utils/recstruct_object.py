@@ -15,18 +15,64 @@ Iterating over a recstruct iterates only over its sub-structures.
 
 Subclasses of recstruct's can set __slots__ = () to save memory.
 
-Hash-consing can be added later as an option.
+Hash-consing is available as an option (see set_hash_consing). When
+it is on, constructing a recstruct that is structurally equal to an
+existing hash-consed one returns the existing object. Hash-consed
+objects cache their hash, and two distinct hash-consed objects are
+unequal, so equality of hash-consed objects is an identity check.
+Objects created while hash-consing is off behave as before, and
+compare equal to hash-consed objects with the same structure.
 
 """
 
 import sys as _sys
 from keyword import iskeyword as _iskeyword
+from weakref import WeakValueDictionary as _WeakValueDictionary
 
 
 def _init(self, *args):
     self._tup = args
 
 
+# The table of hash-consed objects, keyed on (type, tuple). It is
+# never replaced, so that every hash-consed object stays canonical
+# even if hash-consing is turned off and on again.
+
+_cons_table = _WeakValueDictionary()
+_cons_enabled = [False]
+
+def set_hash_consing(enabled):
+    """ Turn hash-consing of newly constructed recstructs on or off.
+    Returns the previous setting. """
+    old = _cons_enabled[0]
+    _cons_enabled[0] = bool(enabled)
+    return old
+
+def hash_consing():
+    return _cons_enabled[0]
+
+def _make(cls, tup):
+    if _cons_enabled[0]:
+        key = (cls, tup)
+        self = _cons_table.get(key)
+        if self is not None:
+            return self
+        self = object.__new__(cls)
+        self._tup = tup
+        self._hash = tup.__hash__()
+        _cons_table[key] = self
+        return self
+    self = object.__new__(cls)
+    self._tup = tup
+    self._hash = None
+    return self
+
+def _reconstruct(cls, tup):
+    """ Rebuild a recstruct from its type and (preprocessed) tuple,
+    used for pickling and copying. """
+    return _make(cls, tup)
+
+
 def _itemgetter(x):
     return lambda self: self._tup.__getitem__(x)
 
@@ -34,7 +80,7 @@ def _itemgetter(x):
 _class_template = '''\
 class {typename}(object):
 
-    __slots__ = ('_tup')
+    __slots__ = ('_tup', '_hash', '__weakref__')
 
     _meta_fields = {meta_field_names!r}
     _sub_fields = {sub_field_names!r}
@@ -52,15 +98,24 @@ class {typename}(object):
         """
         return args
 
-    def __init__(self, {meta_arg_list_with_defaults}{sub_arg_list}):
-        self._tup = tuple(type(self)._preprocess_({meta_arg_list}{sub_arg_list}))
+    def __new__(cls, {meta_arg_list_with_defaults}{sub_arg_list}):
+        return _make(cls, tuple(cls._preprocess_({meta_arg_list}{sub_arg_list})))
+
+    def __init__(self, *args):
+        pass
 
     def __repr__(self):
         """Return a nicely formatted representation string"""
         return type(self).__name__ + repr(self._tup)
 
     def __eq__(self, other):
-        return type(self) is type(other) and (self._tup) == (other._tup)
+        if self is other:
+            return True
+        if type(self) is not type(other):
+            return False
+        if self._hash is not None and other._hash is not None:
+            return False  # distinct hash-consed objects
+        return (self._tup) == (other._tup)
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -79,7 +134,8 @@ class {typename}(object):
 
     def __hash__(self):
         #return hash((type(self), ) + self._tup)
-        return self._tup.__hash__()
+        h = self._hash
+        return self._tup.__hash__() if h is None else h
 
     def _subs(self):
         return self._tup[{n_meta}:]
@@ -102,11 +158,15 @@ class {typename}(object):
     def __nonzero__(self):
         raise TypeError("recstruct should not be converted to bool")
 
+    def __reduce__(self):
+        return (_reconstruct, (type(self), self._tup))
+
     def __getstate__(self):
         return {{'_tup': self._tup}}
 
     def __setstate__(self, state):
         self._tup = state['_tup']
+        self._hash = None
 
 {field_defs}
 '''
@@ -203,6 +263,8 @@ def recstruct(typename, meta_field_names, sub_field_names, verbose=False):
         _itemgetter=_itemgetter,
         _property=property,
         _init=_init,
+        _make=_make,
+        _reconstruct=_reconstruct,
     )
     try:
         exec class_definition in namespace
@@ -1,4 +1,17 @@
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
+import os
+import sys
+import subprocess
+
+class build_py_with_tables(build_py):
+    """ Generate the parse tables before building, so that they are
+    installed with the package (see ivy/ivy_gen_tables.py). """
+    def run(self):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)),'ivy','ivy_gen_tables.py')
+        if subprocess.call([sys.executable,script]) != 0:
+            print "warning: could not generate parse tables, they will be built at run time"
+        build_py.run(self)
 
 setup(name='ms_ivy',
       version='0.1',
@@ -8,14 +21,15 @@ setup(name='ms_ivy',
       author_email='nomail@example.com',
       license='MIT',
       packages=find_packages(),
-      include_package_data={'ivy':['include/*.ivy','include/*.h']}
+      include_package_data={'ivy':['include/*.ivy','include/*.h']},
       install_requires=[
           'ply',
           'pygraphviz',
           'tarjan'
       ],
+      setup_requires=['ply'],
+      cmdclass={'build_py':build_py_with_tables},
       entry_points = {
-        'console_scripts': ['ivy=ivy.ivy:main','ivy_check=ivy.ivy_check:main','ivy_to_cpp=ivy.ivy_to_cpp:main','ivy_show=ivy.ivy_show:main',],
+        'console_scripts': ['ivy=ivy.ivy:main','ivy_check=ivy.ivy_check:main','ivy_to_cpp=ivy.ivy_to_cpp:main','ivy_show=ivy.ivy_show:main','ivy_bench=ivy.ivy_bench:main',],
         },
       zip_safe=False)
-
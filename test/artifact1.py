@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+from ivy import ivy_module as im
+from ivy import ivy_utils as iu
+from ivy import ivy_artifact
+from ivy import ivy_isolate
+from ivy import ivy
+
+prog = """#lang ivy1.6
+
+type t
+relation r(X:t)
+individual c : t
+
+init ~r(X)
+
+action put(x:t) = {
+    r(x) := true;
+    c := x
+}
+
+export put
+
+conjecture r(X) -> r(c)
+"""
+
+tmpdir = tempfile.mkdtemp()
+try:
+    fn = os.path.join(tmpdir,'prog.ivy')
+    with open(fn,'w') as f:
+        f.write(prog)
+    cache = os.path.join(tmpdir,'cache')
+
+    with iu.parameterize({'module_cache':cache}):
+        with im.Module():
+            ivy.source_file(fn,open(fn))
+            actions = sorted(str(a) for a in im.module.actions.values())
+            sig = str(im.module.sig)
+        files = os.listdir(cache)
+        assert len(files) == 1 and files[0].endswith('.ivyc'), files
+
+        # the second load reads the artifact
+        with im.Module():
+            ivy.source_file(fn,open(fn))
+            assert sorted(str(a) for a in im.module.actions.values()) == actions
+            assert str(im.module.sig) == sig
+            assert im.module.update_cache
+        assert os.listdir(cache) == files
+
+        # a changed source gets a new artifact
+        with open(fn,'a') as f:
+            f.write('\nconjecture c = c\n')
+        with im.Module():
+            ivy.source_file(fn,open(fn))
+        assert len(os.listdir(cache)) == 2
+
+        # the updates of an isolate created after loading are cached
+        # separately
+        for i in range(2):
+            with im.Module():
+                ivy.source_file(fn,open(fn),create_isolate=False)
+                with im.module.copy():
+                    ivy_isolate.create_isolate(None)
+                    loaded = ivy_artifact.load_isolate_updates(None)
+                    im.module.actions['put'].update(im.module,{})
+                    ivy_artifact.save_isolate_updates(None,loaded)
+            assert (loaded > 0) == (i > 0), loaded
+        assert len([x for x in os.listdir(cache) if x.endswith('.ivyu')]) == 1
+
+        # parameters that do not affect compilation are not in the key
+        text = open(fn).read()
+        key = ivy_artifact.artifact_key(fn,text,{})
+        with iu.parameterize({'profile_dump':'prof.json'}):
+            assert ivy_artifact.artifact_key(fn,text,{}) == key
+        with iu.parameterize({'ext':'put'}):
+            assert ivy_artifact.artifact_key(fn,text,{}) != key
+
+        # the cache is private to the user, and an artifact that others
+        # can write is not read
+        assert os.stat(cache).st_mode & 0777 == 0700
+        for x in os.listdir(cache):
+            os.chmod(os.path.join(cache,x),0666)
+        with im.Module():
+            ivy.source_file(fn,open(fn))
+        afn = ivy_artifact.artifact_file(ivy_artifact.current_key[0])
+        assert os.stat(afn).st_mode & 0777 == 0600   # compiled and rewritten
+        os.chmod(cache,0777)
+        try:
+            with im.Module():
+                ivy_artifact.compile_file(open(fn),fn)
+            assert False, 'shared cache accepted'
+        except iu.IvyError:
+            pass
+finally:
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,53 @@
+from ivy import ivy_module as im
+from ivy.ivy_compiler import ivy_from_string
+from ivy import ivy_utils as iu
+from ivy import ivy_art
+from ivy import ivy_actions
+from ivy import ivy_logic_utils as lu
+
+prog = """#lang ivy1.5
+
+relation a
+relation b
+relation c
+
+init ~a & ~b & ~c
+
+action step = {
+  c := b;
+  b := a;
+  a := true
+}
+
+action check = {
+  assert ~b
+}
+
+export step
+export check
+"""
+
+with im.Module():
+    iu.set_parameters({'mode':'induction'})
+    ivy_from_string(prog)
+    ag = ivy_art.AnalysisGraph()
+    ag.add_initial_state(ag.domain.init_cond)
+    init = ag.states[0]
+    error = lu.formula_to_clauses(im.module.sig.symbols['c'])
+    step = ag.actions['step']
+    assert ag.bmc_action(init,step,error,2) is None
+    assert len(ag.last_bmc.times) == 3
+    cex = ag.bmc_action(init,step,error,5)
+    assert cex is not None
+    # shortest counterexample has three steps
+    assert len(cex.states) == 4
+    assert len(ag.last_bmc.times) == 4
+    assert ag.last_bmc.result == 'error'
+    # the assertion in check fails after two steps, in the third
+    check = ag.actions['check']
+    both = ivy_actions.EnvAction(step,check)
+    cex = ag.bmc_action(init,both,lu.false_clauses(),5)
+    assert cex is not None
+    assert ag.last_bmc.result == 'failure'
+    assert ag.last_bmc.depth == 2
+    assert len(cex.states) == 3
@@ -0,0 +1,43 @@
+
+from ivy import ivy_module as im
+from ivy.ivy_compiler import ivy_from_string
+from ivy import ivy_utils as iu
+from ivy import ivy_check as ick
+prog = """#lang ivy1.5
+
+type foo
+type bar
+
+module mod(me) = {
+  relation r
+  individual x:foo
+  init x = me
+
+  action thing(y:foo) = {
+    x := me
+  }
+
+  action set_me(y:foo) = {
+    x := y;
+    r := true
+  }
+
+  conjecture r -> x = me
+}
+
+instance inst(X:foo) : mod(X)
+
+isolate iso(me:foo) = inst(me)
+
+export inst.set_me
+"""
+
+with im.Module():
+    iu.set_parameters({'mode':'induction','jobs':'2'})
+    ivy_from_string(prog,create_isolate=False)
+    try:
+        ick.check_module()
+        assert False,"property should have been false"
+    except iu.IvyError as e:
+        print str(e)
+        assert str(e) == 'error: Consecution failed.'
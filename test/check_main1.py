@@ -0,0 +1,47 @@
+# Checks that ivy_check.main runs without loading the UI
+import subprocess
+import tempfile
+import shutil
+import sys
+import os
+
+ui_modules = ['Tkinter','Tix','pygraphviz','tk_ui','ivy_ui','ivy_graph_ui','tk_graph_ui','tk_cy','dot_layout','proof']
+
+source = """#lang ivy1.5
+
+type t
+relation r(X:t)
+init ~r(X)
+
+action set(x:t) = {
+  r(x) := true
+}
+
+export set
+
+conjecture r(X) -> r(X)
+"""
+
+prog = """
+import sys
+import ivy.ivy_check
+sys.argv = ['ivy_check','check_main1.ivy']
+ivy.ivy_check.main()
+print ' '.join(m for m in %r if m in sys.modules or 'ivy.' + m in sys.modules)
+""" % ui_modules
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+tmpdir = tempfile.mkdtemp()
+try:
+    with open(os.path.join(tmpdir,'check_main1.ivy'),'w') as f:
+        f.write(source)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH','')
+    out = subprocess.check_output([sys.executable,'-c',prog],cwd=tmpdir,env=env)
+finally:
+    shutil.rmtree(tmpdir)
+print out
+lines = out.strip().split('\n')
+assert 'OK' in lines, "ivy_check did not succeed"
+loaded = lines[-1] if lines[-1] != 'OK' else ''
+assert not loaded.strip(), "UI modules loaded: {}".format(loaded)
@@ -0,0 +1,172 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from distutils.spawn import find_executable
+from ivy import ivy_module as im
+from ivy.ivy_compiler import ivy_from_string
+from ivy import ivy_utils as iu
+from ivy import ivy_to_cpp as i2c
+from ivy import ivy_actions as ia
+from ivy import ivy_solver as slv
+from ivy import ivy_isolate as iso
+
+# With layout=compact, relations are stored as bitsets and functions
+# as flat arrays, accessed through accessors. We compile the program
+# with both layouts and check that they agree over a random sequence
+# of actions. The relation r spans several words of its bitset.
+
+prog = """#lang ivy1.6
+
+type t
+interpret t -> bv[3]
+
+relation r(X:t,Y:t,Z:t)
+relation q(X:t,Y:t)
+function g(X:t,Y:t) : t
+
+init ~r(X,Y,Z) & ~q(X,Y) & g(X,Y) = 0
+
+action set_r(x:t,y:t,z:t,v:bool) = {
+    r(x,y,z) := v
+}
+
+action set_q(x:t,y:t,v:bool) = {
+    q(x,y) := v
+}
+
+action set_g(x:t,y:t,v:t) = {
+    g(x,y) := v
+}
+
+action clear_r = {
+    r(X,Y,Z) := false
+}
+
+action fill_q = {
+    q(X,Y) := true
+}
+
+action fill_g(v:t) = {
+    g(X,Y) := v
+}
+
+action diag = {
+    q(X,Y) := r(X,Y,Y)
+}
+
+action get_r(x:t,y:t,z:t) returns (b:bool) = {
+    b := r(x,y,z)
+}
+
+action get_q(x:t,y:t) returns (b:bool) = {
+    b := q(x,y)
+}
+
+action get_g(x:t,y:t) returns (v:t) = {
+    v := g(x,y)
+}
+
+action some_r(x:t) returns (b:bool) = {
+    b := exists Y,Z. r(x,Y,Z)
+}
+
+export set_r
+export set_q
+export set_g
+export clear_r
+export fill_q
+export fill_g
+export diag
+export get_r
+export get_q
+export get_g
+export some_r
+"""
+
+# the driver prints the values of all the cells after each action,
+# LAYOUT is replaced by the class name
+
+driver = """
+#include "LAYOUT.h"
+#include <cstdio>
+#include <cstdlib>
+
+int main() {
+    LAYOUT s;
+    srand(1);
+    for (int step = 0; step < 500; step++) {
+        int x = rand() % 8, y = rand() % 8, z = rand() % 8, v = rand() % 8;
+        switch (rand() % 8) {
+        case 0: case 1: s.set_r(x,y,z,v%2); break;
+        case 2: s.set_q(x,y,v%2); break;
+        case 3: s.set_g(x,y,v); break;
+        case 4: if (rand() % 8 == 0) s.clear_r(); break;
+        case 5: if (rand() % 8 == 0) s.fill_q(); break;
+        case 6: s.fill_g(v); break;
+        case 7: s.diag(); break;
+        }
+        for (x = 0; x < 8; x++) {
+            printf("%d",s.some_r(x));
+            for (y = 0; y < 8; y++) {
+                printf("%d%d",s.get_q(x,y),s.get_g(x,y));
+                for (z = 0; z < 8; z++)
+                    printf("%d",s.get_r(x,y,z));
+            }
+        }
+        printf("\\n");
+    }
+    return 0;
+}
+"""
+
+ia.set_determinize(True)
+slv.set_use_native_enums(True)
+iso.set_interpret_all_sorts(True)
+
+code = {}
+for lay in ['dense','compact']:
+    with im.Module():
+        iu.set_parameters({'mode':'induction','target':'impl','layout':lay})
+        ivy_from_string(prog,create_isolate=True)
+        code[lay] = i2c.module_to_cpp_class(lay)
+iu.set_parameters({'layout':'dense'})
+
+header,impl = code['compact']
+print header
+print impl
+
+assert 'struct ivy_bitref' in header
+assert 'unsigned long long __bits_r[8];' in header
+assert 'ivy_bitref r(int X0,int X1,int X2)' in header
+assert 'int __data_g[64];' in header
+assert 'int &g(int X0,int X1)' in header
+
+# the actions use the accessors and fill methods
+assert re.search(r'\br\(\w+,\w+,\w+\) = \w+;',impl)
+assert '___ivy_fill_r(' in impl
+assert '___ivy_fill_q(' in impl
+assert '___ivy_fill_g(' in impl
+assert not re.search(r'\br\[',impl)
+
+if find_executable('g++') is None:
+    print 'g++ not found, not running the generated code'
+else:
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for lay in ['dense','compact']:
+            for suffix,text in zip(['.h','.cpp'],code[lay]):
+                with open(os.path.join(tmpdir,lay + suffix),'w') as f:
+                    f.write(text)
+        traces = {}
+        for lay in ['dense','compact']:
+            with open(os.path.join(tmpdir,lay + '_main.cpp'),'w') as f:
+                f.write(driver.replace('LAYOUT',lay))
+            subprocess.check_call(['g++','-o',lay,lay + '_main.cpp',lay + '.cpp'],cwd=tmpdir)
+            traces[lay] = subprocess.check_output([os.path.join(tmpdir,lay)]).split('\n')
+        assert len(traces['dense']) > 500 and len(set(traces['dense'])) > 100
+        for step,(d,c) in enumerate(zip(traces['dense'],traces['compact'])):
+            assert d == c, 'layouts differ after step {}'.format(step)
+    finally:
+        shutil.rmtree(tmpdir)
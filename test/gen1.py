@@ -0,0 +1,144 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from distutils.spawn import find_executable
+import z3
+from ivy import ivy_module as im
+from ivy.ivy_compiler import ivy_from_string
+from ivy import ivy_utils as iu
+from ivy import ivy_to_cpp as i2c
+from ivy import ivy_actions as ia
+from ivy import ivy_solver as slv
+from ivy import ivy_isolate as iso
+
+# A test generator keeps the state in its solver across calls to
+# generate and updates only the cells that changed. We compile a
+# tester and check over a random sequence of actions that each
+# generated input satisfies the precondition in the current state, and
+# that generate fails only when the precondition is unsatisfiable.
+# Then, in a fixed state, we check that the inputs are not much more
+# biased than a uniform choice among the values that work.
+
+prog = """#lang ivy1.6
+
+type t
+interpret t -> bv[4]
+
+relation used(X:t)
+individual last : t
+
+init ~used(X) & last = 0
+
+action take(x:t,y:t) = {
+    assume ~used(x) & ~used(y) & x ~= y & x ~= last;
+    used(x) := true;
+    used(y) := true;
+    last := x
+}
+
+action free(x:t) = {
+    assume used(x);
+    used(x) := false
+}
+
+export take
+export free
+"""
+
+driver = """
+#include "foo.h"
+#include <cstdio>
+#include <cstdlib>
+
+void ivy_assert(bool c, const char *msg) {}
+void ivy_assume(bool c, const char *msg) {}
+
+int main() {
+    foo s;
+    init_gen ig;
+    take_gen tg;
+    free_gen fg;
+    srand(1);
+    if (!ig.generate(s)) {printf("no initial state\\n"); return 1;}
+    for (int step = 0; step < 2000; step++) {
+        int free_cells = 0;
+        for (int i = 0; i < 16; i++)
+            if (!s.used[i]) free_cells++;
+        if (rand() % 2) {
+            bool ok = free_cells >= 2;
+            if (tg.generate(s) != ok) {printf("take at step %d\\n",step); return 1;}
+            if (ok) {
+                if (s.used[tg.x] || s.used[tg.y] || tg.x == tg.y || tg.x == s.last) {printf("take input at step %d\\n",step); return 1;}
+                s.take(tg.x,tg.y);
+            }
+        }
+        else {
+            bool ok = free_cells < 16;
+            if (fg.generate(s) != ok) {printf("free at step %d\\n",step); return 1;}
+            if (ok) {
+                if (!s.used[fg.x]) {printf("free input at step %d\\n",step); return 1;}
+                s.free(fg.x);
+            }
+        }
+    }
+    double chi2 = 0;
+    int feasible = 0;
+    int counts[16] = {0};
+    for (int i = 0; i < 16; i++)
+        s.used[i] = (i % 3 == 0);
+    s.last = 1;
+    for (int i = 0; i < 16; i++)
+        if (!s.used[i] && i != s.last)
+            feasible++;
+    for (int i = 0; i < 400 * feasible; i++) {
+        if (!tg.generate(s)) {printf("take in fixed state\\n"); return 1;}
+        counts[tg.x]++;
+    }
+    for (int i = 0; i < 16; i++)
+        if (!s.used[i] && i != s.last)
+            chi2 += (counts[i] - 400.0) * (counts[i] - 400.0) / 400.0;
+    if (chi2 / (feasible - 1) > 2.5) {printf("biased inputs: %f\\n",chi2 / (feasible - 1)); return 1;}
+    printf("OK\\n");
+    return 0;
+}
+"""
+
+ia.set_determinize(True)
+slv.set_use_native_enums(True)
+iso.set_interpret_all_sorts(True)
+
+with im.Module():
+    iu.set_parameters({'mode':'induction','target':'gen','coi':'false','create_imports':'true',
+                       'enforce_axioms':'true','filter_symbols':'false'})
+    ivy_from_string(prog,create_isolate=True)
+
+    header,impl = i2c.module_to_cpp_class('foo')
+    print header
+    print impl
+
+    assert 'sync_state();' in impl
+
+# The tester is built against the Z3 given by Z3DIR, as in the
+# examples, or else the one that Ivy uses.
+
+z3dir = os.environ.get('Z3DIR',os.path.dirname(z3.__file__))
+includes = [os.path.join(z3dir,'include'),os.path.join(z3dir,'include','c++')]
+
+if find_executable('g++') is None or not any(os.path.exists(os.path.join(d,'z3++.h')) for d in includes):
+    print 'g++ or z3++.h not found, not running the generated code'
+else:
+    examples = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','examples','ivy')
+    libdir = os.path.join(z3dir,'lib')
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name,text in [('foo.h',header),('foo.cpp',impl),('main.cpp',driver)]:
+            with open(os.path.join(tmpdir,name),'w') as f:
+                f.write(text)
+        flags = ['-I' + d for d in includes + [examples]]
+        subprocess.check_call(['g++'] + flags + ['-o','main','main.cpp','foo.cpp',
+                               os.path.join(examples,'hash.cpp'),'-L',libdir,'-lz3','-Wl,-rpath,' + libdir],
+                              cwd=tmpdir)
+        assert subprocess.check_output([os.path.join(tmpdir,'main')]) == 'OK\n'
+    finally:
+        shutil.rmtree(tmpdir)
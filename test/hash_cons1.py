@@ -0,0 +1,22 @@
+import pickle
+from ivy import ivy_utils as iu
+from ivy import ivy_logic as il
+from ivy import logic as lg
+
+s = lg.UninterpretedSort('t')
+x = lg.Const('x',s)
+
+with iu.parameterize({'hash_cons':'true'}):
+    y = lg.Const('x',s)
+    z = lg.Const('x',lg.UninterpretedSort('t'))
+    assert y is z
+    f = lg.And(lg.Eq(y,z),lg.Not(lg.Eq(y,y)))
+    g = lg.And(lg.Eq(z,y),lg.Not(lg.Eq(z,z)))
+    assert f is g
+    assert pickle.loads(pickle.dumps(f,2)) is f
+    assert lg.Eq(y,y) != lg.Eq(y,lg.Const('w',s))
+
+# terms made without hash-consing are equal to hash-consed ones
+assert x == y and hash(x) == hash(y) and x is not y
+assert lg.Const('x',s) is not y
+assert len(set([x,y,z])) == 1
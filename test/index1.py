@@ -0,0 +1,133 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from distutils.spawn import find_executable
+from ivy import ivy_module as im
+from ivy.ivy_compiler import ivy_from_string
+from ivy import ivy_utils as iu
+from ivy import ivy_to_cpp as i2c
+from ivy import ivy_actions as ia
+from ivy import ivy_solver as slv
+from ivy import ivy_isolate as iso
+
+# Quantifiers guarded by a unary relation iterate over its index and
+# stop as soon as their value is known. We compile the generated class
+# and check the quantifiers and the index against a plain array over a
+# random sequence of additions and removals.
+
+prog = """#lang ivy1.6
+
+type t
+interpret t -> bv[3]
+
+relation r(X:t)
+individual c : t
+
+init ~r(X)
+
+action add(x:t) = {
+    r(x) := true
+}
+
+action f(x:t) returns (y:bool) = {
+    y := x ~= c
+}
+
+action add_call(x:t) = {
+    call r(x) := f(x)
+}
+
+action remove(x:t) = {
+    r(x) := false
+}
+
+action get(x:t) returns (b:bool) = {
+    b := r(x)
+}
+
+action some_other returns (b:bool) = {
+    b := exists X. r(X) & X ~= c
+}
+
+action all_c returns (b:bool) = {
+    b := forall X. r(X) -> X = c
+}
+
+export add
+export add_call
+export remove
+export get
+export some_other
+export all_c
+"""
+
+driver = """
+#include "foo.h"
+#include <cstdio>
+#include <cstdlib>
+
+int main() {
+    foo s;
+    bool r[8] = {false};
+    srand(1);
+    for (int step = 0; step < 2000; step++) {
+        int x = rand() % 8;
+        switch (rand() % 3) {
+        case 0: s.add(x); r[x] = true; break;
+        case 1: s.remove(x); r[x] = false; break;
+        case 2: s.add_call(x); r[x] = (x != s.c); break;
+        }
+        bool some_other = false, all_c = true;
+        int size = 0;
+        for (int y = 0; y < 8; y++) {
+            if (s.get(y) != r[y]) {printf("get %d at step %d\\n",y,step); return 1;}
+            if (r[y] && y != s.c) some_other = true;
+            if (r[y] && y != s.c) all_c = false;
+            if (r[y]) {
+                size++;
+                int p = s.__idx_r.pos[y];
+                if (p < 0 || s.__idx_r.members[p] != y) {printf("index of %d at step %d\\n",y,step); return 1;}
+            }
+            else if (s.__idx_r.pos[y] >= 0) {printf("stale index of %d at step %d\\n",y,step); return 1;}
+        }
+        if ((int)s.__idx_r.members.size() != size) {printf("index size at step %d\\n",step); return 1;}
+        if (s.some_other() != some_other) {printf("some_other at step %d\\n",step); return 1;}
+        if (s.all_c() != all_c) {printf("all_c at step %d\\n",step); return 1;}
+    }
+    printf("OK\\n");
+    return 0;
+}
+"""
+
+ia.set_determinize(True)
+slv.set_use_native_enums(True)
+iso.set_interpret_all_sorts(True)
+
+with im.Module():
+    iu.set_parameters({'mode':'induction','target':'impl'})
+    ivy_from_string(prog,create_isolate=True)
+
+    header,impl = i2c.module_to_cpp_class('foo')
+    print header
+    print impl
+
+    assert 'ivy_index __idx_r;' in header
+
+    # exists exits when its result becomes true, forall when it becomes false
+    assert re.search(r'__I\w+ < __idx_r\.members\.size\(\) && !\w+;',impl)
+    assert re.search(r'__I\w+ < __idx_r\.members\.size\(\) && \w+;',impl)
+
+if find_executable('g++') is None:
+    print 'g++ not found, not running the generated code'
+else:
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name,text in [('foo.h',header),('foo.cpp',impl),('main.cpp',driver)]:
+            with open(os.path.join(tmpdir,name),'w') as f:
+                f.write(text)
+        subprocess.check_call(['g++','-o','main','main.cpp','foo.cpp'],cwd=tmpdir)
+        assert subprocess.check_output([os.path.join(tmpdir,'main')]) == 'OK\n'
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,60 @@
+from ivy import ivy_module as im
+from ivy.ivy_compiler import ivy_from_string
+from ivy import ivy_utils as iu
+from ivy import ivy_logic as il
+from ivy import ivy_ast
+from ivy import ivy_actions
+
+prog = """#lang ivy1.6
+
+relation a
+relation b
+
+axiom a -> b
+
+action flip = {
+  a := ~a;
+  b := *
+}
+
+action twice = {
+  call flip;
+  call flip
+}
+"""
+
+# The memoized updates and the background theory must be recomputed
+# when the module is modified directly, without calling changed.
+
+with im.Module():
+    iu.set_parameters({'mode':'induction'})
+    ivy_from_string(prog,create_isolate=False)
+    mod = im.module
+    a = il.Symbol('a',il.RelationSort([]))
+    b = il.Symbol('b',il.RelationSort([]))
+    twice = mod.actions['twice']
+    with ivy_actions.ActionContext(mod):
+        upd = twice.update(mod,None)
+        assert twice.update(mod,None)[1] is upd[1]
+    theory = mod.background_theory()
+    assert len(theory.fmlas) == 1
+
+    version = mod.update_version()
+    assert mod.update_version() == version
+    mod.labeled_axioms.append(ivy_ast.LabeledFormula(None,il.Or(a,il.Not(b))))
+    assert mod.update_version() != version
+    assert len(mod.background_theory().fmlas) == 2
+    with ivy_actions.ActionContext(mod):
+        upd2 = twice.update(mod,None)
+    assert upd2[1] is not upd[1] and str(upd2[1]) != str(upd[1])
+
+    # properties, conjectures, concept spaces and the signature are
+    # also part of the key
+    for mutate in [lambda: mod.labeled_props.append(ivy_ast.LabeledFormula(None,a)),
+                   lambda: mod.labeled_conjs.append(ivy_ast.LabeledFormula(None,b)),
+                   lambda: mod.concept_spaces.append((a,b)),
+                   lambda: il.add_symbol('c',il.RelationSort([])),
+                   lambda: mod.actions.__setitem__('twice',ivy_actions.Sequence())]:
+        version = mod.update_version()
+        mutate()
+        assert mod.update_version() != version
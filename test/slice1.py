@@ -0,0 +1,62 @@
+from ivy import ivy_module as im
+from ivy.ivy_compiler import ivy_from_string
+from ivy import ivy_utils as iu
+from ivy import ivy_logic as il
+from ivy import ivy_logic_utils as lu
+from ivy import ivy_check as ick
+
+prog = """#lang ivy1.6
+
+type s
+type t
+
+individual c : s
+relation q(X:t)
+relation r(X:t)
+
+axiom X:s = c
+axiom q(X) -> r(X)
+
+property [p1] X:s = Y:s
+
+relation a
+relation b
+relation d
+axiom a -> b
+
+action flip = {
+  a := ~a;
+  b := *
+}
+
+action twice = {
+  call flip;
+  call flip
+}
+"""
+
+with im.Module():
+    iu.set_parameters({'mode':'induction'})
+    ivy_from_string(prog,create_isolate=False)
+    s = il.find_sort('s')
+    q = il.Symbol('q',il.RelationSort([il.find_sort('t')]))
+    full = im.module.background_theory()
+
+    # the axiom on s bounds the size of s, so it is in the slice of a
+    # formula that mentions only the sort
+    sl = im.module.background_theory(im.theory_keys(il.Equals(il.Variable('X',s),il.Variable('Y',s))))
+    assert len(sl.fmlas) == 1 and len(full.fmlas) == 3, sl
+
+    sl = im.module.background_theory(set([q]))
+    assert len(sl.fmlas) == 1 and il.Symbol('c',s) not in lu.used_symbols_clauses(sl), sl
+
+    # the intermediate state of twice must satisfy the axiom, even if
+    # the symbols in scope are unrelated to it
+    d = il.Symbol('d',il.RelationSort([]))
+    twice = im.module.actions['twice']
+    full_upd = twice.update(im.module,None)
+    upd = twice.update(im.module,set([d]))
+    assert str(upd[1]) == str(full_upd[1]), upd
+
+    # the property mentions only the sort s, but follows from the axioms
+    ick.check_module()
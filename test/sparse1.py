@@ -0,0 +1,232 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from distutils.spawn import find_executable
+from ivy import ivy_module as im
+from ivy.ivy_compiler import ivy_from_string
+from ivy import ivy_utils as iu
+from ivy import ivy_to_cpp as i2c
+from ivy import ivy_actions as ia
+from ivy import ivy_solver as slv
+from ivy import ivy_isolate as iso
+
+# State over an unbounded sort, or a sort with more than sparse_limit
+# elements, is stored in sparse hash maps. Quantifiers guarded by a
+# sparse relation iterate over its stored cells, and other quantifiers
+# over a finite sort loop over the whole sort. We compile the program
+# with a small sparse_limit and with the default one, and check that
+# the sparse and dense classes agree over a random sequence of
+# actions.
+
+prog = """#lang ivy1.6
+
+type t
+interpret t -> bv[3]
+
+relation m(X:t)
+relation r(X:t,Y:t)
+function g(X:t) : t
+
+init ~m(X) & ~r(X,Y)
+
+action set_m(x:t,v:bool) = {
+    m(x) := v
+}
+
+action set_r(x:t,y:t,v:bool) = {
+    r(x,y) := v
+}
+
+action set_g(x:t,v:t) = {
+    g(x) := v
+}
+
+action clear_m = {
+    m(X) := false
+}
+
+action fill_r(v:bool) = {
+    r(X,Y) := v
+}
+
+action fill_g(v:t) = {
+    g(X) := v
+}
+
+action get_m(x:t) returns (b:bool) = {
+    b := m(x)
+}
+
+action get_r(x:t,y:t) returns (b:bool) = {
+    b := r(x,y)
+}
+
+action get_g(x:t) returns (v:t) = {
+    v := g(x)
+}
+
+action some_m(y:t) returns (b:bool) = {
+    b := exists X. m(X) & X ~= y
+}
+
+action all_m(y:t) returns (b:bool) = {
+    b := forall X. m(X) -> r(X,y)
+}
+
+action some_r(x:t) returns (b:bool) = {
+    b := exists Y. r(x,Y) & Y ~= x
+}
+
+action all_r(x:t) returns (b:bool) = {
+    b := forall Y. r(x,Y)
+}
+
+action some_g(y:t) returns (b:bool) = {
+    b := exists X. g(X) = y
+}
+
+export set_m
+export set_r
+export set_g
+export clear_m
+export fill_r
+export fill_g
+export get_m
+export get_r
+export get_g
+export some_m
+export all_m
+export some_r
+export all_r
+export some_g
+"""
+
+# The driver prints the values of all the cells and queries after
+# each action. LAYOUT is replaced by the class name. For the sparse
+# class, it also checks that no stored cell has the default value.
+
+driver = """
+#include "LAYOUT.h"
+#include <cstdio>
+#include <cstdlib>
+
+int main() {
+    LAYOUT s;
+    s.fill_g(0);
+    srand(1);
+    for (int step = 0; step < 1000; step++) {
+        int x = rand() % 8, y = rand() % 8, v = rand() % 8;
+        switch (rand() % 8) {
+        case 0: case 1: s.set_m(x,v%2); break;
+        case 2: case 3: s.set_r(x,y,v%2); break;
+        case 4: s.set_g(x,v); break;
+        case 5: if (rand() % 8 == 0) s.clear_m(); break;
+        case 6: if (rand() % 4 == 0) s.fill_r(v%2); break;
+        case 7: if (rand() % 8 == 0) s.fill_g(v); break;
+        }
+#ifdef SPARSE
+        for (ivy_sparse<bool,2>::map_type::iterator it = s.__sparse_r.cells.begin(); it != s.__sparse_r.cells.end(); ++it)
+            if (it->second == s.__sparse_r.dflt) {printf("stored default at step %d\\n",step); return 1;}
+        for (ivy_sparse<bool,1>::map_type::iterator it = s.__sparse_m.cells.begin(); it != s.__sparse_m.cells.end(); ++it)
+            if (it->second == s.__sparse_m.dflt) {printf("stored default at step %d\\n",step); return 1;}
+#endif
+        for (x = 0; x < 8; x++) {
+            printf("%d%d%d%d%d%d%d",s.get_m(x),s.get_g(x),s.some_m(x),s.all_m(x),s.some_r(x),s.all_r(x),s.some_g(x));
+            for (y = 0; y < 8; y++)
+                printf("%d",s.get_r(x,y));
+        }
+        printf("\\n");
+    }
+    return 0;
+}
+"""
+
+# A relation on an unbounded sort that is filled with true cannot
+# guard a quantifier, since its stored cells are not its members.
+
+bad_prog = """#lang ivy1.6
+
+type node
+
+relation member(X:node)
+
+init ~member(X)
+
+action join(n:node) = {
+    member(n) := true
+}
+
+action join_all = {
+    member(X) := true
+}
+
+action has_other(n:node) returns (b:bool) = {
+    b := exists X. member(X) & X ~= n
+}
+
+export join
+export join_all
+export has_other
+"""
+
+ia.set_determinize(True)
+slv.set_use_native_enums(True)
+iso.set_interpret_all_sorts(True)
+
+code = {}
+for lay,limit in [('dense','16'),('sparse','4')]:
+    with im.Module():
+        iu.set_parameters({'mode':'induction','target':'impl','sparse_limit':limit})
+        ivy_from_string(prog,create_isolate=True)
+        code[lay] = i2c.module_to_cpp_class(lay)
+iu.set_parameters({'sparse_limit':'16'})
+
+header,impl = code['sparse']
+print header
+print impl
+
+assert '#include "hash.h"' in header
+assert 'ivy_sparse<bool,1> __sparse_m;' in header
+assert 'ivy_sparse<bool,2>::ref r(int X0,int X1)' in header
+assert 'ivy_sparse<int,1> __sparse_g;' in header
+assert '__sparse_' not in code['dense'][0]
+
+# m guards some_m, all_m and the initial condition, but r is filled
+# with true, so it guards nothing, and some_r loops over the whole sort
+assert len(re.findall(r'= __sparse_m\.cells\.begin\(\);',impl)) == 3
+assert '__sparse_r.cells' not in impl
+assert '___ivy_fill_r(' in impl
+
+with im.Module():
+    iu.set_parameters({'mode':'induction','target':'impl'})
+    ivy_from_string(bad_prog,create_isolate=True)
+    try:
+        i2c.module_to_cpp_class('foo')
+        assert False, "quantifier guarded by a filled relation compiled"
+    except iu.IvyError as e:
+        print e
+        assert 'cannot iterate over type node' in str(e)
+
+if find_executable('g++') is None:
+    print 'g++ not found, not running the generated code'
+else:
+    include = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','examples','ivy')
+    tmpdir = tempfile.mkdtemp()
+    try:
+        traces = {}
+        for lay in ['dense','sparse']:
+            for suffix,text in zip(['.h','.cpp'],code[lay]):
+                with open(os.path.join(tmpdir,lay + suffix),'w') as f:
+                    f.write(text)
+            with open(os.path.join(tmpdir,lay + '_main.cpp'),'w') as f:
+                f.write(driver.replace('LAYOUT',lay))
+            flags = ['-DSPARSE'] if lay == 'sparse' else []
+            subprocess.check_call(['g++','-I',include] + flags + ['-o',lay,lay + '_main.cpp',lay + '.cpp'],cwd=tmpdir)
+            traces[lay] = subprocess.check_output([os.path.join(tmpdir,lay)]).split('\n')
+        assert len(traces['dense']) > 1000 and len(set(traces['dense'])) > 100
+        for step,(d,c) in enumerate(zip(traces['dense'],traces['sparse'])):
+            assert d == c, 'layouts differ after step {}'.format(step)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,25 @@
+# Checks that ivy_check starts without loading the UI, within a time budget
+import subprocess
+import sys
+import os
+
+budget = 3.0 # seconds to import ivy_check
+
+ui_modules = ['Tkinter','Tix','pygraphviz','tk_ui','ivy_ui','ivy_graph_ui','tk_graph_ui','tk_cy','dot_layout','proof']
+
+prog = """
+import time
+start = time.time()
+import ivy.ivy_check
+elapsed = time.time() - start
+import sys
+print elapsed
+print ' '.join(m for m in %r if m in sys.modules or 'ivy.' + m in sys.modules)
+""" % ui_modules
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+out = subprocess.check_output([sys.executable,'-c',prog],cwd=root)
+elapsed,loaded = (out.split('\n') + [''])[:2]
+print "ivy_check import time: {}s".format(elapsed)
+assert not loaded.strip(), "UI modules loaded: {}".format(loaded)
+assert float(elapsed) < budget, "startup took {}s, budget is {}s".format(elapsed,budget)
@@ -0,0 +1,34 @@
+from ivy import ivy_utils as iu
+from ivy import ivy_logic as il
+from ivy import ivy_solver as slv
+from ivy import ivy_module as im
+
+with im.Module():
+    p,q,r = [il.Symbol(n,il.RelationSort([])) for n in 'pqr']
+
+    # least recently used translations are dropped first
+    slv.set_translation_cache_size(2)
+    for f in [p,q,p,r]:
+        slv.formula_to_z3(f)
+    assert p in slv.z3_closed_formulas and r in slv.z3_closed_formulas
+    assert q not in slv.z3_closed_formulas
+    slv.set_translation_cache_size(100000)
+
+    # with hash-consing, shared subformulas are translated once
+    with iu.parameterize({'hash_cons':'true'}):
+        p,q,r = [il.Symbol(n,il.RelationSort([])) for n in 'pqr']
+        shared = il.Or(p,il.Not(q))
+        f = il.And(shared,r)
+        g = il.Implies(r,shared)
+        zf = slv.formula_to_z3(f)
+        assert shared in slv.z3_formulas
+        zs = slv.z3_formulas[shared]
+        zg = slv.formula_to_z3(g)
+        assert slv.z3_formulas[shared] is zs
+        assert any(x.eq(zs) for x in zf.children()) and any(x.eq(zs) for x in zg.children())
+
+    # without it, only whole formulas are memoized
+    slv.clear_translations()
+    shared = il.Or(p,il.Not(q))
+    slv.formula_to_z3(il.And(shared,r))
+    assert shared not in slv.z3_formulas